@@ -0,0 +1,77 @@
+"""Micro-benchmarks for schemev19.py.
+
+Run with `python benchv19.py`, set SCHEME_VALUES=immediate to measure
+the unboxed representation.
+"""
+import io
+import timeit
+from schemev19 import *         # pylint: disable=unused-wildcard-import, wildcard-import
+
+
+def read(s):
+    "Read an expression from a string."
+    return SCMRead(io.StringIO(s))
+
+
+def is_fixnum_enum(obj):
+    "Fixnum predicate as it was written before class based dispatch."
+    return obj.type == ObjectType.FIXNUM
+
+
+def is_self_evaluating_enum(exp):
+    "Self evaluating predicate as it was written before class based dispatch."
+    return (exp.type == ObjectType.BOOLEAN or
+            exp.type == ObjectType.FIXNUM or
+            exp.type == ObjectType.CHARACTER or
+            exp.type == ObjectType.STRING)
+
+
+def report(name, stmt, number=200000, **names):
+    "Print the cost of one execution of stmt."
+    seconds = min(timeit.repeat(stmt, number=number, repeat=5, globals=names))
+    seconds /= number
+    if seconds < 1e-3:
+        print("{:<40} {:>8.1f} ns".format(name, seconds * 1e9))
+    else:
+        print("{:<40} {:>8.1f} ms".format(name, seconds * 1e3))
+
+
+def bench_dispatch():
+    "Per-dispatch cost of the type predicates."
+    pair = read("(f 1 2)")
+    report("is_fixnum (enum)", "is_fixnum_enum(obj)",
+           is_fixnum_enum=is_fixnum_enum, obj=pair)
+    report("is_fixnum (class)", "is_fixnum(obj)",
+           is_fixnum=is_fixnum, obj=pair)
+    report("is_self_evaluating (enum)", "is_self_evaluating_enum(obj)",
+           is_self_evaluating_enum=is_self_evaluating_enum, obj=pair)
+    report("is_self_evaluating (class)", "is_self_evaluating(obj)",
+           is_self_evaluating=is_self_evaluating, obj=pair)
+
+
+def bench_eval():
+    "Cost of evaluating a primitive application."
+    exp = read("(+ 1 2)")
+    report("SCMEval (+ 1 2)", "SCMEval(exp, env)", number=20000,
+           SCMEval=SCMEval, exp=exp, env=SCMTheGlobalEnvironment)
+
+
+def bench_programs():
+    "Arithmetic heavy programs."
+    env = SCMTheGlobalEnvironment
+    SCMEval(read("(define (fib n) (if (< n 2) n"
+                 " (+ (fib (- n 1)) (fib (- n 2)))))"), env)
+    SCMEval(read("(define (tak x y z) (if (< y x)"
+                 " (tak (tak (- x 1) y z) (tak (- y 1) z x) (tak (- z 1) x y))"
+                 " z))"), env)
+    report("(fib 15)", "SCMEval(exp, env)", number=1,
+           SCMEval=SCMEval, exp=read("(fib 15)"), env=env)
+    report("(tak 12 8 4)", "SCMEval(exp, env)", number=1,
+           SCMEval=SCMEval, exp=read("(tak 12 8 4)"), env=env)
+
+
+if __name__ == "__main__":
+    print("value mode:", SCMValueMode)
+    bench_dispatch()
+    bench_eval()
+    bench_programs()
@@ -0,0 +1,272 @@
+"""Persistent hash array mapped trie.
+
+`PersistentMap` never changes once built, `assoc` and `dissoc` return a
+new map sharing every node not on the path to the key. `TransientMap`
+mutates the nodes it owns in place and is frozen back with `persistent`.
+Keys must be hashable.
+"""
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+# Marks a key slot whose value slot holds a child node.
+_CHILD = object()
+
+
+def _hash(key):
+    return hash(key) & HASH_MASK
+
+
+def _bit(h, shift):
+    return 1 << ((h >> shift) & MASK)
+
+
+def _index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count("1")
+
+
+class _BitmapNode:
+    """Interior node, array holds key and value slots for each bit set in
+    bitmap. edit is the token of the transient allowed to mutate it."""
+    __slots__ = ("bitmap", "array", "edit")
+
+    def __init__(self, bitmap, array, edit):
+        self.bitmap = bitmap
+        self.array = array
+        self.edit = edit
+
+    def ensure(self, edit):
+        "This node if edit owns it, otherwise a copy owned by edit."
+        if edit is not None and self.edit is edit:
+            return self
+        return _BitmapNode(self.bitmap, list(self.array), edit)
+
+    def get(self, shift, h, key, default):
+        bit = _bit(h, shift)
+        if not self.bitmap & bit:
+            return default
+        i = 2 * _index(self.bitmap, bit)
+        k, v = self.array[i], self.array[i + 1]
+        if k is _CHILD:
+            return v.get(shift + BITS, h, key, default)
+        return v if k == key else default
+
+    def assoc(self, shift, h, key, value, edit):
+        "Return the new node and whether a key was added."
+        bit = _bit(h, shift)
+        i = 2 * _index(self.bitmap, bit)
+        if not self.bitmap & bit:
+            node = self.ensure(edit)
+            node.array[i:i] = [key, value]
+            node.bitmap |= bit
+            return node, True
+        k, v = self.array[i], self.array[i + 1]
+        if k is _CHILD:
+            child, added = v.assoc(shift + BITS, h, key, value, edit)
+            if child is v:
+                return self, added
+            node = self.ensure(edit)
+            node.array[i + 1] = child
+            return node, added
+        if k == key:
+            if v is value:
+                return self, False
+            node = self.ensure(edit)
+            node.array[i + 1] = value
+            return node, False
+        node = self.ensure(edit)
+        node.array[i] = _CHILD
+        node.array[i + 1] = _make_node(shift + BITS, k, v, h, key, value, edit)
+        return node, True
+
+    def dissoc(self, shift, h, key, edit):
+        "Return the new node, None when empty, and whether key was removed."
+        bit = _bit(h, shift)
+        if not self.bitmap & bit:
+            return self, False
+        i = 2 * _index(self.bitmap, bit)
+        k, v = self.array[i], self.array[i + 1]
+        if k is _CHILD:
+            child, removed = v.dissoc(shift + BITS, h, key, edit)
+            if not removed:
+                return self, False
+            if child is not None:
+                node = self.ensure(edit)
+                node.array[i + 1] = child
+                return node, True
+        elif k != key:
+            return self, False
+        if self.bitmap == bit:
+            return None, True
+        node = self.ensure(edit)
+        del node.array[i:i + 2]
+        node.bitmap ^= bit
+        return node, True
+
+    def items(self):
+        array = self.array
+        for i in range(0, len(array), 2):
+            if array[i] is _CHILD:
+                yield from array[i + 1].items()
+            else:
+                yield array[i], array[i + 1]
+
+
+class _CollisionNode:
+    "Leaf for keys whose full hashes are equal."
+    __slots__ = ("hash", "array", "edit")
+
+    def __init__(self, h, array, edit):
+        self.hash = h
+        self.array = array
+        self.edit = edit
+
+    def ensure(self, edit):
+        if edit is not None and self.edit is edit:
+            return self
+        return _CollisionNode(self.hash, list(self.array), edit)
+
+    def find(self, key):
+        for i in range(0, len(self.array), 2):
+            if self.array[i] == key:
+                return i
+        return -1
+
+    def get(self, shift, h, key, default):
+        i = self.find(key)
+        return default if i < 0 else self.array[i + 1]
+
+    def assoc(self, shift, h, key, value, edit):
+        if h != self.hash:
+            node = _BitmapNode(_bit(self.hash, shift), [_CHILD, self], edit)
+            return node.assoc(shift, h, key, value, edit)
+        i = self.find(key)
+        node = self.ensure(edit)
+        if i < 0:
+            node.array.extend((key, value))
+            return node, True
+        node.array[i + 1] = value
+        return node, False
+
+    def dissoc(self, shift, h, key, edit):
+        i = self.find(key)
+        if i < 0:
+            return self, False
+        if len(self.array) == 2:
+            return None, True
+        node = self.ensure(edit)
+        del node.array[i:i + 2]
+        return node, True
+
+    def items(self):
+        for i in range(0, len(self.array), 2):
+            yield self.array[i], self.array[i + 1]
+
+
+def _make_node(shift, key1, value1, h2, key2, value2, edit):
+    "Node holding two keys that share a slot at the previous level."
+    h1 = _hash(key1)
+    if h1 == h2:
+        return _CollisionNode(h1, [key1, value1, key2, value2], edit)
+    node = _BitmapNode(0, [], edit)
+    node, _ = node.assoc(shift, h1, key1, value1, edit)
+    node, _ = node.assoc(shift, h2, key2, value2, edit)
+    return node
+
+
+_EMPTY = _BitmapNode(0, [], None)
+
+
+class PersistentMap:
+    "Immutable map."
+    __slots__ = ("root", "count")
+
+    def __init__(self, root=_EMPTY, count=0):
+        self.root = root
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.get(key, _CHILD) is not _CHILD
+
+    def __iter__(self):
+        return self.root.items()
+
+    def get(self, key, default=None):
+        return self.root.get(0, _hash(key), key, default)
+
+    def assoc(self, key, value):
+        "New map with key bound to value."
+        root, added = self.root.assoc(0, _hash(key), key, value, None)
+        if root is self.root:
+            return self
+        return PersistentMap(root, self.count + added)
+
+    def dissoc(self, key):
+        "New map without key."
+        root, removed = self.root.dissoc(0, _hash(key), key, None)
+        if not removed:
+            return self
+        return PersistentMap(_EMPTY if root is None else root, self.count - 1)
+
+    def transient(self):
+        "Transient copy of this map, sharing its nodes until written."
+        return TransientMap(self.root, self.count)
+
+
+class TransientMap:
+    "Map updated in place, frozen by persistent."
+    __slots__ = ("root", "count", "edit")
+
+    def __init__(self, root=_EMPTY, count=0):
+        self.root = root
+        self.count = count
+        self.edit = object()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.root.items()
+
+    def check(self):
+        if self.edit is None:
+            raise Exception("Transient used after persistent")
+
+    def get(self, key, default=None):
+        self.check()
+        return self.root.get(0, _hash(key), key, default)
+
+    def assoc(self, key, value):
+        "Bind key to value in place."
+        self.check()
+        self.root, added = self.root.assoc(0, _hash(key), key, value,
+                                           self.edit)
+        self.count += added
+        return self
+
+    def dissoc(self, key):
+        "Remove key in place."
+        self.check()
+        root, removed = self.root.dissoc(0, _hash(key), key, self.edit)
+        if removed:
+            self.root = _EMPTY if root is None else root
+            self.count -= 1
+        return self
+
+    def persistent(self):
+        "Freeze into a persistent map, the transient can not be used after."
+        self.check()
+        self.edit = None
+        return PersistentMap(self.root, self.count)
+
+
+def from_items(items):
+    "Persistent map of (key, value) pairs, built through a transient."
+    transient = TransientMap()
+    for key, value in items:
+        transient.assoc(key, value)
+    return transient.persistent()
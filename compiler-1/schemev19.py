@@ -1,6 +1,21 @@
 #!/usr/bin/env python3
+from array import array
 from enum import Enum
+from fractions import Fraction
+import itertools
+import math
+import operator as op
+import os
+import re
 import sys
+import weakref
+
+import hamt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 # Model
@@ -15,37 +30,419 @@ class ObjectType(Enum):
     SYMBOL = 7
     PRIMITIVE_PROC = 8
     COMPOUND_PROC = 9
+    VECTOR = 10
+    FLONUM = 11
+    NUMVECTOR = 12
+    BYTEVECTOR = 13
+    HASH_TABLE = 14
+    MAP = 15
+    TRANSIENT_MAP = 16
+    STRING_BUILDER = 17
+    RATIONAL = 18
+    RECORD_TYPE = 19
+    RECORD = 20
+    FRAME = 21
+    LOCAL_REF = 22
+    LAMBDA = 23
+    CELL = 24
+    GLOBAL_REF = 25
+    FREE_REF = 26
 
 
-class _ObjectValue:
-    "Private object for store value."   # TODO: redundant
+class SCMObject:
+    "Base class for scheme types."
+    __slots__ = ()
+    type = None
+
     def __init__(self, value):
         self.value = value
 
+    def __eq__(self, other):
+        return self.value == other.value
+
     def __repr__(self):
-        return str(self.value)
+        return "<Type: {}, Value: {}>".format(self.type, self.value)
 
 
-class SCMObject:
-    "Base class for scheme types."
-    def __init__(self, type_, data):
-        "type: ObjectType. data: _ObjectValue"
-        self.type = type_
-        self.data = _ObjectValue(data)
+class Fixnum(SCMObject):
+    "Integer."
+    __slots__ = ("value",)
+    type = ObjectType.FIXNUM
+
+
+class Boolean(SCMObject):
+    "Boolean, only two instances exist."
+    __slots__ = ("value",)
+    type = ObjectType.BOOLEAN
+
+    def __bool__(self):
+        return self.value
+
+
+class Character(SCMObject):
+    "Character, value is a python string of length one."
+    __slots__ = ("value",)
+    type = ObjectType.CHARACTER
+
+
+class String(SCMObject):
+    "String."
+    __slots__ = ("value", "__weakref__")
+    type = ObjectType.STRING
+
+
+class EmptyList(SCMObject):
+    "The empty list, only one instance exists."
+    __slots__ = ("value",)
+    type = ObjectType.THE_EMPTY_LIST
+
+
+class Pair(SCMObject):
+    "Pair, car and cdr are mutable in place."
+    __slots__ = ("car", "cdr")
+    type = ObjectType.PAIR
+
+    def __init__(self, car, cdr):
+        self.car = car
+        self.cdr = cdr
+
+    def __eq__(self, other):
+        return (is_pair(other) and self.car == SCMCar(other) and
+                self.cdr == SCMCdr(other))
+
+    def __repr__(self):
+        return "<Type: {}, Value: ({}, {})>".format(self.type, self.car,
+                                                    self.cdr)
+
+
+class FrozenPair(Pair):
+    """Pair made by freeze, set-car! and set-cdr! refuse it. Only frozen
+    pairs pay for a weak reference slot, for the hash consing table."""
+    __slots__ = ("__weakref__",)
+
+
+class Symbol(SCMObject):
+    """Symbol, value is the name. Symbols are interned, equal means
+    identical, gensyms and uninterned symbols differ from every other."""
+    __slots__ = ("value", "__weakref__")
+    type = ObjectType.SYMBOL
+
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+
+class PrimitiveProc(SCMObject):
+    "Primitive procedure, value is a python function."
+    __slots__ = ("value",)
+    type = ObjectType.PRIMITIVE_PROC
+
+
+class CompoundProc(SCMObject):
+    """Compound procedure.
+
+    parameters is a proper list of names, the last one receives the rest
+    arguments when rest is true. body is a single compiled expression.
+    names are the slots of its frames, the parameters then the internal
+    definitions. free holds the captured variables of a flat closure,
+    boxes the slots that get a Cell on each call.
+    """
+    __slots__ = ("parameters", "body", "env", "arity", "rest", "names",
+                 "free", "boxes", "name")
+    type = ObjectType.COMPOUND_PROC
+
+    def __init__(self, parameters, body, env, arity, rest, names, free=(),
+                 boxes=()):
+        self.parameters = parameters
+        self.body = body
+        self.env = env
+        self.arity = arity
+        self.rest = rest
+        self.names = names
+        self.free = free
+        self.boxes = boxes
+        self.name = None
+
+    def __eq__(self, other):
+        return self is other
+
+    def __repr__(self):
+        return "<Type: {}, Value: {}>".format(self.type, self.name)
+
+
+class Vector(SCMObject):
+    "Vector, value is a python list."
+    __slots__ = ("value",)
+    type = ObjectType.VECTOR
+
+
+class Flonum(SCMObject):
+    "Inexact real, value is a python float."
+    __slots__ = ("value", "__weakref__")
+    type = ObjectType.FLONUM
+
+
+class Rational(SCMObject):
+    "Exact non-integer rational, value is a fractions.Fraction."
+    __slots__ = ("value", "__weakref__")
+    type = ObjectType.RATIONAL
+
+
+class NumVector(SCMObject):
+    """Homogeneous numeric vector.
+
+    kind is "f64" or "s64", value is a numpy array when numpy is
+    installed and an array.array otherwise.
+    """
+    __slots__ = ("value", "kind")
+    type = ObjectType.NUMVECTOR
+
+    def __init__(self, value, kind):
+        self.value = value
+        self.kind = kind
+
+    def __eq__(self, other):
+        return (self.kind == other.kind and
+                self.value.tolist() == other.value.tolist())
+
+
+class Bytevector(SCMObject):
+    """Bytevector, value is a bytearray or a memoryview sharing the bytes
+    of another bytevector."""
+    __slots__ = ("value",)
+    type = ObjectType.BYTEVECTOR
+
+
+class HashTable(SCMObject):
+    """Hash table, value maps the hash key of each scheme key to a
+    (key, value) tuple. kind names the equivalence used for keys."""
+    __slots__ = ("value", "kind")
+    type = ObjectType.HASH_TABLE
+
+    def __init__(self, kind):
+        self.value = {}
+        self.kind = kind
+
+    def __eq__(self, other):
+        return self is other
+
+
+class Map(SCMObject):
+    """Persistent map, value is a hamt.PersistentMap from the equal? hash
+    key of each scheme key to a (key, value) tuple."""
+    __slots__ = ("value",)
+    type = ObjectType.MAP
+
+
+class TransientMap(SCMObject):
+    "Map builder, value is a hamt.TransientMap."
+    __slots__ = ("value",)
+    type = ObjectType.TRANSIENT_MAP
+
+
+class Rope(SCMObject):
+    """String made of two halves, each a python string or a rope. value
+    flattens it on first use and keeps the result."""
+    __slots__ = ("left", "right", "length", "depth", "flat")
+    type = ObjectType.STRING
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = len(left) + len(right)
+        self.depth = max(rope_depth(left), rope_depth(right)) + 1
+        self.flat = None
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def value(self):
+        if self.flat is None:
+            parts = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if type(node) is str:
+                    parts.append(node)
+                elif node.flat is not None:
+                    parts.append(node.flat)
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+            self.flat = "".join(parts)
+        return self.flat
+
+
+class StringBuilder(SCMObject):
+    """Mutable string buffer, value is a list of python strings joined when
+    the string is taken."""
+    __slots__ = ("value", "length")
+    type = ObjectType.STRING_BUILDER
+
+    def __init__(self):
+        self.value = []
+        self.length = 0
+
+    def __eq__(self, other):
+        return self is other
+
+
+class RecordType(SCMObject):
+    "Record type made by define-record-type, value is its Record subclass."
+    __slots__ = ("value",)
+    type = ObjectType.RECORD_TYPE
+
+
+class Record(SCMObject):
+    """Base class of the classes make_record_type generates, one slot per
+    field. name and fields are the scheme names of the type and fields."""
+    __slots__ = ()
+    type = ObjectType.RECORD
+    name = None
+    fields = ()
+
+    def __eq__(self, other):
+        return self is other
+
+    def __repr__(self):
+        return "<Type: {}, Value: {}>".format(self.type, self.name)
+
+
+class Cell(SCMObject):
+    "Binding of a global variable, value is its current value."
+    __slots__ = ("value",)
+    type = ObjectType.CELL
+
+
+class DictFrame(SCMObject):
+    """Global environment frame, value maps each symbol to its cell. A cell
+    is never replaced, so a reference holding it sees every later define
+    and set! of the variable."""
+    __slots__ = ("value",)
+    type = ObjectType.FRAME
+
+
+class Frame(SCMObject):
+    """Environment frame of a procedure call. values is a python list of
+    slots, names the symbol of each slot. Compiled code reads slots by
+    index, anything else by name. None marks a definition not yet run.
+    free is the captured variables of the procedure called."""
+    __slots__ = ("names", "values", "free")
+    type = ObjectType.FRAME
+
+    def __init__(self, names, values, free=()):
+        self.names = names
+        self.values = values
+        self.free = free
+
+    def __eq__(self, other):
+        return self.names == other.names and self.values == other.values
+
+
+class LocalRef(SCMObject):
+    """Compiled reference to a variable, slot index of the frame depth
+    frames up the environment. The slot holds a Cell if boxed."""
+    __slots__ = ("symbol", "depth", "index", "boxed")
+    type = ObjectType.LOCAL_REF
+
+    def __init__(self, symbol, depth, index, boxed=False):
+        self.symbol = symbol
+        self.depth = depth
+        self.index = index
+        self.boxed = boxed
+
+    def __eq__(self, other):
+        return (type(other) is LocalRef and self.symbol is other.symbol and
+                self.depth == other.depth and self.index == other.index and
+                self.boxed == other.boxed)
+
+    def __repr__(self):
+        return "<Type: {}, Value: {} {}:{}>".format(
+            self.type, self.symbol.value, self.depth, self.index)
+
+
+class GlobalRef(SCMObject):
+    """Compiled reference to a variable no enclosing lambda binds, looked up
+    by name past the depth frames of those lambdas. cell caches the cell
+    found there, valid while base is the environment the lookup started
+    from and version is SCMGlobalVersion."""
+    __slots__ = ("symbol", "depth", "cell", "base", "version")
+    type = ObjectType.GLOBAL_REF
+
+    def __init__(self, symbol, depth):
+        self.symbol = symbol
+        self.depth = depth
+        self.cell = None
+        self.base = None
+        self.version = -1
 
     def __eq__(self, other):
-        return self.data.value == other.data.value
+        return (type(other) is GlobalRef and self.symbol is other.symbol and
+                self.depth == other.depth)
 
     def __repr__(self):
-        return "<Type: {}, Value: {}>".format(self.type, self.data)
+        return "<Type: {}, Value: {} {}>".format(
+            self.type, self.symbol.value, self.depth)
+
+
+class FreeRef(SCMObject):
+    "Compiled reference to captured variable index of a flat closure."
+    __slots__ = ("symbol", "index", "boxed")
+    type = ObjectType.FREE_REF
+
+    def __init__(self, symbol, index, boxed):
+        self.symbol = symbol
+        self.index = index
+        self.boxed = boxed
+
+    def __eq__(self, other):
+        return (type(other) is FreeRef and self.symbol is other.symbol and
+                self.index == other.index and self.boxed == other.boxed)
+
+    def __repr__(self):
+        return "<Type: {}, Value: {} {}>".format(
+            self.type, self.symbol.value, self.index)
+
+
+class Lambda(SCMObject):
+    """Compiled lambda expression, evaluates to a compound procedure without
+    compiling its body again. names are the slots of its frames.
+
+    captures, for a lambda nested in a flat closure, tells where each of
+    its captured variables is in the frame it is made in: a slot if the
+    flag is true, otherwise a captured variable. boxes are the slots that
+    hold a Cell."""
+    __slots__ = ("parameters", "body", "names", "arity", "rest", "captures",
+                 "boxes")
+    type = ObjectType.LAMBDA
+
+    def __init__(self, parameters, body, names, arity, rest, captures=None,
+                 boxes=()):
+        self.parameters = parameters
+        self.body = body
+        self.names = names
+        self.arity = arity
+        self.rest = rest
+        self.captures = captures
+        self.boxes = boxes
+
+    def __eq__(self, other):
+        return self is other
+
 
 # FIXME: Re-factoring to user better var name.
 # Global
-SCMTheEmptyList = SCMObject(ObjectType.THE_EMPTY_LIST, None)
-SCMTrue = SCMObject(ObjectType.BOOLEAN, True)
-SCMFalse = SCMObject(ObjectType.BOOLEAN, False)
-SCMSymbolTable = SCMTheEmptyList  # TODO: default dict
+SCMTheEmptyList = EmptyList(None)
+SCMTrue = Boolean(True)
+SCMFalse = Boolean(False)
+# Symbol name to the interned symbol. Symbols nothing else refers to are
+# dropped, a later make_symbol of the name interns a new one.
+SCMSymbolTable = weakref.WeakValueDictionary()
+SCMGensymCounter = itertools.count(1)
 SCMTheEmptyEnvironment = SCMTheEmptyList
+# Bumped whenever a binding is added that could shadow a cell a GlobalRef
+# has cached.
+SCMGlobalVersion = 0
 
 
 def is_the_empty_list(obj):
@@ -55,7 +452,7 @@ def is_the_empty_list(obj):
 
 def is_boolean(obj):
     "Boolean predicates."
-    return obj.type == ObjectType.BOOLEAN
+    return type(obj) is Boolean
 
 
 def is_false(obj):
@@ -69,308 +466,2092 @@ def is_true(obj):
 
 
 def SCMCons(car, cdr):
-    return SCMObject(ObjectType.PAIR, (car, cdr))
+    return Pair(car, cdr)
 
 
 def is_symbol(obj):
-    return obj.type == ObjectType.SYMBOL
+    return type(obj) is Symbol
+
+
+# Fixnums in [SCMFixnumCacheMin, SCMFixnumCacheMax] are shared, they must
+# never be mutated. Each is made on first use, as characters are.
+SCMFixnumCacheMin = -1024
+SCMFixnumCacheMax = 65535
+SCMFixnumCache = []
+SCMFixnumStats = {"hits": 0, "allocations": 0}
+
+
+def set_fixnum_cache_range(low, high):
+    "Share the fixnums from low to high, inclusive."
+    global SCMFixnumCacheMin, SCMFixnumCacheMax, SCMFixnumCache
+    SCMFixnumCacheMin = low
+    SCMFixnumCacheMax = high
+    SCMFixnumCache = [None] * (high - low + 1)
+    reset_fixnum_stats()
+
+
+def reset_fixnum_stats():
+    "Reset the fixnum allocation counters."
+    SCMFixnumStats["hits"] = 0
+    SCMFixnumStats["allocations"] = 0
+
+
+def fixnum_hit_rate():
+    "Fraction of make_fixnum calls in the shared range, if counted."
+    total = SCMFixnumStats["hits"] + SCMFixnumStats["allocations"]
+    return SCMFixnumStats["hits"] / total if total else 0.0
 
 
 def make_fixnum(value):
-    return SCMObject(ObjectType.FIXNUM, value)
+    if SCMFixnumCacheMin <= value <= SCMFixnumCacheMax:
+        obj = SCMFixnumCache[value - SCMFixnumCacheMin]
+        if obj is None:
+            obj = SCMFixnumCache[value - SCMFixnumCacheMin] = Fixnum(value)
+        return obj
+    return Fixnum(value)
+
+
+# SCHEME_FIXNUM_STATS=1 counts the calls of make_fixnum in SCMFixnumStats.
+# Off by default, the counters are writes on the hottest allocation path.
+SCMFixnumStatsMode = os.environ.get("SCHEME_FIXNUM_STATS", "0")
+if SCMFixnumStatsMode == "1":
+    def make_fixnum(value):
+        if SCMFixnumCacheMin <= value <= SCMFixnumCacheMax:
+            SCMFixnumStats["hits"] += 1
+            obj = SCMFixnumCache[value - SCMFixnumCacheMin]
+            if obj is None:
+                obj = SCMFixnumCache[value - SCMFixnumCacheMin] = \
+                    Fixnum(value)
+            return obj
+        SCMFixnumStats["allocations"] += 1
+        return Fixnum(value)
+elif SCMFixnumStatsMode != "0":
+    raise Exception("Unknown fixnum stats mode '{}'".format(
+        SCMFixnumStatsMode))
+
+
+set_fixnum_cache_range(SCMFixnumCacheMin, SCMFixnumCacheMax)
 
 
 def is_fixnum(obj):
-    return obj.type == ObjectType.FIXNUM
+    return type(obj) is Fixnum
+
+
+def fixnum_value(obj):
+    "The python integer of a fixnum."
+    if type(obj) is not Fixnum:
+        raise Exception("Expected an exact integer")
+    return obj.value
+
+
+# Characters are interned: a flat table indexed by code point covers the
+# BMP (Latin-1 is preallocated, the rest is filled on first use), and a
+# dict holds the few characters above it.
+SCMCharacterTable = [None] * 0x10000
+SCMCharacterTableAstral = {}
 
 
 def make_character(value):
-    return SCMObject(ObjectType.CHARACTER, value)
+    code = ord(value)
+    if code < 0x10000:
+        obj = SCMCharacterTable[code]
+        if obj is None:
+            obj = SCMCharacterTable[code] = Character(value)
+        return obj
+    obj = SCMCharacterTableAstral.get(code)
+    if obj is None:
+        obj = SCMCharacterTableAstral[code] = Character(value)
+    return obj
+
+
+for _code in range(0x100):
+    make_character(chr(_code))
 
 
 def is_character(obj):
-    return obj.type == ObjectType.CHARACTER
+    return type(obj) is Character
 
 
 def make_string(value):
-    return SCMObject(ObjectType.STRING, value)
+    return String(value)
 
 
 def is_string(obj):
-    return obj.type == ObjectType.STRING
+    return type(obj) is String or type(obj) is Rope
 
 
 def is_pair(obj):
-    return obj.type == ObjectType.PAIR
+    return type(obj) is Pair or type(obj) is FrozenPair
 
 
 def SCMCar(obj):
-    car, _ = obj.data.value
-    return car
+    return obj.car
 
 
 def SCMSetCar(obj, car):
-    _, cdr = obj.data.value
-    obj.data.value = (car, cdr)
+    obj.car = car
     return
 
 
 def SCMCdr(obj):
-    _, cdr = obj.data.value
-    return cdr
+    return obj.cdr
 
 
-def make_primitive_proc(fn):
-    return SCMObject(ObjectType.PRIMITIVE_PROC, fn)
+def SCMSetCdr(obj, cdr):
+    obj.cdr = cdr
+    return
 
 
-def make_symbol(value):
-    global SCMSymbolTable
-    element = SCMSymbolTable
-    while not is_the_empty_list(element):
-        if SCMCar(element).data.value == value:
-            return SCMCar(element)
+def scheme_references(obj):
+    "The values obj holds, python lists and tuples are expanded by callers."
+    cls = type(obj)
+    if cls is Pair or cls is FrozenPair:
+        return (obj.car, obj.cdr)
+    elif cls is Vector:
+        return obj.value
+    elif cls is Cell:
+        return (obj.value,)
+    elif cls is DictFrame or cls is HashTable:
+        return list(obj.value.values())
+    elif cls is Map or cls is TransientMap:
+        return [item for _, item in obj.value]
+    elif cls is Frame:
+        return (obj.values, obj.free)
+    elif cls is CompoundProc:
+        return (obj.parameters, obj.body, obj.env, obj.free)
+    elif cls is Lambda:
+        return (obj.parameters, obj.body)
+    elif cls is GlobalRef:
+        return (obj.cell, obj.base)
+    elif isinstance(obj, Record):
+        return [getattr(obj, slot, None) for slot in cls.__slots__]
+    return ()
+
+
+class ConsHeap:
+    """Pairs stored column-wise and referenced by integer handles.
+
+    Each cell of `cars` and `cdrs` is a tagged integer: a pair handle, a
+    fixnum immediate, or an index into `objects` for everything else.
+    collect frees the pairs no root reaches, cons reuses them from `free`.
+    Only data goes in the heap, environments and argument lists the
+    interpreter makes on every call are Pair objects, see SCMConsObject.
+    """
+    PAIR_TAG = 0
+    FIXNUM_TAG = 1
+    OBJECT_TAG = 2
+    IMMEDIATE_LIMIT = 1 << 60
+
+    def __init__(self):
+        self.cars = array("q")
+        self.cdrs = array("q")
+        self.objects = []
+        self.object_index = {}
+        self.free = []
+
+    def encode(self, obj):
+        "Encode obj as a tagged cell."
+        if type(obj) is int:
+            return obj << 2
+        elif (type(obj) is Fixnum and
+              -self.IMMEDIATE_LIMIT <= obj.value < self.IMMEDIATE_LIMIT):
+            return obj.value << 2 | self.FIXNUM_TAG
+        index = self.object_index.get(id(obj))
+        if index is None:
+            index = len(self.objects)
+            self.objects.append(obj)
+            self.object_index[id(obj)] = index
+        return index << 2 | self.OBJECT_TAG
+
+    def decode(self, cell):
+        "Decode a tagged cell."
+        tag = cell & 3
+        if tag == self.PAIR_TAG:
+            return cell >> 2
+        elif tag == self.FIXNUM_TAG:
+            return make_fixnum(cell >> 2)
+        else:
+            return self.objects[cell >> 2]
+
+    def cons(self, car, cdr):
+        "Allocate a pair, a freed one if any, return its handle."
+        if self.free:
+            handle = self.free.pop()
+            self.cars[handle] = self.encode(car)
+            self.cdrs[handle] = self.encode(cdr)
+            return handle
+        handle = len(self.cars)
+        self.cars.append(self.encode(car))
+        self.cdrs.append(self.encode(cdr))
+        return handle
+
+    def collect(self, roots):
+        """Free the pairs roots do not reach and the objects only they
+        hold, return the set of freed handles. A handle held by python code
+        alone is not seen, collect between evaluations."""
+        live = bytearray(len(self.cars))
+        seen = set()
+        stack = list(roots)
+        while stack:
+            obj = stack.pop()
+            cls = type(obj)
+            if cls is int:
+                if not live[obj]:
+                    live[obj] = 1
+                    for cell in (self.cars[obj], self.cdrs[obj]):
+                        tag = cell & 3
+                        if tag == self.PAIR_TAG:
+                            stack.append(cell >> 2)
+                        elif tag == self.OBJECT_TAG:
+                            stack.append(self.objects[cell >> 2])
+            elif cls is list or cls is tuple:
+                stack.extend(obj)
+            elif id(obj) not in seen:
+                seen.add(id(obj))
+                stack.extend(scheme_references(obj))
+        freed = {handle for handle in range(len(live)) if not live[handle]}
+        size = len(live)
+        while size and not live[size - 1]:
+            size -= 1
+        del self.cars[size:]
+        del self.cdrs[size:]
+        objects = []
+        moved = {}
+        for handle in range(size):
+            if not live[handle]:
+                self.cars[handle] = self.cdrs[handle] = 0
+                continue
+            for cells in (self.cars, self.cdrs):
+                cell = cells[handle]
+                if cell & 3 == self.OBJECT_TAG:
+                    index = moved.get(cell >> 2)
+                    if index is None:
+                        index = moved[cell >> 2] = len(objects)
+                        objects.append(self.objects[cell >> 2])
+                    cells[handle] = index << 2 | self.OBJECT_TAG
+        self.objects = objects
+        self.object_index = {id(obj): index
+                             for index, obj in enumerate(objects)}
+        self.free = [handle for handle in range(size - 1, -1, -1)
+                     if not live[handle]]
+        return freed
+
+    def car(self, handle):
+        return self.decode(self.cars[handle])
+
+    def cdr(self, handle):
+        return self.decode(self.cdrs[handle])
+
+    def set_car(self, handle, car):
+        self.cars[handle] = self.encode(car)
+
+    def set_cdr(self, handle, cdr):
+        self.cdrs[handle] = self.encode(cdr)
+
+
+# Environments and argument lists are made on every procedure call and
+# dropped when it returns. They are always Pair objects, so python frees
+# them, and never go in a ConsHeap. An argument list that outlives the
+# call, as the value of list or the rest arguments, goes through data_list.
+SCMConsObject = Pair
+
+
+def data_list(arguments):
+    "Argument list kept as data."
+    return arguments
+
+# SCHEME_HEAP=soa stores every other pair in a ConsHeap. Those pairs are
+# plain integer handles, which SCMCons, SCMCar, SCMCdr and SCMWrite accept
+# transparently, next to the Pair objects of SCMConsObject.
+SCMHeapMode = os.environ.get("SCHEME_HEAP", "object")
+if SCMHeapMode == "soa":
+    SCMHeap = ConsHeap()
+
+    def is_pair(obj):
+        return type(obj) is int or type(obj) is Pair
+
+    def SCMCar(obj):
+        if type(obj) is Pair:
+            return obj.car
+        return SCMHeap.car(obj)
+
+    def SCMCdr(obj):
+        if type(obj) is Pair:
+            return obj.cdr
+        return SCMHeap.cdr(obj)
+
+    def SCMSetCar(obj, car):
+        if type(obj) is Pair:
+            obj.car = car
         else:
-            element = SCMCdr(element)
+            SCMHeap.set_car(obj, car)
+
+    def SCMSetCdr(obj, cdr):
+        if type(obj) is Pair:
+            obj.cdr = cdr
+        else:
+            SCMHeap.set_cdr(obj, cdr)
+
+    SCMCons = SCMHeap.cons
 
-    obj = SCMObject(ObjectType.SYMBOL, value)
-    SCMSymbolTable = SCMCons(obj, SCMSymbolTable)
+    def data_list(arguments):
+        """Argument list kept as data, its leading Pair objects copied to
+        the heap. The tail after them already is in the heap."""
+        items = []
+        while type(arguments) is Pair:
+            items.append(arguments.car)
+            arguments = arguments.cdr
+        for item in reversed(items):
+            arguments = SCMCons(item, arguments)
+        return arguments
+elif SCMHeapMode != "object":
+    raise Exception("Unknown heap mode '{}'".format(SCMHeapMode))
+
+
+def make_vector(items):
+    return Vector(items)
+
+
+def is_vector(obj):
+    return type(obj) is Vector
+
+
+def make_flonum(value):
+    return Flonum(value)
+
+
+def is_flonum(obj):
+    return type(obj) is Flonum
+
+
+def is_rational(obj):
+    return type(obj) is Rational
+
+
+def make_number(value):
+    """Scheme number of a python int, float or Fraction. Fractions with a
+    denominator of one become fixnums."""
+    cls = type(value)
+    if cls is int:
+        return make_fixnum(value)
+    elif cls is float:
+        return make_flonum(value)
+    elif value.denominator == 1:
+        return make_fixnum(value.numerator)
+    return Rational(value)
+
+
+def number_to_text(value):
+    "External representation of a python int, float or Fraction."
+    if type(value) is float:
+        if math.isnan(value):
+            return "+nan.0"
+        elif math.isinf(value):
+            return "+inf.0" if value > 0 else "-inf.0"
+        return repr(value)
+    return str(value)
+
+
+def is_number(obj):
+    return is_fixnum(obj) or type(obj) is Flonum or type(obj) is Rational
+
+
+def number_value(obj):
+    "The python number of a fixnum, flonum or rational."
+    cls = type(obj)
+    if cls is Fixnum or cls is Flonum or cls is Rational:
+        return obj.value
+    raise Exception("Expected a number")
+
+
+# Homogeneous vectors: array.array typecode, numpy dtype and the
+# constructor of one element for each kind.
+SCMNumVectorKinds = {
+    "f64": ("d", "float64", lambda x: make_flonum(float(x))),
+    "s64": ("q", "int64", lambda x: make_fixnum(int(x))),
+}
+
+
+def make_numvector(kind, items):
+    "Make a homogeneous vector of kind from python numbers."
+    typecode, dtype, _ = SCMNumVectorKinds[kind]
+    if numpy is not None:
+        return NumVector(numpy.asarray(items, dtype=dtype), kind)
+    return NumVector(array(typecode, items), kind)
+
+
+def is_numvector(obj):
+    return type(obj) is NumVector
+
+
+def make_bytevector(value):
+    return Bytevector(value)
+
+
+def is_bytevector(obj):
+    return type(obj) is Bytevector
+
+
+def make_primitive_proc(fn):
+    return PrimitiveProc(fn)
+
+
+def make_symbol(value):
+    obj = SCMSymbolTable.get(value)
+    if obj is None:
+        obj = SCMSymbolTable[value] = Symbol(value)
     return obj
 
 
+def symbol_count():
+    "Number of interned symbols."
+    return len(SCMSymbolTable)
+
+
+def interned_symbols():
+    "Iterate over the interned symbols."
+    return iter(list(SCMSymbolTable.values()))
+
+
+def make_uninterned_symbol(value):
+    "Symbol that is not in the table, eq? only to itself."
+    return Symbol(value)
+
+
+def is_interned(obj):
+    return SCMSymbolTable.get(obj.value) is obj
+
+
+def gensym(prefix="g"):
+    "Fresh uninterned symbol."
+    return make_uninterned_symbol("{}{}".format(prefix,
+                                                next(SCMGensymCounter)))
+
+
 def make_compound_proc(parameters, body, env):
     "Make a compound procedure."
+    return make_closure(flatten_lambda(compile_lambda(parameters, body, ())),
+                        env)
+
+
+def make_closure(lambda_, env):
+    """Compound procedure of a compiled lambda. A flat closure keeps the
+    variables it captures, not the frame it is made in."""
+    if lambda_.captures is None:
+        return CompoundProc(lambda_.parameters, lambda_.body, env,
+                            lambda_.arity, lambda_.rest, lambda_.names,
+                            (), lambda_.boxes)
+    frame = SCMCar(env)
+    free = tuple(frame.values[index] if local else frame.free[index]
+                 for local, index in lambda_.captures)
+    return CompoundProc(lambda_.parameters, lambda_.body, SCMCdr(env),
+                        lambda_.arity, lambda_.rest, lambda_.names,
+                        free, lambda_.boxes)
+
+
+def procedure_arguments(procedure, arguments):
+    """Check the number of arguments, return the slots of a frame: the
+    arguments, the list of rest arguments and unassigned definitions."""
+    values = []
+    for _ in range(procedure.arity):
+        if not is_pair(arguments):
+            break
+        values.append(SCMCar(arguments))
+        arguments = SCMCdr(arguments)
+    if len(values) < procedure.arity or \
+       (not procedure.rest and not is_the_empty_list(arguments)):
+        raise Exception("Procedure '{}' expects {} arguments".format(
+            procedure.name, procedure.arity))
+    if procedure.rest:
+        values.append(data_list(arguments))
+    if len(values) < len(procedure.names):
+        values.extend([None] * (len(procedure.names) - len(values)))
+    return values
+
+
+
+def is_primitive_proc(obj):
+    return type(obj) is PrimitiveProc
+
+
+# Primitive Procedures
+#
+# Arithmetic operations
+#
+# Fixnums are added in a loop of their own. From the first other argument
+# on, number_fold takes over, python promotes mixed operands and
+# number_value refuses anything that is not a number.
+def add_proc(arguments):
+    """Add numbers from arguments."""
+    result = 0
+    while not is_the_empty_list(arguments):
+        obj = SCMCar(arguments)
+        if type(obj) is not Fixnum:
+            return number_fold(op.add, result, arguments)
+        result += obj.value
+        arguments = SCMCdr(arguments)
+    return make_fixnum(result)
+
+
+def sub_proc(arguments):
+    """Subtraction."""
+    # TODO: reduce after implement scheme pair as list.
+    result = number_value(SCMCar(arguments))
+    arguments = SCMCdr(arguments)
+    while not is_the_empty_list(arguments):
+        obj = SCMCar(arguments)
+        if type(obj) is not Fixnum:
+            return number_fold(op.sub, result, arguments)
+        result -= obj.value
+        arguments = SCMCdr(arguments)
+    return make_fixnum(result) if type(result) is int else make_number(result)
+
+
+def mul_proc(arguments):
+    """Multiplication."""
+    result = 1
+    while not is_the_empty_list(arguments):
+        obj = SCMCar(arguments)
+        if type(obj) is not Fixnum:
+            return number_fold(op.mul, result, arguments)
+        result *= obj.value
+        arguments = SCMCdr(arguments)
+    return make_fixnum(result)
+
+
+def number_fold(function, result, arguments):
+    "Fold the numbers of arguments into the python number result."
+    while not is_the_empty_list(arguments):
+        result = function(result, number_value(SCMCar(arguments)))
+        arguments = SCMCdr(arguments)
+    return make_number(result)
+
+
+def divide(num1, num2):
+    "Quotient of two python numbers, exact unless one of them is a float."
+    if num2 == 0:
+        raise Exception("Division by zero")
+    if type(num1) is float or type(num2) is float:
+        return num1 / num2
+    return Fraction(num1) / num2
+
+
+def div_proc(arguments):
+    """Division, with one argument its reciprocal."""
+    rest = SCMCdr(arguments)
+    if is_the_empty_list(rest):
+        return make_number(divide(1, number_value(SCMCar(arguments))))
+    return number_fold(divide, number_value(SCMCar(arguments)), rest)
+
+
+def integer_value(obj):
+    "The python number of an integer, a fixnum or an integral flonum."
+    value = number_value(obj)
+    if type(value) is int or (type(value) is float and value.is_integer()):
+        return value
+    raise Exception("Expected an integer")
+
+
+def integer_division(function):
+    """Primitive applying function to two integers, inexact if one of them
+    is."""
+    def proc(arguments):
+        num1 = integer_value(SCMCar(arguments))
+        num2 = integer_value(SCMCar(SCMCdr(arguments)))
+        if num2 == 0:
+            raise Exception("Division by zero")
+        return make_number(function(num1, num2))
+    return proc
+
+
+quotient_proc = integer_division(op.floordiv)
+remainder_proc = integer_division(op.mod)
+
+
+def is_number_proc(arguments):
+    """Number predicate."""
+    return SCMTrue if is_number(SCMCar(arguments)) else SCMFalse
+
+
+def is_exact_proc(arguments):
+    """Is the number exact?"""
+    value = number_value(SCMCar(arguments))
+    return SCMFalse if type(value) is float else SCMTrue
+
+
+def is_inexact_proc(arguments):
+    """Is the number inexact?"""
+    value = number_value(SCMCar(arguments))
+    return SCMTrue if type(value) is float else SCMFalse
+
+
+def exact_to_inexact_proc(arguments):
+    """Flonum closest to the number."""
+    return make_flonum(float(number_value(SCMCar(arguments))))
+
+
+def inexact_to_exact_proc(arguments):
+    """Exact number equal to the number."""
+    value = number_value(SCMCar(arguments))
+    if type(value) is float:
+        if not math.isfinite(value):
+            raise Exception("No exact value for {}".format(value))
+        value = Fraction(value)
+    return make_number(value)
+
+
+def rounding_proc(function):
+    "Primitive rounding a number with function, keeping its exactness."
+    def proc(arguments):
+        value = number_value(SCMCar(arguments))
+        if type(value) is float:
+            return make_flonum(float(function(value)))
+        return make_number(function(value))
+    return proc
+
+
+floor_proc = rounding_proc(math.floor)
+ceiling_proc = rounding_proc(math.ceil)
+truncate_proc = rounding_proc(math.trunc)
+# round on floats and Fractions rounds halves to even, as scheme does.
+round_proc = rounding_proc(round)
+
+
+def exact_sqrt(value):
+    "Exact square root of a non-negative int or Fraction, None if inexact."
+    numerator, denominator = value.numerator, value.denominator
+    root1, root2 = math.isqrt(numerator), math.isqrt(denominator)
+    if root1 * root1 == numerator and root2 * root2 == denominator:
+        return Fraction(root1, root2)
+    return None
+
+
+def sqrt_proc(arguments):
+    """Square root, exact for exact squares."""
+    value = number_value(SCMCar(arguments))
+    if value < 0:
+        raise Exception("Square root of negative number {}".format(value))
+    if type(value) is not float:
+        root = exact_sqrt(value)
+        if root is not None:
+            return make_number(root)
+    return make_flonum(math.sqrt(value))
+
+
+def expt_proc(arguments):
+    """base raised to the power exponent, exact for exact base and integer
+    exponent."""
+    base = number_value(SCMCar(arguments))
+    exponent = number_value(SCMCar(SCMCdr(arguments)))
+    if exponent < 0 and base == 0:
+        raise Exception("Division by zero")
+    if type(exponent) is int and type(base) is not float:
+        return make_number(Fraction(base) ** exponent)
+    if base < 0 and type(exponent) is not int and exponent != int(exponent):
+        raise Exception("Complex result of expt {} {}".format(base, exponent))
+    return make_flonum(float(base) ** float(exponent))
+
+
+
+# Primitive comparison
+def is_number_equal_proc(arguments):
+    """Compare two numbers, if equal returns true."""
+    value = number_value(SCMCar(arguments))
+    while not is_the_empty_list(SCMCdr(arguments)):
+        if value != number_value(SCMCar(SCMCdr(arguments))):
+            return SCMFalse
+        arguments = SCMCdr(arguments)
+    return SCMTrue
+
+
+def is_less_then_proc(arguments):
+    """If arguments is decreasing then returns true."""
+    previous = number_value(SCMCar(arguments))
+    next_ = None
+    while not is_the_empty_list(SCMCdr(arguments)):
+        next_ = number_value(SCMCar(SCMCdr(arguments)))
+        arguments = SCMCdr(arguments)
+        if previous < next_:
+            previous = next_
+        else:
+            return SCMFalse
+    return SCMTrue
+
+
+def is_greater_then_proc(arguments):
+    """If arguments is increasing then returns false."""
+    previous = number_value(SCMCar(arguments))
+    next_ = None
+    while not is_the_empty_list(SCMCdr(arguments)):
+        next_ = number_value(SCMCar(SCMCdr(arguments)))
+        arguments = SCMCdr(arguments)
+        if previous > next_:
+            previous = next_
+        else:
+            return SCMFalse
+    return SCMTrue
+
+
+# Type predicates
+def is_null_proc(arguments):
+    """Null predicate."""
+    return SCMTrue if is_the_empty_list(SCMCar(arguments)) else SCMFalse
+
+
+def is_boolean_proc(arguments):
+    """Boolean predicate."""
+    return SCMTrue if is_boolean(SCMCar(arguments)) else SCMFalse
+
+
+def is_symbol_proc(arguments):
+    """Symbol predicate."""
+    return SCMTrue if is_symbol(SCMCar(arguments)) else SCMFalse
+
+
+def is_integer_proc(arguments):
+    """Integer predicate, true for integral flonums too."""
+    obj = SCMCar(arguments)
+    if is_fixnum(obj) or (is_flonum(obj) and obj.value.is_integer()):
+        return SCMTrue
+    return SCMFalse
+
+
+def is_char_proc(arguments):
+    """Character predicate."""
+    return SCMTrue if is_character(SCMCar(arguments)) else SCMFalse
+
+
+def is_string_proc(arguments):
+    """String predicate."""
+    return SCMTrue if is_string(SCMCar(arguments)) else SCMFalse
+
+
+def is_pair_proc(arguments):
+    """Pair predicate."""
+    return SCMTrue if is_pair(SCMCar(arguments)) else SCMFalse
+
+
+def is_compound_proc(obj):
+    "Compound procedure predicate."
+    return type(obj) is CompoundProc
+
+
+def is_procedure_proc(arguments):        # TODO: Untested
+    """Procedure predicate."""
+    obj = SCMCar(arguments)
+    return SCMTrue if is_primitive_proc(obj) or is_compound_proc(obj) else \
+        SCMFalse
+
+
+# List procedures
+def cons_proc(arguments):
+    """Cons procedure."""
+    return SCMCons(SCMCar(arguments),
+                   SCMCar(SCMCdr(arguments)))
+
+
+def car_proc(arguments):
+    """Car procedure."""
+    return SCMCar(SCMCar(arguments))
+
+
+def cdr_proc(arguments):
+    """Cdr procedure."""
+    return SCMCdr(SCMCar(arguments))
+
+
+def set_car_proc(arguments):
+    """Set car procedure."""
+    SCMSetCar(mutable_pair(SCMCar(arguments)), SCMCar(SCMCdr(arguments)))
+    return SCMOkSymbol
+
+def set_cdr_proc(arguments):
+    """Set cdr procedure."""
+    SCMSetCdr(mutable_pair(SCMCar(arguments)), SCMCar(SCMCdr(arguments)))
+    return SCMOkSymbol
+
+
+def list_proc(arguments):
+    """List procedure."""
+    return data_list(arguments)
+
+
+def list_to_pylist(obj):
+    "Python list of the elements of a scheme list."
+    items = []
+    while not is_the_empty_list(obj):
+        items.append(SCMCar(obj))
+        obj = SCMCdr(obj)
+    return items
+
+
+def pylist_to_list(items):
+    "Scheme list of the elements of a python sequence."
+    obj = SCMTheEmptyList
+    for item in reversed(items):
+        obj = SCMCons(item, obj)
+    return obj
+
+
+# Comparison
+def is_eq(obj1, obj2):
+    "Identity, python ints (immediate fixnums, pair handles) by value."
+    return obj1 is obj2 or (type(obj1) is int and type(obj2) is int and
+                            obj1 == obj2)
+
+
+def is_eqv(obj1, obj2):
+    "eq?, or numbers of the same exactness and value."
+    if is_eq(obj1, obj2):
+        return True
+    cls = type(obj1)
+    if cls is not type(obj2):
+        return False
+    elif cls is Fixnum or cls is Rational:
+        return obj1.value == obj2.value
+    elif cls is Flonum:
+        return obj1.value.hex() == obj2.value.hex()
+    return False
+
+
+def is_equal(obj1, obj2):
+    """Structural equality. Iterative, and safe on circular data as a pair
+    of nodes already being compared is assumed equal."""
+    stack = [(obj1, obj2)]
+    seen = set()
+    while stack:
+        obj1, obj2 = stack.pop()
+        if is_eqv(obj1, obj2):
+            continue
+        if is_pair(obj1) and is_pair(obj2):
+            key = (canonical_identity(obj1), canonical_identity(obj2))
+            if key not in seen:
+                seen.add(key)
+                stack.append((SCMCdr(obj1), SCMCdr(obj2)))
+                stack.append((SCMCar(obj1), SCMCar(obj2)))
+        elif is_string(obj1) and is_string(obj2):
+            s1, s2 = obj1.value, obj2.value
+            # str caches its hash, unequal hashes settle it without a scan.
+            if hash(s1) != hash(s2) or s1 != s2:
+                return False
+        elif type(obj1) is not type(obj2):
+            return False
+        elif type(obj1) is Vector:
+            if len(obj1.value) != len(obj2.value):
+                return False
+            key = (id(obj1), id(obj2))
+            if key not in seen:
+                seen.add(key)
+                stack.extend(zip(reversed(obj1.value), reversed(obj2.value)))
+        elif type(obj1) is Bytevector:
+            if obj1.value != obj2.value:
+                return False
+        elif type(obj1) is NumVector:
+            if obj1.kind != obj2.kind or obj1 != obj2:
+                return False
+        else:
+            return False
+    return True
+
+
+def is_eq_proc(arguments):
+    """Identity."""
+    obj1 = SCMCar(arguments)
+    obj2 = SCMCar(SCMCdr(arguments))
+    return SCMTrue if is_eq(obj1, obj2) else SCMFalse
+
+
+def is_eqv_proc(arguments):
+    """Identity, numbers by value."""
+    obj1 = SCMCar(arguments)
+    obj2 = SCMCar(SCMCdr(arguments))
+    return SCMTrue if is_eqv(obj1, obj2) else SCMFalse
+
+
+def is_equal_proc(arguments):
+    """Structural equality."""
+    obj1 = SCMCar(arguments)
+    obj2 = SCMCar(SCMCdr(arguments))
+    return SCMTrue if is_equal(obj1, obj2) else SCMFalse
+
+
+def apply_proc(_):
+    "Apply primitive procedure."
+    raise Exception(
+        "Illegal state: The body of the apply primitive procedure should not execute")
+
+
+# Vector procedures
+def vector_index(vector, k):
+    "Check k is a valid index of vector."
+    if not is_fixnum(k):
+        raise Exception("Index must be an exact integer")
+    k = fixnum_value(k)
+    if not 0 <= k < len(vector.value):
+        raise Exception("Index {} out of range".format(k))
+    return k
+
+
+def is_vector_proc(arguments):
+    """Vector predicate."""
+    return SCMTrue if is_vector(SCMCar(arguments)) else SCMFalse
+
+
+def make_vector_proc(arguments):
+    """Make a vector of k elements, filled with fill or 0."""
+    k = fixnum_value(SCMCar(arguments))
+    rest = SCMCdr(arguments)
+    fill = make_fixnum(0) if is_the_empty_list(rest) else SCMCar(rest)
+    return make_vector([fill] * k)
+
+
+def vector_proc(arguments):
+    """Vector of the arguments."""
+    return make_vector(list_to_pylist(arguments))
+
+
+def vector_ref_proc(arguments):
+    """Element k of a vector."""
+    vector = SCMCar(arguments)
+    return vector.value[vector_index(vector, SCMCar(SCMCdr(arguments)))]
+
+
+def vector_set_proc(arguments):
+    """Set element k of a vector."""
+    vector = SCMCar(arguments)
+    k = vector_index(vector, SCMCar(SCMCdr(arguments)))
+    vector.value[k] = SCMCar(SCMCdr(SCMCdr(arguments)))
+    return SCMOkSymbol
+
+
+def vector_length_proc(arguments):
+    """Number of elements of a vector."""
+    return make_fixnum(len(SCMCar(arguments).value))
+
+
+def vector_to_list_proc(arguments):
+    """List of the elements of a vector."""
+    return pylist_to_list(SCMCar(arguments).value)
+
+
+def list_to_vector_proc(arguments):
+    """Vector of the elements of a list."""
+    return make_vector(list_to_pylist(SCMCar(arguments)))
+
+
+def vector_fill_proc(arguments):
+    """Set every element of a vector."""
+    vector = SCMCar(arguments)
+    vector.value[:] = [SCMCar(SCMCdr(arguments))] * len(vector.value)
+    return SCMOkSymbol
+
+
+def vector_map_proc(arguments):
+    """Apply a procedure to the elements of vectors, returns a vector."""
+    procedure = SCMCar(arguments)
+    vectors = [vector.value for vector in list_to_pylist(SCMCdr(arguments))]
+    return make_vector([apply_procedure(procedure, pylist_to_list(items))
+                        for items in zip(*vectors)])
+
+
+# Homogeneous vector procedures
+def numvector_element(vector, x):
+    "Box the python number x read from vector."
+    return SCMNumVectorKinds[vector.kind][2](x)
+
+
+def numvector_like(vector, items):
+    "A new vector of the same kind as vector."
+    return make_numvector(vector.kind, items)
+
+
+def numvector_operands(arguments):
+    "Two vectors of the same kind and length."
+    vector1 = SCMCar(arguments)
+    vector2 = SCMCar(SCMCdr(arguments))
+    if vector1.kind != vector2.kind or \
+       len(vector1.value) != len(vector2.value):
+        raise Exception("Vectors of different kinds or lengths")
+    return vector1.value, vector2.value
+
+
+def make_numvector_proc(kind):
+    "make-f64vector and friends: k elements filled with fill or 0."
+    def proc(arguments):
+        k = fixnum_value(SCMCar(arguments))
+        rest = SCMCdr(arguments)
+        fill = 0 if is_the_empty_list(rest) else number_value(SCMCar(rest))
+        return make_numvector(kind, [fill] * k)
+    return proc
+
+
+def numvector_proc(kind):
+    "f64vector and friends: a vector of the arguments."
+    def proc(arguments):
+        return make_numvector(kind, [number_value(item) for item in
+                                     list_to_pylist(arguments)])
+    return proc
+
+
+def list_to_numvector_proc(kind):
+    "list->f64vector and friends."
+    def proc(arguments):
+        return make_numvector(kind, [number_value(item) for item in
+                                     list_to_pylist(SCMCar(arguments))])
+    return proc
+
+
+def is_numvector_proc(kind):
+    "f64vector? and friends."
+    def proc(arguments):
+        obj = SCMCar(arguments)
+        return SCMTrue if is_numvector(obj) and obj.kind == kind else SCMFalse
+    return proc
+
+
+SCMNumVectorConstructors = {
+    kind: (is_numvector_proc(kind), make_numvector_proc(kind),
+           numvector_proc(kind), list_to_numvector_proc(kind))
+    for kind in SCMNumVectorKinds
+}
+
+
+def numvector_ref_proc(arguments):
+    """Element k of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    k = vector_index(vector, SCMCar(SCMCdr(arguments)))
+    return numvector_element(vector, vector.value[k])
+
+
+def numvector_set_proc(arguments):
+    """Set element k of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    k = vector_index(vector, SCMCar(SCMCdr(arguments)))
+    vector.value[k] = number_value(SCMCar(SCMCdr(SCMCdr(arguments))))
+    return SCMOkSymbol
+
+
+def numvector_length_proc(arguments):
+    """Number of elements of a homogeneous vector."""
+    return make_fixnum(len(SCMCar(arguments).value))
+
+
+def numvector_to_list_proc(arguments):
+    """List of the elements of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    return pylist_to_list([numvector_element(vector, x)
+                           for x in vector.value.tolist()])
+
+
+def numvector_add_proc(arguments):
+    """Elementwise sum of two homogeneous vectors."""
+    values1, values2 = numvector_operands(arguments)
+    if numpy is not None:
+        return numvector_like(SCMCar(arguments), values1 + values2)
+    return numvector_like(SCMCar(arguments),
+                          map(op.add, values1, values2))
+
+
+def numvector_mul_proc(arguments):
+    """Elementwise product of two homogeneous vectors."""
+    values1, values2 = numvector_operands(arguments)
+    if numpy is not None:
+        return numvector_like(SCMCar(arguments), values1 * values2)
+    return numvector_like(SCMCar(arguments),
+                          map(op.mul, values1, values2))
+
+
+def numvector_dot_proc(arguments):
+    """Dot product of two homogeneous vectors."""
+    values1, values2 = numvector_operands(arguments)
+    if numpy is not None:
+        result = numpy.dot(values1, values2)
+    else:
+        result = sum(map(op.mul, values1, values2))
+    return numvector_element(SCMCar(arguments), result)
+
+
+def numvector_sum_proc(arguments):
+    """Sum of the elements of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    return numvector_element(vector, vector.value.sum() if numpy is not None
+                             else sum(vector.value))
+
+
+def numvector_min_proc(arguments):
+    """Smallest element of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    return numvector_element(vector, vector.value.min() if numpy is not None
+                             else min(vector.value))
+
+
+def numvector_max_proc(arguments):
+    """Largest element of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    return numvector_element(vector, vector.value.max() if numpy is not None
+                             else max(vector.value))
+
+
+def numvector_scale_proc(arguments):
+    """Multiply every element of a homogeneous vector by a number."""
+    vector = SCMCar(arguments)
+    factor = number_value(SCMCar(SCMCdr(arguments)))
+    if numpy is not None:
+        return numvector_like(vector, vector.value * factor)
+    return numvector_like(vector, map(op.mul, vector.value,
+                                      itertools.repeat(factor)))
+
+
+def numvector_slice_proc(arguments):
+    """Copy of the elements from start to end of a homogeneous vector."""
+    vector = SCMCar(arguments)
+    start = fixnum_value(SCMCar(SCMCdr(arguments)))
+    end = fixnum_value(SCMCar(SCMCdr(SCMCdr(arguments))))
+    if not 0 <= start <= end <= len(vector.value):
+        raise Exception("Slice {}:{} out of range".format(start, end))
+    items = vector.value[start:end]
+    return numvector_like(vector, items.copy() if numpy is not None else items)
+
+
+# Bytevector procedures
+def range_arguments(arguments, length):
+    "Optional start and end arguments, defaulting to the whole sequence."
+    start, end = 0, length
+    if not is_the_empty_list(arguments):
+        start = fixnum_value(SCMCar(arguments))
+        arguments = SCMCdr(arguments)
+        if not is_the_empty_list(arguments):
+            end = fixnum_value(SCMCar(arguments))
+    if not 0 <= start <= end <= length:
+        raise Exception("Range {}:{} out of range".format(start, end))
+    return start, end
+
+
+def byte_value(obj):
+    "Check obj is a byte."
+    byte = fixnum_value(obj)
+    if not 0 <= byte < 256:
+        raise Exception("{} is not a byte".format(byte))
+    return byte
+
+
+def is_bytevector_proc(arguments):
+    """Bytevector predicate."""
+    return SCMTrue if is_bytevector(SCMCar(arguments)) else SCMFalse
+
+
+def make_bytevector_proc(arguments):
+    """Make a bytevector of k bytes, filled with fill or 0."""
+    k = fixnum_value(SCMCar(arguments))
+    rest = SCMCdr(arguments)
+    fill = 0 if is_the_empty_list(rest) else byte_value(SCMCar(rest))
+    return make_bytevector(bytearray([fill]) * k)
+
+
+def bytevector_proc(arguments):
+    """Bytevector of the arguments."""
+    return make_bytevector(bytearray(byte_value(item) for item in
+                                     list_to_pylist(arguments)))
+
+
+def bytevector_length_proc(arguments):
+    """Number of bytes of a bytevector."""
+    return make_fixnum(len(SCMCar(arguments).value))
+
+
+def bytevector_u8_ref_proc(arguments):
+    """Byte k of a bytevector."""
+    bytevector = SCMCar(arguments)
+    k = vector_index(bytevector, SCMCar(SCMCdr(arguments)))
+    return make_fixnum(bytevector.value[k])
+
+
+def bytevector_u8_set_proc(arguments):
+    """Set byte k of a bytevector."""
+    bytevector = SCMCar(arguments)
+    k = vector_index(bytevector, SCMCar(SCMCdr(arguments)))
+    bytevector.value[k] = byte_value(SCMCar(SCMCdr(SCMCdr(arguments))))
+    return SCMOkSymbol
+
+
+def bytevector_copy_proc(arguments):
+    """Fresh copy of the bytes from start to end."""
+    value = SCMCar(arguments).value
+    start, end = range_arguments(SCMCdr(arguments), len(value))
+    return make_bytevector(bytearray(value[start:end]))
+
+
+def bytevector_slice_proc(arguments):
+    """Bytevector sharing the bytes from start to end, without copying."""
+    value = SCMCar(arguments).value
+    start, end = range_arguments(SCMCdr(arguments), len(value))
+    return make_bytevector(memoryview(value)[start:end])
+
+
+def utf8_to_string_proc(arguments):
+    """Decode the bytes from start to end as UTF-8."""
+    value = SCMCar(arguments).value
+    start, end = range_arguments(SCMCdr(arguments), len(value))
+    try:
+        return make_string(str(memoryview(value)[start:end], "utf-8"))
+    except UnicodeDecodeError as e:
+        raise Exception("Invalid UTF-8 at byte {}".format(start + e.start))
+
+
+def string_to_utf8_proc(arguments):
+    """Encode a string as UTF-8."""
+    try:
+        return make_bytevector(bytearray(SCMCar(arguments).value, "utf-8"))
+    except UnicodeEncodeError:
+        raise Exception("String has no UTF-8 encoding")
+
+
+# Hash tables
+def eqv_key(obj):
+    "Hash key under eqv?, numbers by value and everything else by identity."
+    cls = type(obj)
+    if cls is Fixnum or cls is Rational:
+        return (cls, obj.value)
+    elif cls is Flonum:
+        return (cls, obj.value.hex())
+    elif cls is int or cls is bool:
+        return (cls, obj)
+    return id(obj)
+
+
+def equal_key(obj):
+    "Hash key under equal?, built from the structure of obj."
+    if is_pair(obj):
+        items = []
+        while is_pair(obj):
+            items.append(equal_key(SCMCar(obj)))
+            obj = SCMCdr(obj)
+        return (Pair, tuple(items), equal_key(obj))
+    cls = type(obj)
+    if cls is String or cls is Rope:
+        return (String, obj.value)
+    elif cls is Bytevector:
+        return (cls, bytes(obj.value))
+    elif cls is Vector:
+        return (cls, tuple(equal_key(item) for item in obj.value))
+    elif cls is NumVector:
+        return (cls, obj.kind, tuple(obj.value.tolist()))
+    return eqv_key(obj)
+
+
+def string_key(obj):
+    "Hash key of a string."
+    if not is_string(obj):
+        raise Exception("String hash table keys must be strings")
+    return obj.value
+
+
+SCMHashTableKinds = {
+    "eq": eqv_key,
+    "eqv": eqv_key,
+    "equal": equal_key,
+    "string": string_key,
+}
+
+
+def make_hash_table(kind):
+    return HashTable(kind)
+
+
+def is_hash_table(obj):
+    return type(obj) is HashTable
+
+
+def hash_table_key(table, key):
+    "Hash key of a scheme key in table."
+    return SCMHashTableKinds[table.kind](key)
+
+
+def make_hash_table_proc(arguments):
+    """Make a hash table, keys compared with the given equivalence
+    procedure or with equal? by default."""
+    kind = "equal"
+    if not is_the_empty_list(arguments):
+        equivalence = SCMCar(arguments)
+        kind = SCMHashTableEquivalences.get(
+            equivalence.value if is_primitive_proc(equivalence) else None)
+        if kind is None:
+            raise Exception("Unsupported hash table equivalence")
+    return make_hash_table(kind)
+
+
+def make_kind_hash_table_proc(kind):
+    "make-eq-hash-table and friends."
+    def proc(_):
+        return make_hash_table(kind)
+    return proc
+
+
+def is_hash_table_proc(arguments):
+    """Hash table predicate."""
+    return SCMTrue if is_hash_table(SCMCar(arguments)) else SCMFalse
+
+
+def hash_table_ref_proc(arguments):
+    """Value of key, calls the optional thunk when key is missing."""
+    table = SCMCar(arguments)
+    key = SCMCar(SCMCdr(arguments))
+    entry = table.value.get(hash_table_key(table, key))
+    if entry is not None:
+        return entry[1]
+    rest = SCMCdr(SCMCdr(arguments))
+    if is_the_empty_list(rest):
+        raise Exception("Key not found in hash table")
+    return apply_procedure(SCMCar(rest), SCMTheEmptyList)
+
+
+def hash_table_ref_default_proc(arguments):
+    """Value of key, or the default."""
+    table = SCMCar(arguments)
+    entry = table.value.get(hash_table_key(table, SCMCar(SCMCdr(arguments))))
+    return SCMCar(SCMCdr(SCMCdr(arguments))) if entry is None else entry[1]
+
+
+def hash_table_set_proc(arguments):
+    """Associate key with value."""
+    table = SCMCar(arguments)
+    key = SCMCar(SCMCdr(arguments))
+    table.value[hash_table_key(table, key)] = \
+        (key, SCMCar(SCMCdr(SCMCdr(arguments))))
+    return SCMOkSymbol
+
+
+def hash_table_delete_proc(arguments):
+    """Remove key."""
+    table = SCMCar(arguments)
+    table.value.pop(hash_table_key(table, SCMCar(SCMCdr(arguments))), None)
+    return SCMOkSymbol
+
+
+def hash_table_contains_proc(arguments):
+    """Is key in the table?"""
+    table = SCMCar(arguments)
+    return SCMTrue if hash_table_key(table, SCMCar(SCMCdr(arguments))) in \
+        table.value else SCMFalse
+
+
+def hash_table_count_proc(arguments):
+    """Number of associations."""
+    return make_fixnum(len(SCMCar(arguments).value))
+
+
+def hash_table_update_proc(arguments):
+    """Replace the value of key by proc applied to it, the optional thunk
+    gives the value of a missing key."""
+    table = SCMCar(arguments)
+    key = SCMCar(SCMCdr(arguments))
+    procedure = SCMCar(SCMCdr(SCMCdr(arguments)))
+    hash_key = hash_table_key(table, key)
+    entry = table.value.get(hash_key)
+    if entry is not None:
+        value = entry[1]
+    else:
+        rest = SCMCdr(SCMCdr(SCMCdr(arguments)))
+        if is_the_empty_list(rest):
+            raise Exception("Key not found in hash table")
+        value = apply_procedure(SCMCar(rest), SCMTheEmptyList)
+    table.value[hash_key] = \
+        (key, apply_procedure(procedure, SCMCons(value, SCMTheEmptyList)))
+    return SCMOkSymbol
+
+
+def hash_table_keys_proc(arguments):
+    """List of the keys."""
+    return pylist_to_list([key for key, _ in SCMCar(arguments).value.values()])
+
+
+def hash_table_values_proc(arguments):
+    """List of the values."""
+    return pylist_to_list([value for _, value in
+                           SCMCar(arguments).value.values()])
+
+
+def hash_table_to_alist_proc(arguments):
+    """Association list of the table."""
+    return pylist_to_list([SCMCons(key, value) for key, value in
+                           SCMCar(arguments).value.values()])
+
+
+def hash_table_walk_proc(arguments):
+    """Call proc with each key and value."""
+    procedure = SCMCar(SCMCdr(arguments))
+    for key, value in list(SCMCar(arguments).value.values()):
+        apply_procedure(procedure,
+                        SCMCons(key, SCMCons(value, SCMTheEmptyList)))
+    return SCMOkSymbol
+
+
+# Strings and ropes
+# Appends shorter than this copy, longer ones share both halves in a rope.
+SCMRopeThreshold = 1024
+# Ropes deeper than this are rebuilt balanced.
+SCMRopeMaxDepth = 48
+
+
+def rope_depth(piece):
+    return 0 if type(piece) is str else piece.depth
+
+
+def rope_text(piece):
+    return piece if type(piece) is str else piece.value
+
+
+def string_piece(obj):
+    "Python string or rope behind a scheme string."
+    cls = type(obj)
+    if cls is String:
+        return obj.value
+    elif cls is Rope:
+        return obj
+    raise Exception("Not a string")
+
+
+def piece_to_string(piece):
+    "Scheme string of a python string or rope."
+    return make_string(piece) if type(piece) is str else piece
+
+
+def rope_leaves(piece):
+    "Python strings of a rope, left to right."
+    leaves = []
+    stack = [piece]
+    while stack:
+        node = stack.pop()
+        if type(node) is str:
+            leaves.append(node)
+        elif node.flat is not None:
+            leaves.append(node.flat)
+        else:
+            stack.append(node.right)
+            stack.append(node.left)
+    return leaves
+
+
+def rope_build(leaves, start, end):
+    "Balanced rope of leaves[start:end]."
+    if end - start == 1:
+        return leaves[start]
+    middle = (start + end) // 2
+    return Rope(rope_build(leaves, start, middle),
+                rope_build(leaves, middle, end))
+
+
+def rope_concat(left, right):
+    "Concatenation of two pieces, a rope once the result is long."
+    if not left:
+        return right
+    if not right:
+        return left
+    if len(left) + len(right) < SCMRopeThreshold:
+        return rope_text(left) + rope_text(right)
+    if (type(left) is Rope and type(right) is str and left.flat is None and
+            type(left.right) is str and
+            len(left.right) + len(right) < SCMRopeThreshold):
+        rope = Rope(left.left, left.right + right)
+    else:
+        rope = Rope(left, right)
+    if rope.depth > SCMRopeMaxDepth:
+        leaves = rope_leaves(rope)
+        return rope_build(leaves, 0, len(leaves))
+    return rope
+
+
+def rope_ref(piece, k):
+    "Character k of a piece."
+    while type(piece) is Rope:
+        if piece.flat is not None:
+            return piece.flat[k]
+        left_length = len(piece.left)
+        if k < left_length:
+            piece = piece.left
+        else:
+            k -= left_length
+            piece = piece.right
+    return piece[k]
+
+
+def rope_slice(piece, start, end):
+    "Characters start to end of a piece, sharing whole subtrees."
+    if type(piece) is str:
+        return piece[start:end]
+    if start == 0 and end == piece.length:
+        return piece
+    if piece.flat is not None:
+        return piece.flat[start:end]
+    left_length = len(piece.left)
+    if end <= left_length:
+        return rope_slice(piece.left, start, end)
+    if start >= left_length:
+        return rope_slice(piece.right, start - left_length, end - left_length)
+    return rope_concat(rope_slice(piece.left, start, left_length),
+                       rope_slice(piece.right, 0, end - left_length))
+
+
+def string_length_proc(arguments):
+    """Number of characters in a string."""
+    return make_fixnum(len(string_piece(SCMCar(arguments))))
+
+
+def string_ref_proc(arguments):
+    """Character k of a string."""
+    piece = string_piece(SCMCar(arguments))
+    k = fixnum_value(SCMCar(SCMCdr(arguments)))
+    if not 0 <= k < len(piece):
+        raise Exception("Index {} out of range".format(k))
+    return make_character(rope_ref(piece, k))
+
+
+def string_append_proc(arguments):
+    """Concatenation of the strings."""
+    result = ""
+    while not is_the_empty_list(arguments):
+        result = rope_concat(result, string_piece(SCMCar(arguments)))
+        arguments = SCMCdr(arguments)
+    return piece_to_string(result)
+
+
+def substring_proc(arguments):
+    """Characters start to end of a string, end defaults to its length."""
+    piece = string_piece(SCMCar(arguments))
+    start, end = range_arguments(SCMCdr(arguments), len(piece))
+    return piece_to_string(rope_slice(piece, start, end))
+
+
+def make_string_builder_proc(arguments):
+    """Empty string builder, or one holding the optional string."""
+    builder = StringBuilder()
+    if not is_the_empty_list(arguments):
+        string_builder_append_proc(SCMCons(builder, arguments))
+    return builder
+
+
+def is_string_builder_proc(arguments):
+    """String builder predicate."""
+    return SCMTrue if type(SCMCar(arguments)) is StringBuilder else SCMFalse
+
+
+def string_builder_append_proc(arguments):
+    """Append strings and characters to a string builder."""
+    builder = SCMCar(arguments)
+    arguments = SCMCdr(arguments)
+    while not is_the_empty_list(arguments):
+        obj = SCMCar(arguments)
+        if type(obj) is Rope:
+            builder.value.extend(rope_leaves(obj))
+            builder.length += obj.length
+        elif is_string(obj) or is_character(obj):
+            builder.value.append(obj.value)
+            builder.length += len(obj.value)
+        else:
+            raise Exception("Not a string or character")
+        arguments = SCMCdr(arguments)
+    return SCMOkSymbol
 
-    obj = SCMObject(ObjectType.COMPOUND_PROC,
-                    dict(parameters=parameters, body=body, env=env))
-    return obj
 
+def string_builder_length_proc(arguments):
+    """Number of characters appended so far."""
+    return make_fixnum(SCMCar(arguments).length)
 
 
-def is_primitive_proc(obj):
-    return obj.type == ObjectType.PRIMITIVE_PROC
+def string_builder_to_string_proc(arguments):
+    """String of everything appended so far."""
+    builder = SCMCar(arguments)
+    s = "".join(builder.value)
+    builder.value = [s]
+    return make_string(s)
 
 
-# Primitive Procedures
-#
-# Arithmetic operations
-def add_proc(arguments):
-    """Add numbers from arguments."""
-    result = 0
-    while not is_the_empty_list(arguments):
-        result += SCMCar(arguments).data.value
-        arguments = SCMCdr(arguments)
-    return make_fixnum(result)
+# Persistent maps
+def make_map(value):
+    return Map(value)
 
 
-def sub_proc(arguments):
-    """Subtraction."""
-    # TODO: reduce after implement scheme pair as list.
-    result = SCMCar(arguments).data.value
-    arguments = SCMCdr(arguments)
-    while not is_the_empty_list(arguments):
-        result -= SCMCar(arguments).data.value
-        arguments = SCMCdr(arguments)
-    return make_fixnum(result)
+def is_map(obj):
+    return type(obj) is Map
 
 
-def mul_proc(arguments):
-    """Multiplication."""
-    result = 1
-    while not is_the_empty_list(arguments):
-        result *= SCMCar(arguments).data.value
-        arguments = SCMCdr(arguments)
-    return make_fixnum(result)
+def make_map_proc(_):
+    """Empty map."""
+    return make_map(hamt.PersistentMap())
 
 
-def quotient_proc(arguments):
-    """Quotient."""
-    num1 = SCMCar(arguments).data.value
-    num2 = SCMCar(SCMCdr(arguments)).data.value
-    return make_fixnum(num1 // num2)
+def is_map_proc(arguments):
+    """Map predicate."""
+    return SCMTrue if is_map(SCMCar(arguments)) else SCMFalse
 
 
-def remainder_proc(arguments):
-    """Remainder."""
-    num1 = SCMCar(arguments).data.value
-    num2 = SCMCar(SCMCdr(arguments)).data.value
-    return make_fixnum(num1 % num2)
+def map_ref_proc(arguments):
+    """Value of key, or the optional default."""
+    key = SCMCar(SCMCdr(arguments))
+    entry = SCMCar(arguments).value.get(equal_key(key))
+    if entry is not None:
+        return entry[1]
+    rest = SCMCdr(SCMCdr(arguments))
+    if is_the_empty_list(rest):
+        raise Exception("Key not found in map")
+    return SCMCar(rest)
 
 
+def map_assoc_proc(arguments):
+    """New map with key bound to value."""
+    key = SCMCar(SCMCdr(arguments))
+    value = SCMCar(SCMCdr(SCMCdr(arguments)))
+    return make_map(SCMCar(arguments).value.assoc(equal_key(key),
+                                                  (key, value)))
 
-# Primitive comparison
-# FIXME: Should return scheme boolean objects.
-def is_number_equal_proc(arguments):
-    """Compare two numbers, if equal returns true."""
-    value = SCMCar(arguments).data.value
-    while not is_the_empty_list(SCMCdr(arguments)):
-        if value != SCMCar(SCMCdr(arguments)).data.value:
-            return False
-        arguments = SCMCdr(arguments)
-    return True
 
+def map_dissoc_proc(arguments):
+    """New map without key."""
+    key = SCMCar(SCMCdr(arguments))
+    return make_map(SCMCar(arguments).value.dissoc(equal_key(key)))
 
-def is_less_then_proc(arguments):
-    """If arguments is decreasing then returns true."""
-    previous = SCMCar(arguments).data.value
-    next_ = None
-    while not is_the_empty_list(SCMCdr(arguments)):
-        next_ = SCMCar(SCMCdr(arguments)).data.value
-        arguments = SCMCdr(arguments)
-        if previous < next_:
-            previous = next_
-        else:
-            return False
-    return True
 
+def map_contains_proc(arguments):
+    """Is key in the map?"""
+    key = SCMCar(SCMCdr(arguments))
+    return SCMTrue if equal_key(key) in SCMCar(arguments).value else SCMFalse
 
-def is_greater_then_proc(arguments):
-    """If arguments is increasing then returns false."""
-    previous = SCMCar(arguments).data.value
-    next_ = None
-    while not is_the_empty_list(SCMCdr(arguments)):
-        next_ = SCMCar(SCMCdr(arguments)).data.value
-        arguments = SCMCdr(arguments)
-        if previous > next_:
-            previous = next_
-        else:
-            return False
-    return True
 
+def map_count_proc(arguments):
+    """Number of keys."""
+    return make_fixnum(len(SCMCar(arguments).value))
 
-# Type predicates
-def is_null_proc(arguments):
-    """Null predicate."""
-    return is_the_empty_list(SCMCar(arguments)) is True
 
+def map_keys_proc(arguments):
+    """List of the keys."""
+    return pylist_to_list([key for _, (key, _) in SCMCar(arguments).value])
 
-def is_boolean_proc(arguments):
-    """Boolean predicate."""
-    return is_boolean(SCMCar(arguments)) is True
 
+def map_to_alist_proc(arguments):
+    """Association list of the map."""
+    return pylist_to_list([SCMCons(key, value) for _, (key, value) in
+                           SCMCar(arguments).value])
 
-def is_symbol_proc(arguments):
-    """Symbol predicate."""
-    return is_symbol(SCMCar(arguments)) is True
 
+def alist_to_map_proc(arguments):
+    """Map of an association list, later keys win."""
+    return make_map(hamt.from_items(
+        (equal_key(SCMCar(pair)), (SCMCar(pair), SCMCdr(pair)))
+        for pair in list_to_pylist(SCMCar(arguments))))
 
-def is_integer_proc(arguments):
-    """Integer predicate."""
-    return is_fixnum(SCMCar(arguments)) is True
 
+def map_transient_proc(arguments):
+    """Transient copy of a map."""
+    return TransientMap(SCMCar(arguments).value.transient())
 
-def is_char_proc(arguments):
-    """Character predicate."""
-    return is_character(SCMCar(arguments)) is True
 
+def map_assoc_bang_proc(arguments):
+    """Bind key to value in a transient map."""
+    transient = SCMCar(arguments)
+    key = SCMCar(SCMCdr(arguments))
+    transient.value.assoc(equal_key(key),
+                          (key, SCMCar(SCMCdr(SCMCdr(arguments)))))
+    return transient
 
-def is_string_proc(arguments):
-    """String predicate."""
-    return is_string(SCMCar(arguments)) is True
 
+def map_dissoc_bang_proc(arguments):
+    """Remove key from a transient map."""
+    transient = SCMCar(arguments)
+    transient.value.dissoc(equal_key(SCMCar(SCMCdr(arguments))))
+    return transient
 
-def is_pair_proc(arguments):
-    """Pair predicate."""
-    return is_pair(SCMCar(arguments)) is True
 
+def map_persistent_bang_proc(arguments):
+    """Freeze a transient map."""
+    return make_map(SCMCar(arguments).value.persistent())
 
-def is_compound_proc(obj):
-    "Compound procedure predicate."
-    return obj.type == ObjectType.COMPOUND_PROC
 
+# Records
+def make_record_type(name, fields):
+    """Record subclass for a record type, the slot of the nth field is
+    field<n> as scheme field names need not be python identifiers."""
+    slots = tuple("field{}".format(i) for i in range(len(fields)))
+    return type(name, (Record,),
+                {"__slots__": slots, "name": name, "fields": tuple(fields)})
 
-def is_procedure_proc(arguments):        # TODO: Untested
-    """Procedure predicate."""
-    obj = SCMCar(arguments)
-    return SCMTrue if is_primitive_proc(obj) or is_compound_proc(obj) else \
-        SCMFalse
 
+def record_slot(cls, field):
+    "Slot of a field of a record class."
+    if field not in cls.fields:
+        raise Exception("Record type {} has no field {}".format(cls.name,
+                                                                field))
+    return "field{}".format(cls.fields.index(field))
 
-# List procedures
-def cons_proc(arguments):
-    """Cons procedure."""
-    return SCMCons(SCMCar(arguments),
-                   SCMCar(SCMCdr(arguments)))
 
+def record_definition_names(exp):
+    "Names a define-record-type expression defines."
+    exp = SCMCdr(exp)
+    names = [SCMCar(exp), SCMCar(SCMCar(SCMCdr(exp))),
+             SCMCar(SCMCdr(SCMCdr(exp)))]
+    for spec in list_to_pylist(SCMCdr(SCMCdr(SCMCdr(exp)))):
+        names.extend(list_to_pylist(SCMCdr(spec)))
+    return names
 
-def car_proc(arguments):
-    """Car procedure."""
-    return SCMCar(SCMCar(arguments))
 
+def record_constructor_proc(cls, fields):
+    "Primitive building a cls record from the values of fields."
+    slots = [record_slot(cls, field) for field in fields]
+    others = [slot for slot in cls.__slots__ if slot not in slots]
+    new = cls.__new__
 
-def cdr_proc(arguments):
-    """Cdr procedure."""
-    return SCMCdr(SCMCar(arguments))
+    def proc(arguments):
+        record = new(cls)
+        for slot in slots:
+            if is_the_empty_list(arguments):
+                raise Exception("Record constructor of {} expects {} "
+                                "arguments".format(cls.name, len(slots)))
+            setattr(record, slot, SCMCar(arguments))
+            arguments = SCMCdr(arguments)
+        if not is_the_empty_list(arguments):
+            raise Exception("Record constructor of {} expects {} "
+                            "arguments".format(cls.name, len(slots)))
+        for slot in others:
+            setattr(record, slot, SCMFalse)
+        return record
+    return proc
 
 
-def set_car_proc(arguments):
-    """Set car procedure."""
-    SCMSetCar(SCMCar(arguments), SCMCar(SCMCdr(arguments)))
-    return SCMOkSymbol
+def record_predicate_proc(cls):
+    "Primitive testing for cls records."
+    def proc(arguments):
+        return SCMTrue if type(SCMCar(arguments)) is cls else SCMFalse
+    return proc
 
-def set_cdr_proc(arguments):
-    """Set cdr procedure."""
-    SCMSetCdr(SCMCar(arguments), SCMCar(SCMCdr(arguments)))
-    return SCMOkSymbol
 
+def record_accessor_proc(cls, field):
+    "Primitive reading a field of cls records."
+    get = op.attrgetter(record_slot(cls, field))
 
-def list_proc(arguments):
-    """List procedure."""
-    return arguments
+    def proc(arguments):
+        record = SCMCar(arguments)
+        if type(record) is not cls:
+            raise Exception("Not a {} record".format(cls.name))
+        return get(record)
+    return proc
+
+
+def record_modifier_proc(cls, field):
+    "Primitive setting a field of cls records."
+    slot = record_slot(cls, field)
 
+    def proc(arguments):
+        record = SCMCar(arguments)
+        if type(record) is not cls:
+            raise Exception("Not a {} record".format(cls.name))
+        setattr(record, slot, SCMCar(SCMCdr(arguments)))
+        return SCMOkSymbol
+    return proc
+
+
+# Hash consing
+#
+# freeze returns a copy of a datum in which structurally equal pairs,
+# strings and numbers are one shared object. Every part of it is already
+# canonical when its parent is looked up, so the key of a pair is the
+# identities of its car and cdr. Canonical pairs are frozen, set-car! and
+# set-cdr! refuse them.
+#
+# The table holds its objects weakly, a frozen datum nothing else refers
+# to is freed. An entry goes with its object, before the ids in its key
+# can be reused. Fixnums are keyed by value and not shared. Canonical
+# pairs are FrozenPairs, the pair type is what marks them frozen.
+#
+# With SCHEME_HEAP=soa pairs are handles, SCMFrozenPairs holds the frozen
+# ones and both tables are plain.
+if SCMHeapMode == "object":
+    SCMHashConsTable = weakref.WeakValueDictionary()
+    make_frozen_pair = FrozenPair
 
-# Comparison
-def is_eq_proc(arguments):
-    obj1 = SCMCar(arguments)
-    obj2 = SCMCar(SCMCdr(arguments))
-    if obj1.type != obj2.type:
-        return SCMFalse
-    else:
-        return SCMTrue if obj1.data.value == \
-            obj2.data.value else SCMFalse
+    def is_frozen(obj):
+        return type(obj) is FrozenPair
+else:
+    SCMHashConsTable = {}
+    SCMFrozenPairs = set()
 
+    def make_frozen_pair(car, cdr):
+        pair = SCMCons(car, cdr)
+        SCMFrozenPairs.add(pair)
+        return pair
 
-def apply_proc(_):
-    "Apply primitive procedure."
-    raise Exception(
-        "Illegal state: The body of the apply primitive procedure should not execute")
+    def is_frozen(obj):
+        return type(obj) is int and obj in SCMFrozenPairs
 
 
+# Garbage collection
+#
+# Python frees Pair objects itself. Heap pairs are freed by SCMCollect,
+# from the values roots reach. A frozen pair it frees leaves the hash
+# consing table, as with the weak table of object mode.
+if SCMHeapMode == "object":
+    def SCMCollect(roots):
+        "Nothing to free, return the number of pairs freed."
+        return 0
+else:
+    def SCMCollect(roots):
+        """Free the heap pairs roots do not reach, return the number of
+        pairs freed. Call it between evaluations, see ConsHeap.collect."""
+        freed = SCMHeap.collect(roots)
+        SCMFrozenPairs.difference_update(freed)
+        for key in [key for key, obj in SCMHashConsTable.items()
+                    if type(obj) is int and obj in freed]:
+            del SCMHashConsTable[key]
+        return len(freed)
+
+
+def canonical_identity(obj):
+    "Identity of a canonical object, by value for immediates and handles."
+    cls = type(obj)
+    if cls is int or cls is bool:
+        return (cls, obj)
+    elif cls is Fixnum:
+        return (cls, obj.value)
+    return id(obj)
+
+
+def canonical_atom_key(obj):
+    "Hash consing key of a non-pair, None if it is unique or mutable."
+    cls = type(obj)
+    if cls is String or cls is Rational:
+        return (cls, obj.value)
+    elif cls is Flonum:
+        return (cls, obj.value.hex())
+    return None
+
+
+def canonical_pair(car, cdr):
+    "The frozen pair of canonical car and cdr."
+    key = (canonical_identity(car), canonical_identity(cdr))
+    pair = SCMHashConsTable.get(key)
+    if pair is None:
+        pair = SCMHashConsTable[key] = make_frozen_pair(car, cdr)
+    return pair
+
+
+def freeze(obj, active=None):
+    """Canonical frozen copy of obj. active holds the pairs being frozen,
+    reaching one again means obj is circular."""
+    if is_pair(obj) and not is_frozen(obj):
+        if active is None:
+            active = set()
+        items = []
+        pairs = []
+        while is_pair(obj) and not is_frozen(obj):
+            key = canonical_identity(obj)
+            if key in active:
+                raise Exception("Cannot freeze circular data")
+            active.add(key)
+            pairs.append(key)
+            items.append(freeze(SCMCar(obj), active))
+            obj = SCMCdr(obj)
+        result = freeze(obj, active)
+        active.difference_update(pairs)
+        for item in reversed(items):
+            result = canonical_pair(item, result)
+        return result
+    key = canonical_atom_key(obj)
+    if key is None:
+        return obj
+    return SCMHashConsTable.setdefault(key, obj)
+
+
+def mutable_pair(obj):
+    "Check obj is not a frozen pair."
+    if is_frozen(obj):
+        raise Exception("Cannot mutate a frozen pair")
+    return obj
 
 
+def freeze_proc(arguments):
+    """Canonical frozen copy of a datum."""
+    return freeze(SCMCar(arguments))
 
 
+def is_frozen_proc(arguments):
+    """Is the pair frozen?"""
+    return SCMTrue if is_frozen(SCMCar(arguments)) else SCMFalse
 
 
 # Type conversions, TODO: add test
 def char_to_integer_proc(arguments):
     """Convert character to integer."""
-    return make_fixnum(ord(SCMCar(arguments).data.value))
+    return make_fixnum(ord(SCMCar(arguments).value))
 
 
 def integer_to_char_proc(arguments):
     """Convert integer to character."""
-    return make_character(chr(SCMCar(arguments).data.value))
+    return make_character(chr(fixnum_value(SCMCar(arguments))))
 
 
 def number_to_string_proc(arguments):
     """Convert number to string."""
-    return make_string(str(SCMCar(arguments).data.value))
+    return make_string(number_to_text(number_value(SCMCar(arguments))))
 
 
 def string_to_number_proc(arguments):
-    """Convert string to number."""
-    return make_fixnum(int(SCMCar(arguments).data.value))
+    """Convert string to number, false if it is not a number."""
+    value = parse_number(SCMCar(arguments).value)
+    return SCMFalse if value is None else make_number(value)
 
 
 def symbol_to_string_proc(arguments):
     """Convert symbol to string."""
-    return make_string(SCMCar(arguments).data.value)
+    return make_string(SCMCar(arguments).value)
 
 
 def string_to_symbol_proc(arguments):
     """Convert string to symbol."""
-    return make_symbol(SCMCar(arguments).data.value)
+    return make_symbol(SCMCar(arguments).value)
+
+
+def string_to_uninterned_symbol_proc(arguments):
+    """Uninterned symbol named by a string."""
+    return make_uninterned_symbol(SCMCar(arguments).value)
+
+
+def gensym_proc(arguments):
+    """Fresh uninterned symbol, named after the optional prefix string."""
+    if is_the_empty_list(arguments):
+        return gensym()
+    return gensym(SCMCar(arguments).value)
+
+
+def is_symbol_interned_proc(arguments):
+    """Is the symbol interned?"""
+    return SCMTrue if is_interned(SCMCar(arguments)) else SCMFalse
+
+
+def symbol_count_proc(_):
+    """Number of interned symbols."""
+    return make_fixnum(symbol_count())
+
+
+def interned_symbols_proc(_):
+    """List of the interned symbols."""
+    return pylist_to_list(list(interned_symbols()))
+
+
+# SCHEME_VALUES=immediate represents fixnums as python ints and booleans
+# as True and False, the primitives below then work on them without
+# boxing. The empty list is the SCMTheEmptyList sentinel in both modes.
+SCMValueMode = os.environ.get("SCHEME_VALUES", "boxed")
+if SCMValueMode == "immediate":
+    if SCMHeapMode != "object":
+        raise Exception("Immediate values need the object heap mode.")
+
+    SCMTrue = True
+    SCMFalse = False
+
+    def is_boolean(obj):
+        return type(obj) is bool
+
+    def make_fixnum(value):
+        return value
+
+    def is_fixnum(obj):
+        return type(obj) is int
+
+    def fixnum_value(obj):
+        # bool is a subclass of int, type(obj) is int leaves it out.
+        if type(obj) is not int:
+            raise Exception("Expected an exact integer")
+        return obj
+
+    def number_value(obj):
+        if type(obj) is int:
+            return obj
+        elif type(obj) is Flonum or type(obj) is Rational:
+            return obj.value
+        raise Exception("Expected a number")
+
+    # bool is a subclass of int, so operands are checked with type(x) is
+    # int. Flonums and rationals stay boxed, from the first argument that
+    # is not an int the rest go through number_fold.
+    def add_proc(arguments):
+        """Add numbers from arguments."""
+        result = 0
+        while not is_the_empty_list(arguments):
+            obj = SCMCar(arguments)
+            if type(obj) is not int:
+                return number_fold(op.add, result, arguments)
+            result += obj
+            arguments = SCMCdr(arguments)
+        return result
+
+    def sub_proc(arguments):
+        """Subtraction."""
+        result = SCMCar(arguments)
+        arguments = SCMCdr(arguments)
+        if type(result) is not int:
+            return number_fold(op.sub, number_value(result), arguments)
+        while not is_the_empty_list(arguments):
+            obj = SCMCar(arguments)
+            if type(obj) is not int:
+                return number_fold(op.sub, result, arguments)
+            result -= obj
+            arguments = SCMCdr(arguments)
+        return result
+
+    def mul_proc(arguments):
+        """Multiplication."""
+        result = 1
+        while not is_the_empty_list(arguments):
+            obj = SCMCar(arguments)
+            if type(obj) is not int:
+                return number_fold(op.mul, result, arguments)
+            result *= obj
+            arguments = SCMCdr(arguments)
+        return result
+
+    def is_number_equal_proc(arguments):
+        """Compare two numbers, if equal returns true."""
+        value = number_value(SCMCar(arguments))
+        while not is_the_empty_list(SCMCdr(arguments)):
+            if value != number_value(SCMCar(SCMCdr(arguments))):
+                return False
+            arguments = SCMCdr(arguments)
+        return True
+
+    def is_less_then_proc(arguments):
+        """If arguments is decreasing then returns true."""
+        previous = number_value(SCMCar(arguments))
+        while not is_the_empty_list(SCMCdr(arguments)):
+            arguments = SCMCdr(arguments)
+            next_ = number_value(SCMCar(arguments))
+            if previous < next_:
+                previous = next_
+            else:
+                return False
+        return True
+
+    def is_greater_then_proc(arguments):
+        """If arguments is increasing then returns false."""
+        previous = number_value(SCMCar(arguments))
+        while not is_the_empty_list(SCMCdr(arguments)):
+            arguments = SCMCdr(arguments)
+            next_ = number_value(SCMCar(arguments))
+            if previous > next_:
+                previous = next_
+            else:
+                return False
+        return True
+elif SCMValueMode != "boxed":
+    raise Exception("Unknown value mode '{}'".format(SCMValueMode))
+
+
+# Hash table equivalences, by the python function of the primitive.
+SCMHashTableEquivalences = {
+    is_eq_proc: "eq",
+    is_eqv_proc: "eqv",
+    is_equal_proc: "equal",
+}
+SCMHashTableConstructors = {
+    kind: make_kind_hash_table_proc(kind) for kind in SCMHashTableKinds
+}
 
 
 # Singleton
@@ -386,6 +2567,7 @@ SCMElseSymbol = make_symbol("else")
 SCMLetSymbol = make_symbol("let")
 SCMAndSymbol = make_symbol("and")
 SCMOrSymbol = make_symbol("or")
+SCMDefineRecordTypeSymbol = make_symbol("define-record-type")
 
 def make_lambda(parameters, body):
     "Make a lambda pair."
@@ -512,12 +2694,6 @@ def make_application(operator_obj, operands_obj):
     return SCMCons(operator_obj, operands_obj)
 
 
-def SCMSetCdr(obj, cdr):
-    car, _ = obj.data.value
-    obj.data.value = (car, cdr)
-    return
-
-
 def enclosing_environment(env):
     return SCMCdr(env)
 
@@ -526,38 +2702,126 @@ def first_frame(env):
     return SCMCar(env)
 
 
-def make_frame(variables, values):
-    return SCMCons(variables, values)
+def make_dict_frame(bindings):
+    return DictFrame(bindings)
 
 
-def frame_variables(frame):
-    return SCMCar(frame)
+def is_dict_frame(frame):
+    return type(frame) is DictFrame
 
 
-def frame_values(frame):
-    return SCMCdr(frame)
-
-
-def add_binding_to_frame(var, val, frame):
-    SCMSetCar(frame, SCMCons(var, SCMCar(frame)))
-    SCMSetCdr(frame, SCMCons(val, SCMCdr(frame)))
+def extend_environment(variables, vals, base_env):
+    return SCMConsObject(Frame(tuple(list_to_pylist(variables)),
+                               list_to_pylist(vals)),
+                         base_env)
+
+
+def procedure_environment(procedure, arguments):
+    "Environment of a call to a compound procedure."
+    values = procedure_arguments(procedure, arguments)
+    for index in procedure.boxes:
+        values[index] = Cell(values[index])
+    return SCMConsObject(Frame(procedure.names, values, procedure.free),
+                         procedure.env)
+
+
+def lookup_local(ref, env):
+    "Value of the slot ref addresses."
+    for _ in range(ref.depth):
+        env = SCMCdr(env)
+    value = SCMCar(env).values[ref.index]
+    if ref.boxed:
+        value = value.value
+    if value is None:
+        raise Exception("Unassigned variable '{}'".format(ref.symbol))
+    return value
+
+
+def set_local(ref, val, env):
+    "Set the slot ref addresses."
+    for _ in range(ref.depth):
+        env = SCMCdr(env)
+    if ref.boxed:
+        SCMCar(env).values[ref.index].value = val
+    else:
+        SCMCar(env).values[ref.index] = val
+
+
+def lookup_free(ref, env):
+    "Value of the captured variable ref addresses."
+    value = SCMCar(env).free[ref.index]
+    if ref.boxed:
+        value = value.value
+    if value is None:
+        raise Exception("Unassigned variable '{}'".format(ref.symbol))
+    return value
+
+
+def set_free(ref, val, env):
+    "Set the captured variable ref addresses, always boxed."
+    SCMCar(env).free[ref.index].value = val
+
+
+def lookup_global(ref, env):
+    "Value of the variable ref names, through its cached cell when valid."
+    base = env
+    for _ in range(ref.depth):
+        base = SCMCdr(base)
+    if ref.base is base and ref.version == SCMGlobalVersion:
+        return ref.cell.value
+    cell = global_cell(ref, env, base)
+    if cell is None:
+        return lookup_variable_value(ref.symbol, env)
+    return cell.value
+
+
+def set_global(ref, val, env):
+    "Set the variable ref names."
+    base = env
+    for _ in range(ref.depth):
+        base = SCMCdr(base)
+    if ref.base is base and ref.version == SCMGlobalVersion:
+        ref.cell.value = val
+        return
+    cell = global_cell(ref, env, base)
+    if cell is None:
+        set_variable_value(ref.symbol, val, env)
+    else:
+        cell.value = val
 
 
-def extend_environment(variables, vals, base_env):
-    return SCMCons(make_frame(variables, vals), base_env)
+def global_cell(ref, env, base):
+    """Cell of the variable ref names, found from env, cached in ref for
+    lookups starting from base. None if a call frame binds the variable,
+    only possible for a name defined into it after compiling."""
+    var = ref.symbol
+    while not is_the_empty_list(env):
+        frame = first_frame(env)
+        if is_dict_frame(frame):
+            cell = frame.value.get(var)
+            if cell is not None:
+                ref.cell = cell
+                ref.base = base
+                ref.version = SCMGlobalVersion
+                return cell
+        elif var in frame.names:
+            return None
+        env = enclosing_environment(env)
+    raise Exception("Unbound variable '{}'".format(var))
 
 
 def lookup_variable_value(var, env):
     while not is_the_empty_list(env):
         frame = first_frame(env)
-        variables = frame_variables(frame)
-        values = frame_values(frame)
-        while not is_the_empty_list(variables):
-            if var == SCMCar(variables):
-                return SCMCar(values)
-            else:
-                variables = SCMCdr(variables)
-                values = SCMCdr(values)
+        if is_dict_frame(frame):
+            cell = frame.value.get(var)
+            if cell is not None:
+                return cell.value
+        elif var in frame.names:
+            value = frame.values[frame.names.index(var)]
+            if value is None:
+                raise Exception("Unassigned variable '{}'".format(var))
+            return value
         env = enclosing_environment(env)
     raise Exception("Unbound variable '{}'".format(var))
 
@@ -565,36 +2829,42 @@ def lookup_variable_value(var, env):
 def set_variable_value(var, val, env):
     while not is_the_empty_list(env):
         frame = first_frame(env)
-        variables = frame_variables(frame)
-        values = frame_values(frame)
-        while not is_the_empty_list(variables):
-            if var == SCMCar(variables):
-                SCMSetCar(values, val)
+        if is_dict_frame(frame):
+            cell = frame.value.get(var)
+            if cell is not None:
+                cell.value = val
                 return
-            else:
-                variables = SCMCdr(variables)
-                values = SCMCdr(values)
+        elif var in frame.names:
+            frame.values[frame.names.index(var)] = val
+            return
         env = enclosing_environment(env)
     raise Exception("Unbound variable '{}'".format(var))
 
 
 def define_variable(var, val, env):
+    global SCMGlobalVersion
     frame = first_frame(env)
-    variables = frame_variables(frame)
-    values = frame_values(frame)
-    while not is_the_empty_list(variables):
-        if var == SCMCar(variables):
-            SCMSetCar(values, val)
+    if is_dict_frame(frame):
+        cell = frame.value.get(var)
+        if cell is not None:
+            cell.value = val
             return
-        else:
-            variables = SCMCdr(variables)
-            values = SCMCdr(values)
-    add_binding_to_frame(var, val, frame)
+        frame.value[var] = Cell(val)
+    elif var in frame.names:
+        frame.values[frame.names.index(var)] = val
+        return
+    else:
+        # Not a slot known when the body was compiled, only reachable by
+        # name.
+        frame.names = frame.names + (var,)
+        frame.values.append(val)
+    # The new binding may shadow a cell cached further out.
+    SCMGlobalVersion += 1
 
 
 def definition_variable(exp):
     """Definition variable."""
-    if is_symbol(SCMCar(SCMCdr(exp))):
+    if not is_pair(SCMCar(SCMCdr(exp))):
         return SCMCar(SCMCdr(exp))
     else:
         return SCMCar(SCMCar(SCMCdr(exp)))
@@ -602,7 +2872,7 @@ def definition_variable(exp):
 
 def definition_value(exp):
     "Definition value."
-    if is_symbol(SCMCar(SCMCdr(exp))):
+    if not is_pair(SCMCar(SCMCdr(exp))):
         return SCMCar(SCMCdr(SCMCdr(exp)))
     else:
         return make_lambda(SCMCdr(SCMCar(SCMCdr(exp))),
@@ -624,9 +2894,8 @@ def make_if(predicate, consequent, alternative):
 
 
 def setup_environment():
-    return extend_environment(SCMTheEmptyList,
-                              SCMTheEmptyList,
-                              SCMTheEmptyEnvironment)
+    "Environment of one empty global frame."
+    return SCMConsObject(make_dict_frame({}), SCMTheEmptyEnvironment)
 
 
 def null_environment_proc(_):
@@ -664,6 +2933,9 @@ def populate_environment(env):
     add_procedure("boolean?", is_boolean_proc)
     add_procedure("symbol?", is_symbol_proc)
     add_procedure("integer?", is_integer_proc)
+    add_procedure("number?", is_number_proc)
+    add_procedure("exact?", is_exact_proc)
+    add_procedure("inexact?", is_inexact_proc)
     add_procedure("char?", is_char_proc)
     add_procedure("string?", is_string_proc)
     add_procedure("pair?", is_pair_proc)
@@ -675,12 +2947,27 @@ def populate_environment(env):
     add_procedure("string->number", string_to_number_proc)
     add_procedure("symbol->string", symbol_to_string_proc)
     add_procedure("string->symbol", string_to_symbol_proc)
+    add_procedure("string->uninterned-symbol",
+                  string_to_uninterned_symbol_proc)
+    add_procedure("gensym", gensym_proc)
+    add_procedure("symbol-interned?", is_symbol_interned_proc)
+    add_procedure("symbol-count", symbol_count_proc)
+    add_procedure("interned-symbols", interned_symbols_proc)
 
     add_procedure("+", add_proc)
     add_procedure("-", sub_proc)
     add_procedure("*", mul_proc)
     add_procedure("quotient", quotient_proc)
     add_procedure("remainder", remainder_proc)
+    add_procedure("/", div_proc)
+    add_procedure("exact->inexact", exact_to_inexact_proc)
+    add_procedure("inexact->exact", inexact_to_exact_proc)
+    add_procedure("floor", floor_proc)
+    add_procedure("ceiling", ceiling_proc)
+    add_procedure("truncate", truncate_proc)
+    add_procedure("round", round_proc)
+    add_procedure("sqrt", sqrt_proc)
+    add_procedure("expt", expt_proc)
     add_procedure("=", is_number_equal_proc)
     add_procedure("<", is_less_then_proc)
     add_procedure(">", is_greater_then_proc)
@@ -690,9 +2977,98 @@ def populate_environment(env):
     add_procedure("cdr", cdr_proc)
     add_procedure("set-car!", set_car_proc)
     add_procedure("set-cdr!", set_cdr_proc)
+    add_procedure("freeze", freeze_proc)
+    add_procedure("frozen?", is_frozen_proc)
     add_procedure("list", list_proc)
 
+    add_procedure("vector?", is_vector_proc)
+    add_procedure("make-vector", make_vector_proc)
+    add_procedure("vector", vector_proc)
+    add_procedure("vector-ref", vector_ref_proc)
+    add_procedure("vector-set!", vector_set_proc)
+    add_procedure("vector-length", vector_length_proc)
+    add_procedure("vector->list", vector_to_list_proc)
+    add_procedure("list->vector", list_to_vector_proc)
+    add_procedure("vector-fill!", vector_fill_proc)
+    add_procedure("vector-map", vector_map_proc)
+
+    for kind in SCMNumVectorKinds:
+        name = kind + "vector"
+        is_proc, make_proc, from_arguments, from_list = \
+            SCMNumVectorConstructors[kind]
+        add_procedure(name + "?", is_proc)
+        add_procedure("make-" + name, make_proc)
+        add_procedure(name, from_arguments)
+        add_procedure("list->" + name, from_list)
+        add_procedure(name + "-ref", numvector_ref_proc)
+        add_procedure(name + "-set!", numvector_set_proc)
+        add_procedure(name + "-length", numvector_length_proc)
+        add_procedure(name + "->list", numvector_to_list_proc)
+        add_procedure(name + "-add", numvector_add_proc)
+        add_procedure(name + "-mul", numvector_mul_proc)
+        add_procedure(name + "-dot", numvector_dot_proc)
+        add_procedure(name + "-sum", numvector_sum_proc)
+        add_procedure(name + "-min", numvector_min_proc)
+        add_procedure(name + "-max", numvector_max_proc)
+        add_procedure(name + "-scale", numvector_scale_proc)
+        add_procedure(name + "-slice", numvector_slice_proc)
+
+    add_procedure("bytevector?", is_bytevector_proc)
+    add_procedure("make-bytevector", make_bytevector_proc)
+    add_procedure("bytevector", bytevector_proc)
+    add_procedure("bytevector-length", bytevector_length_proc)
+    add_procedure("bytevector-u8-ref", bytevector_u8_ref_proc)
+    add_procedure("bytevector-u8-set!", bytevector_u8_set_proc)
+    add_procedure("bytevector-copy", bytevector_copy_proc)
+    add_procedure("bytevector-slice", bytevector_slice_proc)
+    add_procedure("utf8->string", utf8_to_string_proc)
+    add_procedure("string->utf8", string_to_utf8_proc)
+
+    add_procedure("make-hash-table", make_hash_table_proc)
+    for kind in SCMHashTableKinds:
+        add_procedure("make-{}-hash-table".format(kind),
+                      SCMHashTableConstructors[kind])
+    add_procedure("hash-table?", is_hash_table_proc)
+    add_procedure("hash-table-ref", hash_table_ref_proc)
+    add_procedure("hash-table-ref/default", hash_table_ref_default_proc)
+    add_procedure("hash-table-set!", hash_table_set_proc)
+    add_procedure("hash-table-delete!", hash_table_delete_proc)
+    add_procedure("hash-table-contains?", hash_table_contains_proc)
+    add_procedure("hash-table-count", hash_table_count_proc)
+    add_procedure("hash-table-update!", hash_table_update_proc)
+    add_procedure("hash-table-keys", hash_table_keys_proc)
+    add_procedure("hash-table-values", hash_table_values_proc)
+    add_procedure("hash-table->alist", hash_table_to_alist_proc)
+    add_procedure("hash-table-walk", hash_table_walk_proc)
+
+    add_procedure("string-length", string_length_proc)
+    add_procedure("string-ref", string_ref_proc)
+    add_procedure("string-append", string_append_proc)
+    add_procedure("substring", substring_proc)
+    add_procedure("make-string-builder", make_string_builder_proc)
+    add_procedure("string-builder?", is_string_builder_proc)
+    add_procedure("string-builder-append!", string_builder_append_proc)
+    add_procedure("string-builder-length", string_builder_length_proc)
+    add_procedure("string-builder->string", string_builder_to_string_proc)
+
+    add_procedure("make-map", make_map_proc)
+    add_procedure("map?", is_map_proc)
+    add_procedure("map-ref", map_ref_proc)
+    add_procedure("map-assoc", map_assoc_proc)
+    add_procedure("map-dissoc", map_dissoc_proc)
+    add_procedure("map-contains?", map_contains_proc)
+    add_procedure("map-count", map_count_proc)
+    add_procedure("map-keys", map_keys_proc)
+    add_procedure("map->alist", map_to_alist_proc)
+    add_procedure("alist->map", alist_to_map_proc)
+    add_procedure("map-transient", map_transient_proc)
+    add_procedure("map-assoc!", map_assoc_bang_proc)
+    add_procedure("map-dissoc!", map_dissoc_bang_proc)
+    add_procedure("map-persistent!", map_persistent_bang_proc)
+
     add_procedure("eq?", is_eq_proc)
+    add_procedure("eqv?", is_eqv_proc)
+    add_procedure("equal?", is_equal_proc)
     add_procedure("apply", apply_proc)
 
     add_procedure("interaction-environment", interaction_environment_proc)
@@ -749,16 +3125,42 @@ def eat_whitespace(fhandle):
     return char, pos
 
 
+# Decimal integers, ratios and decimals with an optional exponent. Checked
+# before converting, int and float also take "1_000", " 12 " and "inf".
+SCMNumberSyntax = re.compile(r"[+-]?(\d+/\d+|(\d+\.?\d*|\.\d+)(e[+-]?\d+)?)")
+
+
+def parse_number(text):
+    "Python int, float or Fraction written in text, None if it is not one."
+    if SCMNumberSyntax.fullmatch(text) is None:
+        return None
+    try:
+        if "/" in text:
+            return Fraction(text)
+        elif "." in text or "e" in text:
+            value = float(text)
+            # Too large for a float, python reads it as infinity.
+            return value if math.isfinite(value) else None
+        return int(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
 def read_digit(fhandle, leading):
-    "Read digits, return corresponding integer."
+    "Read a number, return the corresponding int, float or Fraction."
     digits = [leading]
     while True:
         char = peek(fhandle)
-        if char.isdigit():
+        if (char.isdigit() or char == "." or char == "/" or char == "e" or
+                ((char == "+" or char == "-") and digits[-1] == "e")):
             digits.append(fhandle.read(1))
             continue
         elif is_delimiter(char):
-            return int("".join(digits))
+            text = "".join(digits)
+            value = parse_number(text)
+            if value is None:
+                raise Exception("Bad number literal '{}'".format(text))
+            return value
         else:
             raise Exception("Number not followed by delimiter")
 
@@ -818,7 +3220,7 @@ def read_character(fhandle, leading):
 
 
 def read_string(fhandle):
-    s = ""
+    s = []
     while True:
         char = fhandle.read(1)
         if char != "\"":
@@ -829,10 +3231,10 @@ def read_string(fhandle):
             elif char == "":    # EOF
                 raise Exception("non-terminated string literal")
             else:
-                s += char
+                s.append(char)
         else:
             break
-    return s
+    return "".join(s)
 
 
 def read_pair(fhandle):
@@ -858,6 +3260,13 @@ def read_pair(fhandle):
         return SCMCons(car_obj, cdr_obj)
 
 
+# SCHEME_QUOTE=frozen freezes every 'datum as it is read, so repeated
+# quoted constants share one copy and set-car! on them is an error.
+SCMQuoteMode = os.environ.get("SCHEME_QUOTE", "mutable")
+if SCMQuoteMode not in ("mutable", "frozen"):
+    raise Exception("Unknown quote mode '{}'".format(SCMQuoteMode))
+
+
 def SCMRead(fhandle):
     "Return an object from a file handle."
     buffer = ""
@@ -865,20 +3274,28 @@ def SCMRead(fhandle):
 
     if char == "#":
         candidate = read_bool(fhandle)
-        if isinstance(candidate, str):
-            # Character
-            return read_character(fhandle, candidate)
-        else:
+        if not isinstance(candidate, str):
             # Boolean
             return candidate
+        elif candidate == "(":
+            # Vector
+            return make_vector(list_to_pylist(read_pair(fhandle)))
+        elif candidate == "u":
+            # Bytevector
+            eat_expected_string(fhandle, "8(")
+            return make_bytevector(bytearray(
+                byte_value(item) for item in list_to_pylist(read_pair(fhandle))))
+        else:
+            # Character
+            return read_character(fhandle, candidate)
     # Digit
     elif char.isdigit():
         value = read_digit(fhandle, char)
-        return make_fixnum(value)
+        return make_number(value)
     elif char == "-" and peek(fhandle).isdigit():
         char2 = fhandle.read(1)
         value = read_digit(fhandle, char2)
-        return make_fixnum(-1*value)
+        return make_number(-1*value)
     # Symbol
     elif is_initial(char) or ((char == "+" or char == "-") and
                               is_delimiter(peek(fhandle))):
@@ -902,18 +3319,30 @@ def SCMRead(fhandle):
         return read_pair(fhandle)
     # Quoted expression
     elif char == "\'":
+        datum = SCMRead(fhandle)
+        if SCMQuoteMode == "frozen":
+            datum = freeze(datum)
         return SCMCons(SCMQuoteSymbol,
-                       SCMCons(SCMRead(fhandle), SCMTheEmptyList))
+                       SCMCons(datum, SCMTheEmptyList))
     else:
         raise Exception("Unexpected character '{}'".format(char))
 
 
+def SCMReadFrozen(fhandle):
+    "Read an object and freeze it, for data that is never mutated."
+    return freeze(SCMRead(fhandle))
+
+
 # Evaluate
+SCMSelfEvaluatingTypes = frozenset((Boolean, Fixnum, Character, String, Rope,
+                                    Vector, Flonum, Rational, NumVector,
+                                    Bytevector))
+if SCMValueMode == "immediate":
+    SCMSelfEvaluatingTypes |= {bool, int}
+
+
 def is_self_evaluating(exp):
-    return (is_boolean(exp) or
-            is_fixnum(exp) or
-            is_character(exp) or
-            is_string(exp))
+    return type(exp) in SCMSelfEvaluatingTypes
 
 
 def is_variable(exp):
@@ -923,7 +3352,7 @@ def is_variable(exp):
 def is_tagged_list(exp, tag):
     if is_pair(exp):
         the_car = SCMCar(exp)
-        return is_symbol(the_car) and the_car == tag
+        return the_car is tag
     else:
         return False
 
@@ -1072,6 +3501,40 @@ def or_tests(exp):
     return SCMCdr(exp)
 
 
+def is_record_definition(exp):
+    "Return true if is (define-record-type ...)."
+    return is_tagged_list(exp, SCMDefineRecordTypeSymbol)
+
+
+def eval_record_definition(exp, env):
+    """Define the type, constructor, predicate, accessors and modifiers of
+    (define-record-type name (constructor field ...) predicate
+                        (field accessor [modifier]) ...)."""
+    exp = SCMCdr(exp)
+    type_name = SCMCar(exp)
+    constructor = SCMCar(SCMCdr(exp))
+    predicate = SCMCar(SCMCdr(SCMCdr(exp)))
+    specs = list_to_pylist(SCMCdr(SCMCdr(SCMCdr(exp))))
+    cls = make_record_type(type_name.value,
+                           [SCMCar(spec).value for spec in specs])
+    define_variable(type_name, RecordType(cls), env)
+    define_variable(SCMCar(constructor), make_primitive_proc(
+        record_constructor_proc(
+            cls, [field.value for field in
+                  list_to_pylist(SCMCdr(constructor))])), env)
+    define_variable(predicate,
+                    make_primitive_proc(record_predicate_proc(cls)), env)
+    for spec in specs:
+        field = SCMCar(spec).value
+        spec = SCMCdr(spec)
+        define_variable(SCMCar(spec), make_primitive_proc(
+            record_accessor_proc(cls, field)), env)
+        if not is_the_empty_list(SCMCdr(spec)):
+            define_variable(SCMCar(SCMCdr(spec)), make_primitive_proc(
+                record_modifier_proc(cls, field)), env)
+    return SCMOkSymbol
+
+
 def apply_operator(arguments):
     "Extract operator from apply procedure."
     return SCMCar(arguments)
@@ -1082,8 +3545,8 @@ def prepare_apply_operands(arguments):
     if is_the_empty_list(SCMCdr(arguments)):
         return SCMCar(arguments)
     else:
-        return SCMCons(SCMCar(arguments),
-                       prepare_apply_operands(SCMCdr(arguments)))
+        return SCMConsObject(SCMCar(arguments),
+                             prepare_apply_operands(SCMCdr(arguments)))
 
 
 def apply_operands(arguments):
@@ -1102,99 +3565,378 @@ def eval_environment(arguments):
 
 
 def eval_assignment(exp, env):
-    set_variable_value(assignment_variable(exp),
-                       SCMEval(assignment_value(exp), env),
-                       env)
+    var = assignment_variable(exp)
+    val = SCMEval(assignment_value(exp), env)
+    if type(var) is LocalRef:
+        set_local(var, val, env)
+    elif type(var) is FreeRef:
+        set_free(var, val, env)
+    elif type(var) is GlobalRef:
+        set_global(var, val, env)
+    else:
+        set_variable_value(var, val, env)
     return SCMOkSymbol
 
 
 def eval_definition(exp, env):
-    define_variable(definition_variable(exp),
-                    SCMEval(definition_value(exp), env),
-                    env)
+    var = definition_variable(exp)
+    val = SCMEval(definition_value(exp), env)
+    if type(var) is LocalRef:
+        if is_compound_proc(val) and val.name is None:
+            val.name = var.symbol.value
+        set_local(var, val, env)
+        return SCMOkSymbol
+    if is_compound_proc(val) and val.name is None:
+        val.name = var.value
+    define_variable(var, val, env)
     return SCMOkSymbol
 
 
-def SCMEval(exp, env):
-    if is_self_evaluating(exp):
+# Special forms, by the symbol at the head of the expression. A handler
+# takes the expression and the environment and returns its value. The
+# handler of a tail form instead returns the expression and environment
+# to evaluate next, or the value and None, and SCMEval loops on them.
+#
+# compiler, when given, compiles the form inside a lambda body, see
+# compile_exp. Forms without one are left as they are.
+SCMSpecialForms = {}
+SCMSpecialFormCompilers = {}
+
+
+def define_special_form(name, handler, tail=False, compiler=None):
+    "Evaluate expressions headed by the symbol name with handler."
+    symbol = make_symbol(name)
+    SCMSpecialForms[symbol] = (handler, tail)
+    if compiler is not None:
+        SCMSpecialFormCompilers[symbol] = compiler
+    else:
+        SCMSpecialFormCompilers.pop(symbol, None)
+
+
+# Lexical addressing
+#
+# make_compound_proc compiles the body of a lambda once. Variables bound
+# by it, by its internal definitions and by enclosing compiled lambdas
+# become LocalRef slots, nested lambdas become Lambda nodes. Any other
+# variable becomes a GlobalRef, which caches the cell of its global
+# binding. Variables in forms without a compiler stay symbols and are
+# looked up by name.
+def body_definitions(exp, names):
+    "Add the names defined in exp, outside nested lambdas, to names."
+    if not is_pair(exp):
+        return
+    head = SCMCar(exp)
+    if type(head) is Symbol and head in SCMSpecialForms:
+        if head is SCMDefineSymbol:
+            var = definition_variable(exp)
+            if var not in names:
+                names.append(var)
+            body_definitions(definition_value(exp), names)
+            return
+        elif head is SCMDefineRecordTypeSymbol:
+            for var in record_definition_names(exp):
+                if var not in names:
+                    names.append(var)
+            return
+        elif head is SCMLetSymbol:
+            exp = let_to_application(exp)
+        elif head is SCMCondSymbol:
+            exp = cond_to_if(exp)
+        elif (head is SCMQuoteSymbol or head is SCMLambdaSymbol or
+              head not in SCMSpecialFormCompilers):
+            return
+    while is_pair(exp):
+        body_definitions(SCMCar(exp), names)
+        exp = SCMCdr(exp)
+
+
+def compile_lambda(parameters, body, scope):
+    """Lambda node of parameters and body, a list of expressions. scope is
+    a tuple of the slot names of the enclosing frames, innermost first."""
+    names = []
+    while is_pair(parameters):
+        names.append(SCMCar(parameters))
+        parameters = SCMCdr(parameters)
+    arity = len(names)
+    rest = not is_the_empty_list(parameters)
+    if rest:
+        names.append(parameters)
+    parameters = pylist_to_list(names)
+    body = sequence_to_exp(body)
+    body_definitions(body, names)
+    names = tuple(names)
+    return Lambda(parameters, compile_exp(body, (names,) + scope), names,
+                  arity, rest)
+
+
+def compile_exp(exp, scope):
+    "Compile an expression in scope."
+    if is_variable(exp):
+        return compile_variable(exp, scope)
+    elif not is_pair(exp):
         return exp
-    elif is_variable(exp):
-        return lookup_variable_value(exp, env)
-    elif is_quoted(exp):
-        return text_of_quotation(exp)
-    elif is_assignment(exp):
-        return eval_assignment(exp, env)
-    elif is_definition(exp):
-        return eval_definition(exp, env)
-    elif is_if(exp):
-        exp = if_consequent(exp) if is_true(SCMEval(if_predicate(exp), env)) \
-              else if_alternative(exp)
-        return SCMEval(exp, env)     # TODO: Tailcall
-    elif is_lambda(exp):
-        return make_compound_proc(lambda_parameters(exp),
-                                  lambda_body(exp),
-                                  env)
-    elif is_begin(exp):
-        exp = begin_actions(exp)
-        while not is_last_exp(exp):
-            SCMEval(first_exp(exp), env)
-            exp = rest_exp(exp)
-        exp = first_exp(exp)
-        return SCMEval(exp, env)
-    elif is_cond(exp):
-        exp = cond_to_if(exp)
-        return SCMEval(exp, env)
-    elif is_let(exp):
-        exp = let_to_application(exp)
-        return SCMEval(exp, env)
-    elif is_and(exp):
-        exp = and_tests(exp)
-        if is_the_empty_list(exp):
-            return SCMTrue
-        while not is_last_exp(exp):
-            result = SCMEval(first_exp(exp), env)
-            if is_false(result):
-                return result
-            exp = rest_exp(exp)
-        exp = first_exp(exp)
-        return SCMEval(exp, env)
-    elif is_or(exp):
-        exp = or_tests(exp)
-        if is_the_empty_list(exp):
-            return SCMFalse
-        while not is_last_exp(exp):
-            result = SCMEval(first_exp(exp), env)
-            if is_true(result):
-                return result
-            exp = rest_exp(exp)
-        exp = first_exp(exp)
-        return SCMEval(exp, env)
-    elif is_application(exp):
-        procedure = SCMEval(operator(exp), env)
+    head = SCMCar(exp)
+    if type(head) is Symbol and head in SCMSpecialForms:
+        compiler = SCMSpecialFormCompilers.get(head)
+        return exp if compiler is None else compiler(exp, scope)
+    return compile_list(exp, scope)
+
+
+def compile_list(exps, scope):
+    "Compile each expression of a list."
+    items = []
+    while is_pair(exps):
+        items.append(compile_exp(SCMCar(exps), scope))
+        exps = SCMCdr(exps)
+    return pylist_to_list(items)
+
+
+def compile_variable(var, scope):
+    "LocalRef of var if scope binds it, otherwise a GlobalRef."
+    for depth, names in enumerate(scope):
+        if var in names:
+            return LocalRef(var, depth, names.index(var))
+    return GlobalRef(var, len(scope))
+
+
+def compile_quoted(exp, scope):
+    return exp
+
+
+def compile_operands(exp, scope):
+    "Keep the head of exp, compile the rest."
+    return SCMCons(SCMCar(exp), compile_list(SCMCdr(exp), scope))
+
+
+def compile_definition(exp, scope):
+    return pylist_to_list([SCMDefineSymbol,
+                           compile_variable(definition_variable(exp), scope),
+                           compile_exp(definition_value(exp), scope)])
+
+
+def compile_lambda_exp(exp, scope):
+    return compile_lambda(lambda_parameters(exp), lambda_body(exp), scope)
+
+
+def compile_cond(exp, scope):
+    return compile_exp(cond_to_if(exp), scope)
+
+
+def compile_let(exp, scope):
+    return compile_exp(let_to_application(exp), scope)
+
+
+# Flat closures
+#
+# A lambda compiled completely, nested lambdas included, is flattened.
+# A nested lambda copies the variables of enclosing lambdas it or lambdas
+# inside it refer to when it is made, and reads them as FreeRefs, so the
+# closure keeps nothing else of the enclosing frames alive. A captured
+# variable that is assigned, by set! or define, is boxed: its slot holds a
+# Cell the frame and the closures share. A lambda with a form without a
+# compiler in it keeps chained frames, the form looks variables up by name
+# through them.
+def flatten_lambda(lambda_):
+    "Flat closure version of the compiled lambda_, or lambda_."
+    free = {}
+    captured = set()
+    assigned = set()
+    if not analyze_lambda(lambda_, (), free, captured, assigned):
+        return lambda_
+    return flatten(lambda_, (), free, captured & assigned, None)
+
+
+def analyze_lambda(lambda_, stack, free, captured, assigned):
+    """Record the variables lambda_ captures in free, by the id of the
+    lambda, and the (id of the binding lambda, slot) of every captured and
+    assigned variable. False if a form was not compiled."""
+    free[id(lambda_)] = {}
+    return analyze_exp(lambda_.body, stack + (lambda_,), free, captured,
+                       assigned)
+
+
+def analyze_exp(exp, stack, free, captured, assigned):
+    if type(exp) is LocalRef:
+        if exp.depth:
+            key = (id(stack[-1 - exp.depth]), exp.index)
+            captured.add(key)
+            for inner in stack[-exp.depth:]:
+                free[id(inner)][key] = None
+        return True
+    elif type(exp) is Lambda:
+        return analyze_lambda(exp, stack, free, captured, assigned)
+    elif not is_pair(exp):
+        return True
+    head = SCMCar(exp)
+    if type(head) is Symbol and head in SCMSpecialForms:
+        if head is SCMQuoteSymbol:
+            return True
+        elif head not in SCMSpecialFormCompilers:
+            return False
+        elif head is SCMSetSymbol or head is SCMDefineSymbol:
+            var = SCMCar(SCMCdr(exp))
+            if type(var) is LocalRef:
+                assigned.add((id(stack[-1 - var.depth]), var.index))
+    while is_pair(exp):
+        if not analyze_exp(SCMCar(exp), stack, free, captured, assigned):
+            return False
+        exp = SCMCdr(exp)
+    return True
+
+
+def flatten(lambda_, stack, free, boxed, outer):
+    """Flat Lambda of lambda_. outer maps the variables captured by the
+    enclosing lambda to their index, None for the outermost lambda."""
+    captures = None
+    index = {key: i for i, key in enumerate(free[id(lambda_)])}
+    if stack:
+        parent = id(stack[-1])
+        captures = tuple((True, key[1]) if key[0] == parent
+                         else (False, outer[key]) for key in index)
+    stack = stack + (lambda_,)
+    boxes = tuple(i for i in range(len(lambda_.names))
+                  if (id(lambda_), i) in boxed)
+    return Lambda(lambda_.parameters,
+                  flatten_exp(lambda_.body, stack, free, boxed, index),
+                  lambda_.names, lambda_.arity, lambda_.rest, captures, boxes)
+
+
+def flatten_exp(exp, stack, free, boxed, index):
+    if type(exp) is LocalRef:
+        key = (id(stack[-1 - exp.depth]), exp.index)
+        if exp.depth == 0:
+            return LocalRef(exp.symbol, 0, exp.index, key in boxed)
+        return FreeRef(exp.symbol, index[key], key in boxed)
+    elif type(exp) is GlobalRef:
+        # Every frame of a flat closure is right above its base.
+        return GlobalRef(exp.symbol, 1)
+    elif type(exp) is Lambda:
+        return flatten(exp, stack, free, boxed, index)
+    elif not is_pair(exp) or SCMCar(exp) is SCMQuoteSymbol:
+        return exp
+    items = []
+    while is_pair(exp):
+        items.append(flatten_exp(SCMCar(exp), stack, free, boxed, index))
+        exp = SCMCdr(exp)
+    return pylist_to_list(items)
+
+
+def eval_quoted(exp, env):
+    return text_of_quotation(exp)
+
+
+def eval_if(exp, env):
+    if is_true(SCMEval(if_predicate(exp), env)):
+        return if_consequent(exp), env
+    return if_alternative(exp), env
+
+
+def eval_lambda(exp, env):
+    return make_compound_proc(lambda_parameters(exp), lambda_body(exp), env)
+
+
+def eval_begin(exp, env):
+    exp = begin_actions(exp)
+    while not is_last_exp(exp):
+        SCMEval(first_exp(exp), env)
+        exp = rest_exp(exp)
+    return first_exp(exp), env
+
+
+def eval_cond(exp, env):
+    return cond_to_if(exp), env
+
+
+def eval_let(exp, env):
+    return let_to_application(exp), env
+
+
+def eval_and(exp, env):
+    exp = and_tests(exp)
+    if is_the_empty_list(exp):
+        return SCMTrue, None
+    while not is_last_exp(exp):
+        result = SCMEval(first_exp(exp), env)
+        if is_false(result):
+            return result, None
+        exp = rest_exp(exp)
+    return first_exp(exp), env
+
+
+def eval_or(exp, env):
+    exp = or_tests(exp)
+    if is_the_empty_list(exp):
+        return SCMFalse, None
+    while not is_last_exp(exp):
+        result = SCMEval(first_exp(exp), env)
+        if is_true(result):
+            return result, None
+        exp = rest_exp(exp)
+    return first_exp(exp), env
+
+
+define_special_form("quote", eval_quoted, compiler=compile_quoted)
+define_special_form("set!", eval_assignment, compiler=compile_operands)
+define_special_form("define", eval_definition, compiler=compile_definition)
+define_special_form("define-record-type", eval_record_definition)
+define_special_form("if", eval_if, tail=True, compiler=compile_operands)
+define_special_form("lambda", eval_lambda, compiler=compile_lambda_exp)
+define_special_form("begin", eval_begin, tail=True,
+                    compiler=compile_operands)
+define_special_form("cond", eval_cond, tail=True, compiler=compile_cond)
+define_special_form("let", eval_let, tail=True, compiler=compile_let)
+define_special_form("and", eval_and, tail=True, compiler=compile_operands)
+define_special_form("or", eval_or, tail=True, compiler=compile_operands)
+
+
+def SCMEval(exp, env):
+    while True:
+        if type(exp) is LocalRef:
+            return lookup_local(exp, env)
+        elif type(exp) is FreeRef:
+            return lookup_free(exp, env)
+        elif type(exp) is GlobalRef:
+            return lookup_global(exp, env)
+        elif is_self_evaluating(exp):
+            return exp
+        elif is_variable(exp):
+            return lookup_variable_value(exp, env)
+        elif type(exp) is Lambda:
+            return make_closure(exp, env)
+        elif not is_application(exp):
+            raise Exception("Cannot eval unknown expression type")
+
+        head = operator(exp)
+        if type(head) is Symbol:
+            form = SCMSpecialForms.get(head)
+            if form is not None:
+                handler, tail = form
+                if not tail:
+                    return handler(exp, env)
+                exp, env = handler(exp, env)
+                if env is None:
+                    return exp
+                continue
+
+        procedure = SCMEval(head, env)
         arguments = list_of_values(operands(exp), env)
 
-        if is_primitive_proc(procedure) and procedure.data.value == eval_proc:
+        if is_primitive_proc(procedure) and procedure.value == eval_proc:
             exp = eval_expression(arguments)
             env = eval_environment(arguments)
-            return SCMEval(exp, env)
+            continue
 
-        if is_primitive_proc(procedure) and procedure.data.value == apply_proc:
+        if is_primitive_proc(procedure) and procedure.value == apply_proc:
             procedure = apply_operator(arguments)
             arguments = apply_operands(arguments)
 
         if is_primitive_proc(procedure):
-            return procedure.data.value(arguments)
+            return procedure.value(arguments)
         elif is_compound_proc(procedure):
-            env = extend_environment(
-                procedure.data.value.get("parameters"),
-                arguments,
-                procedure.data.value.get("env"))
-            exp = make_begin(procedure.data.value.get("body"))
-            return SCMEval(exp, env)
+            env = procedure_environment(procedure, arguments)
+            exp = procedure.body
         else:
             raise Exception("Unknown procedure type.")
-    else:
-        raise Exception("Cannot eval unknown expression type")
 
 
 def list_of_values(exps, env):
@@ -1202,8 +3944,23 @@ def list_of_values(exps, env):
     if is_no_operands(exps):
         return SCMTheEmptyList
     else:
-        return SCMCons(SCMEval(first_operand(exps), env),
-                       list_of_values(rest_operands(exps), env))
+        return SCMConsObject(SCMEval(first_operand(exps), env),
+                             list_of_values(rest_operands(exps), env))
+
+
+def apply_procedure(procedure, arguments):
+    "Apply a procedure to a list of arguments, for primitives taking procedures."
+    if is_primitive_proc(procedure) and procedure.value == apply_proc:
+        procedure = apply_operator(arguments)
+        arguments = apply_operands(arguments)
+
+    if is_primitive_proc(procedure):
+        return procedure.value(arguments)
+    elif is_compound_proc(procedure):
+        return SCMEval(procedure.body,
+                       procedure_environment(procedure, arguments))
+    else:
+        raise Exception("Unknown procedure type.")
 
 
 def write_pair(obj):
@@ -1211,10 +3968,10 @@ def write_pair(obj):
     cdr = SCMCdr(obj)
 
     SCMWrite(car)
-    if cdr.type == ObjectType.PAIR:
+    if is_pair(cdr):
         print(" ", end="")
         write_pair(cdr)
-    elif cdr.type == ObjectType.THE_EMPTY_LIST:
+    elif is_the_empty_list(cdr):
         return
     else:
         print(" . ", end="")
@@ -1224,14 +3981,22 @@ def write_pair(obj):
 
 # Print
 def SCMWrite(obj):
-    if obj.type == ObjectType.FIXNUM:
-        print(obj.data.value, end="")
-    elif obj.type == ObjectType.BOOLEAN:
-        print(obj.data.value, end="")
-    elif obj.type == ObjectType.THE_EMPTY_LIST:
+    cls = type(obj)
+    if cls is Fixnum:
+        print(obj.value, end="")
+    elif cls is Boolean:
+        print(obj.value, end="")
+    elif is_pair(obj):
+        # Checked before int, pairs are int handles with SCHEME_HEAP=soa.
+        print("(", end="")
+        write_pair(obj)
+        print(")", end="")
+    elif cls is int or cls is bool:
+        print(obj, end="")
+    elif cls is EmptyList:
         print("()", end="")
-    elif obj.type == ObjectType.CHARACTER:
-        c = obj.data.value
+    elif cls is Character:
+        c = obj.value
         fmt = "#\\{}"
         if c == "\n":
             print(fmt.format("newline"), end="")
@@ -1239,21 +4004,48 @@ def SCMWrite(obj):
             print(fmt.format("space"), end="")
         else:
             print(fmt.format(c), end="")
-    elif obj.type == ObjectType.STRING:
-        s = obj.data.value
+    elif cls is String or cls is Rope:
+        s = obj.value
         fmt = "\"{}\""
         s = s.replace("\n", "\\n")
         s = s.replace("\\", "\\\\")
         s = s.replace("\"", "\\\"")
         print(fmt.format(s), end="")
-    elif obj.type == ObjectType.PAIR:
-        print("(", end="")
-        write_pair(obj)
+    elif cls is Flonum or cls is Rational:
+        print(number_to_text(obj.value), end="")
+    elif cls is NumVector:
+        print("#{}(".format(obj.kind), end="")
+        print(" ".join(repr(x) for x in obj.value.tolist()), end="")
+        print(")", end="")
+    elif cls is Bytevector:
+        print("#u8(", end="")
+        print(" ".join(str(byte) for byte in obj.value), end="")
+        print(")", end="")
+    elif cls is Vector:
+        print("#(", end="")
+        for i, item in enumerate(obj.value):
+            if i:
+                print(" ", end="")
+            SCMWrite(item)
         print(")", end="")
-    elif obj.type == ObjectType.SYMBOL:
-        s = obj.data.value
+    elif cls is Symbol:
+        s = obj.value
         print(s, end="")
-    elif obj.type == ObjectType.PRIMITIVE_PROC or obj.type == ObjectType.COMPOUND_PROC:
+    elif cls is HashTable:
+        print("#<hash-table>", end="")
+    elif cls is Map:
+        print("#<map>", end="")
+    elif cls is TransientMap:
+        print("#<transient-map>", end="")
+    elif cls is StringBuilder:
+        print("#<string-builder>", end="")
+    elif cls is DictFrame or cls is Frame:
+        print("#<frame>", end="")
+    elif cls is RecordType:
+        print("#<record-type {}>".format(obj.value.name), end="")
+    elif isinstance(obj, Record):
+        print("#<record {}>".format(obj.name), end="")
+    elif cls is PrimitiveProc or cls is CompoundProc:
         print("<#<procedure>")
     else:
         raise Exception("Cannot write unkown type")
@@ -1269,6 +4061,7 @@ def repl():
         s = io.StringIO(s)
         SCMWrite(SCMEval(SCMRead(s), SCMTheGlobalEnvironment))
         print()
+        SCMCollect([SCMTheGlobalEnvironment])
 
 
 if __name__ == "__main__":
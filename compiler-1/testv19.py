@@ -1,8 +1,51 @@
 """Tests for schemev12.py."""
 import unittest
+import contextlib
+import gc
 import io
+import os
+import subprocess
+import sys
+import hamt
 from schemev19 import *         # pylint: disable=unused-wildcard-import, wildcard-import
 
+
+class EvalMixin:
+    "Fresh environment for each test, and helpers evaluating strings in it."
+    def setUp(self):
+        self.env = make_environment()
+
+    def eval(self, s, env=None):
+        "Evaluate a string."
+        return SCMEval(SCMRead(io.StringIO(s)),
+                       self.env if env is None else env)
+
+    def write(self, s):
+        "Written form of the value of a string."
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            SCMWrite(self.eval(s))
+        return out.getvalue()
+
+
+# With SCHEME_HEAP=soa the reader and cons make integer handles, == on two
+# of them compares the handles and not the lists.
+needs_pair_objects = unittest.skipIf(
+    SCMHeapMode == "soa", "== compares soa pair handles, not lists")
+
+
+def run_in_mode(code, **modes):
+    """Output of code run in a fresh interpreter with schemev19 imported,
+    modes are the SCHEME_ environment variables to set."""
+    environ = {key: value for key, value in os.environ.items()
+               if not key.startswith("SCHEME_")}
+    environ.update(modes)
+    return subprocess.run(
+        [sys.executable, "-c", "from schemev19 import *\n" + code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=environ,
+        capture_output=True, text=True, check=True).stdout
+
+
 class TestFixnumObject(unittest.TestCase):
     """Tests for fixnum."""
     def test_scmread(self):
@@ -15,6 +58,33 @@ class TestFixnumObject(unittest.TestCase):
                          make_fixnum(int("-1234")))
 
 
+@unittest.skipIf(SCMValueMode == "immediate", "fixnums are not boxed")
+class TestFixnumCache(unittest.TestCase):
+    "Tests for the small integer cache."
+    def tearDown(self):
+        set_fixnum_cache_range(-1024, 65535)
+
+    def test_shared(self):
+        "Small fixnums are shared."
+        self.assertIs(make_fixnum(0), make_fixnum(0))
+        self.assertIs(make_fixnum(-1024), make_fixnum(-1024))
+        self.assertIs(add_proc(SCMRead(io.StringIO("(40 2)"))),
+                      make_fixnum(42))
+        self.assertIsNot(make_fixnum(65536), make_fixnum(65536))
+        self.assertEqual(make_fixnum(65536), make_fixnum(65536))
+
+    def test_stats(self):
+        "Allocation counters, kept with SCHEME_FIXNUM_STATS=1."
+        out = run_in_mode(
+            "set_fixnum_cache_range(0, 10)\n"
+            "for i in (1, 2, 3, 11):\n"
+            "    make_fixnum(i)\n"
+            "print(SCMFixnumStats['hits'], SCMFixnumStats['allocations'],\n"
+            "      fixnum_hit_rate(), make_fixnum(-1) is make_fixnum(-1))\n",
+            SCHEME_FIXNUM_STATS="1")
+        self.assertEqual(out, "3 1 0.75 False\n")
+
+
 class TestBoolean(unittest.TestCase):
     "Tests for boolean."
     def test_scmbool(self):
@@ -49,6 +119,14 @@ class TestCharacter(unittest.TestCase):
         self.assertEqual(SCMRead(io.StringIO(char5)),
                          make_character("g"))
 
+    def test_interned(self):
+        "Characters are shared."
+        self.assertIs(SCMRead(io.StringIO("#\\a")), make_character("a"))
+        self.assertIs(integer_to_char_proc(SCMRead(io.StringIO("(955)"))),
+                      make_character("\u03bb"))
+        self.assertIs(make_character("\U0001f600"),
+                      make_character("\U0001f600"))
+
 
 class TestString(unittest.TestCase):
     "Tests for string."
@@ -95,11 +173,12 @@ class TestPair(unittest.TestCase):
         pair2 = "(0 1)"
         pair3 = "(0 . (1 . ()))"
         pair4 = "(0 . (1 . 2))"
-        pair1_e = SCMCons(make_fixnum(0), make_fixnum(1))
-        pair2_e = SCMCons(make_fixnum(0),
-                          SCMCons(make_fixnum(1), SCMTheEmptyList))
+        pair1_e = SCMConsObject(make_fixnum(0), make_fixnum(1))
+        pair2_e = SCMConsObject(make_fixnum(0),
+                                SCMConsObject(make_fixnum(1), SCMTheEmptyList))
         pair3_e = pair2_e
-        pair4_e = SCMCons(make_fixnum(0), SCMCons(make_fixnum(1), make_fixnum(2)))
+        pair4_e = SCMConsObject(make_fixnum(0),
+                                SCMConsObject(make_fixnum(1), make_fixnum(2)))
         self.assertEqual(SCMRead(io.StringIO(pair1)),
                          pair1_e)
         self.assertEqual(SCMRead(io.StringIO(pair2)),
@@ -124,6 +203,40 @@ class TestSymbol(unittest.TestCase):
         self.assertEqual(SCMRead(io.StringIO(symbol2)), symbol2_e)
         self.assertEqual(SCMRead(io.StringIO(symbol3)), symbol3_e)
 
+    def test_interned(self):
+        "Symbols are interned in a table that can be counted and iterated."
+        count = symbol_count()
+        symbol = make_symbol("test-interned-symbol")
+        self.assertIs(make_symbol("test-interned-symbol"), symbol)
+        self.assertIs(string_to_symbol_proc(
+            pylist_to_list([make_string("test-interned-symbol")])), symbol)
+        self.assertEqual(symbol_count(), count + 1)
+        self.assertIn(symbol, list(interned_symbols()))
+        self.assertEqual({symbol: 1}[make_symbol("test-interned-symbol")], 1)
+
+    def test_weak(self):
+        "Unreferenced symbols leave the table."
+        make_symbol("test-weak-symbol")
+        gc.collect()
+        self.assertNotIn("test-weak-symbol",
+                         [symbol.value for symbol in interned_symbols()])
+
+    def test_uninterned(self):
+        "gensym and uninterned symbols are not in the table."
+        env = make_environment()
+        eval_ = lambda s: SCMEval(SCMRead(io.StringIO(s)), env)
+        count = symbol_count()
+        self.assertIs(eval_('(eq? (string->uninterned-symbol "a") \'a)'),
+                      SCMFalse)
+        self.assertIs(eval_("(eq? (gensym) (gensym))"), SCMFalse)
+        self.assertIs(eval_('(symbol? (gensym "tmp"))'), SCMTrue)
+        self.assertIs(eval_('(symbol-interned? (gensym))'), SCMFalse)
+        self.assertIs(eval_("(symbol-interned? 'a)"), SCMTrue)
+        self.assertTrue(gensym("tmp").value.startswith("tmp"))
+        SCMCollect([env])
+        gc.collect()
+        self.assertLessEqual(symbol_count(), count)
+
 
 class TestIf(unittest.TestCase):
     "Test for if predicate."
@@ -296,6 +409,17 @@ class TestComparision(unittest.TestCase):
         self.assertTrue(is_greater_then_proc(self.greaternums))
         self.assertFalse(is_greater_then_proc(self.lessnums))
 
+    def test_eval(self):
+        "Comparisons return scheme booleans."
+        self.assertIs(is_less_then_proc(self.lessnums), SCMTrue)
+        self.assertIs(is_number_equal_proc(self.lessnums), SCMFalse)
+        SCMEval(SCMRead(io.StringIO(
+            "(define (fact n) (if (< n 2) 1 (* n (fact (- n 1)))))")),
+                SCMTheGlobalEnvironment)
+        self.assertEqual(SCMEval(SCMRead(io.StringIO("(fact 10)")),
+                                 SCMTheGlobalEnvironment),
+                         make_fixnum(3628800))
+
 
 class TestListProc(unittest.TestCase):
     """Tests for list procedures."""
@@ -308,7 +432,7 @@ class TestListProc(unittest.TestCase):
     def test_cons_proc(self):
         "Scheme cons."
         self.assertEqual(cons_proc(self.abc),
-                         SCMCons(make_fixnum(1), make_fixnum(2)))
+                         SCMConsObject(make_fixnum(1), make_fixnum(2)))
 
     def test_car_proc(self):
         "Scheme car."
@@ -317,7 +441,7 @@ class TestListProc(unittest.TestCase):
     def test_cdr_proc(self):
         "Scheme cdr."
         self.assertEqual(cdr_proc(self.opq),
-                         SCMCons(make_fixnum(2), SCMTheEmptyList))
+                         SCMConsObject(make_fixnum(2), SCMTheEmptyList))
 
     def test_set_car_proc(self):
         "Set! car."
@@ -327,12 +451,838 @@ class TestListProc(unittest.TestCase):
         "Set! cdr."
         self.assertEqual(set_cdr_proc(self.lmn), SCMOkSymbol)
 
+    def test_set_in_place(self):
+        "Set car and cdr mutate the pair itself."
+        pair = SCMCons(make_fixnum(1), make_fixnum(2))
+        three = make_fixnum(3)
+        set_car_proc(SCMCons(pair, SCMCons(three, SCMTheEmptyList)))
+        set_cdr_proc(SCMCons(pair, SCMCons(SCMTheEmptyList, SCMTheEmptyList)))
+        self.assertIs(SCMCar(pair), three)
+        self.assertIs(SCMCdr(pair), SCMTheEmptyList)
+
     def test_list_proc(self):
         "Scheme list."
         self.assertEqual(list_proc(self.abc),
                          self.abc)
 
 
+@unittest.skipIf(SCMValueMode == "immediate", "fixnums are not boxed")
+class TestConsHeap(unittest.TestCase):
+    "Tests for the struct-of-arrays cons heap."
+    def setUp(self):
+        self.heap = ConsHeap()
+
+    def test_cons(self):
+        "Cons, car and cdr through handles."
+        one = make_fixnum(1)
+        big = make_fixnum(1 << 62)
+        sym = make_symbol("a")
+        tail = self.heap.cons(big, SCMTheEmptyList)
+        head = self.heap.cons(one, tail)
+        self.assertIs(self.heap.car(head), one)
+        self.assertEqual(self.heap.cdr(head), tail)
+        self.assertEqual(self.heap.car(tail), big)
+        self.assertIs(self.heap.cdr(tail), SCMTheEmptyList)
+        self.heap.set_car(tail, sym)
+        self.heap.set_cdr(head, head)
+        self.assertIs(self.heap.car(tail), sym)
+        self.assertEqual(self.heap.cdr(head), head)
+
+    def test_immediates(self):
+        "Fixnums are stored inline, other objects are shared."
+        self.heap.cons(make_fixnum(-5), SCMTheEmptyList)
+        self.heap.cons(make_fixnum(7), SCMTheEmptyList)
+        self.assertEqual(self.heap.car(0), make_fixnum(-5))
+        self.assertEqual(self.heap.objects, [SCMTheEmptyList])
+
+    def test_collect(self):
+        "Unreachable pairs are freed and reused, reachable ones kept."
+        garbage = self.heap.cons(make_string("x"), SCMTheEmptyList)
+        kept = self.heap.cons(make_fixnum(1), SCMTheEmptyList)
+        self.heap.set_cdr(kept, kept)
+        last = self.heap.cons(garbage, SCMTheEmptyList)
+        self.assertEqual(self.heap.collect([make_vector([kept])]),
+                         {garbage, last})
+        self.assertEqual(len(self.heap.cars), 2)
+        self.assertEqual(self.heap.objects, [])
+        self.assertEqual(self.heap.cdr(kept), kept)
+        self.assertEqual(self.heap.cons(SCMTheEmptyList, kept), garbage)
+        self.assertEqual(self.heap.collect([]), {garbage, kept})
+        self.assertEqual(len(self.heap.cars), 0)
+
+
+class TestNumericTower(EvalMixin, unittest.TestCase):
+    "Tests for flonums and rationals."
+
+    def test_read(self):
+        "Float and rational literals."
+        self.assertEqual(self.write("1.5"), "1.5")
+        self.assertEqual(self.write("-2.5e3"), "-2500.0")
+        self.assertEqual(self.write("1e-2"), "0.01")
+        self.assertEqual(self.write("6/4"), "3/2")
+        self.assertEqual(self.write("-4/2"), "-2")
+        self.assertRaises(Exception, self.eval, "1.2.3")
+        self.assertRaises(Exception, self.eval, "1/0")
+
+    def test_arithmetic(self):
+        "Mixed operands promote, exact results stay exact."
+        self.assertEqual(self.write("(+ 1 2)"), "3")
+        self.assertEqual(self.write("(+ 1 1/2)"), "3/2")
+        self.assertEqual(self.write("(+ 1/2 1/2)"), "1")
+        self.assertEqual(self.write("(+ 1 1/2 0.5)"), "2.0")
+        self.assertEqual(self.write("(- 1 0.5)"), "0.5")
+        self.assertEqual(self.write("(- 1.5 1/2 1)"), "0.0")
+        self.assertEqual(self.write("(* 2 1/3)"), "2/3")
+        self.assertEqual(self.write("(/ 6 4)"), "3/2")
+        self.assertEqual(self.write("(/ 6 3)"), "2")
+        self.assertEqual(self.write("(/ 4)"), "1/4")
+        self.assertEqual(self.write("(/ 1 2.0)"), "0.5")
+        self.assertRaises(Exception, self.eval, "(/ 1 0)")
+        self.assertIs(self.eval("(< 1/3 0.5 1)"), SCMTrue)
+        self.assertIs(self.eval("(> 1 1/2 0.25)"), SCMTrue)
+        self.assertIs(self.eval("(= 1/2 0.5)"), SCMTrue)
+        self.assertIs(self.eval("(= 1 1.5)"), SCMFalse)
+
+    def test_exactness(self):
+        "Conversions between exact and inexact numbers."
+        self.assertEqual(self.write("(exact->inexact 1/4)"), "0.25")
+        self.assertEqual(self.write("(inexact->exact 0.25)"), "1/4")
+        self.assertEqual(self.write("(inexact->exact 2.0)"), "2")
+        self.assertIs(self.eval("(exact? 1/2)"), SCMTrue)
+        self.assertIs(self.eval("(inexact? 1/2)"), SCMFalse)
+        self.assertIs(self.eval("(inexact? 0.5)"), SCMTrue)
+        self.assertIs(self.eval("(number? 1/2)"), SCMTrue)
+        self.assertIs(self.eval("(number? #t)"), SCMFalse)
+        self.assertIs(self.eval("(integer? 2.0)"), SCMTrue)
+        self.assertIs(self.eval("(integer? 2.5)"), SCMFalse)
+        self.assertIs(self.eval("(integer? 1/2)"), SCMFalse)
+        for exp in ["(+ 1 #t)", "(- 1 #f)", "(* 2 #t)", "(= 1 #t)",
+                    "(< #f 1)", "(> 1 #t)", "(quotient 1 #t)", '(+ 1 "a")']:
+            self.assertRaisesRegex(Exception, "Expected a number",
+                                   self.eval, exp)
+
+    def test_rounding(self):
+        "Rounding keeps exactness, round goes to even."
+        self.assertEqual(self.write("(floor -7/2)"), "-4")
+        self.assertEqual(self.write("(ceiling -7/2)"), "-3")
+        self.assertEqual(self.write("(truncate -3.7)"), "-3.0")
+        self.assertEqual(self.write("(round 5/2)"), "2")
+        self.assertEqual(self.write("(round 3.5)"), "4.0")
+        self.assertEqual(self.write("(floor 3)"), "3")
+
+    def test_sqrt_expt(self):
+        "Exact roots and powers where possible."
+        self.assertEqual(self.write("(sqrt 16)"), "4")
+        self.assertEqual(self.write("(sqrt 9/4)"), "3/2")
+        self.assertEqual(self.write("(sqrt 2.25)"), "1.5")
+        self.assertEqual(self.write("(sqrt 2)"), repr(2 ** 0.5))
+        self.assertRaises(Exception, self.eval, "(sqrt -1)")
+        self.assertEqual(self.write("(expt 2 100)"), str(2 ** 100))
+        self.assertEqual(self.write("(expt 2 -2)"), "1/4")
+        self.assertEqual(self.write("(expt 2/3 2)"), "4/9")
+        self.assertEqual(self.write("(expt 4 1/2)"), "2.0")
+        self.assertEqual(self.write("(expt 2.0 3)"), "8.0")
+        self.assertRaisesRegex(Exception, "Division by zero", self.eval,
+                               "(expt 0.0 -1)")
+        self.assertRaisesRegex(Exception, "Division by zero", self.eval,
+                               "(expt 0 -1.5)")
+
+    def test_integer_division(self):
+        "quotient and remainder take integral flonums, exactness is kept."
+        self.assertEqual(self.write("(quotient 7 2)"), "3")
+        self.assertEqual(self.write("(quotient 7.0 2)"), "3.0")
+        self.assertEqual(self.write("(remainder 7 2.0)"), "1.0")
+        self.assertIs(self.eval("(number? (quotient 7.0 2))"), SCMTrue)
+        self.assertRaisesRegex(Exception, "Expected an integer", self.eval,
+                               "(remainder 7.5 2)")
+        self.assertRaisesRegex(Exception, "Expected an integer", self.eval,
+                               "(quotient 1/2 2)")
+        self.assertRaisesRegex(Exception, "Division by zero", self.eval,
+                               "(quotient 1 0)")
+
+    def test_string(self):
+        "Conversions from and to strings."
+        self.assertEqual(self.eval('(number->string 3/4)'),
+                         make_string("3/4"))
+        self.assertEqual(self.eval('(number->string 0.5)'),
+                         make_string("0.5"))
+        self.assertEqual(self.write('(string->number "-1/2")'), "-1/2")
+        self.assertIs(self.eval('(string->number "abc")'), SCMFalse)
+        for text in ["1_000", " 12 ", "12\n", "inf", "1e", "1/2.0", "0x10"]:
+            self.assertIs(self.eval('(string->number "{}")'.format(text)),
+                          SCMFalse)
+        self.assertEqual(self.write('(string->number ".5e1")'), "5.0")
+        self.assertIs(self.eval('(string->number "1e400")'), SCMFalse)
+        self.assertRaises(Exception, self.eval, "1e400")
+
+
+class TestVector(EvalMixin, unittest.TestCase):
+    "Tests for vectors."
+
+    def test_read(self):
+        "Read vector literals."
+        vector = SCMRead(io.StringIO("#(1 #\\a (2))"))
+        self.assertTrue(is_vector(vector))
+        self.assertEqual(vector.value,
+                         [make_fixnum(1), make_character("a"),
+                          SCMConsObject(make_fixnum(2), SCMTheEmptyList)])
+        self.assertEqual(SCMRead(io.StringIO("#()")), make_vector([]))
+        self.assertEqual(self.eval("#(1 2)"),
+                         make_vector([make_fixnum(1), make_fixnum(2)]))
+
+    def test_access(self):
+        "Indexed access."
+        self.eval("(define v (make-vector 3 0))")
+        self.eval("(vector-set! v 1 'x)")
+        self.assertEqual(self.eval("(vector-ref v 1)"), make_symbol("x"))
+        self.assertEqual(self.eval("(vector-length v)"), make_fixnum(3))
+        self.assertRaises(Exception, self.eval, "(vector-ref v 3)")
+        self.assertRaisesRegex(Exception, "exact integer", self.eval,
+                               "(vector-ref v 1.0)")
+        for exp in ["(make-vector #t)", "(integer->char #t)",
+                    "(make-vector 1.0)"]:
+            self.assertRaisesRegex(Exception, "Expected an exact integer",
+                                   self.eval, exp)
+        self.eval("(vector-fill! v 7)")
+        self.assertEqual(self.write("(vector->list v)"), "(7 7 7)")
+
+    def test_conversion(self):
+        "Vectors and lists."
+        self.assertEqual(self.eval("(list->vector '(1 2))"),
+                         self.eval("(vector 1 2)"))
+        self.assertIs(self.eval("(vector? (vector))"), SCMTrue)
+        self.assertIs(self.eval("(vector? '(1))"), SCMFalse)
+
+    def test_vector_map(self):
+        "Map over vectors."
+        self.assertEqual(self.eval("(vector-map + #(1 2) #(10 20 30))"),
+                         self.eval("#(11 22)"))
+        self.assertEqual(
+            self.eval("(vector-map (lambda (x) (* x x)) #(1 2 3))"),
+            self.eval("#(1 4 9)"))
+
+    def test_write(self):
+        "Print a vector."
+        self.assertEqual(self.write("#(1 (2) #(3))"), "#(1 (2) #(3))")
+
+
+class TestNumVector(EvalMixin, unittest.TestCase):
+    "Tests for homogeneous numeric vectors."
+
+    def test_storage(self):
+        "Elements are stored unboxed in a contiguous buffer."
+        vector = self.eval("(make-f64vector 4 1)")
+        self.assertTrue(is_numvector(vector))
+        self.assertEqual(vector.value.itemsize, 8)
+        self.assertEqual(vector.value.tolist(), [1.0] * 4)
+        self.assertEqual(self.eval("(s64vector 1 2 3)").value.tolist(),
+                         [1, 2, 3])
+
+    def test_access(self):
+        "Element access."
+        self.eval("(define v (list->s64vector '(1 2 3)))")
+        self.eval("(s64vector-set! v 0 10)")
+        self.assertEqual(self.eval("(s64vector-ref v 0)"), make_fixnum(10))
+        self.assertEqual(self.eval("(s64vector-length v)"), make_fixnum(3))
+        self.assertEqual(self.write("(s64vector->list v)"), "(10 2 3)")
+        self.assertEqual(self.eval("(f64vector-ref (f64vector 1) 0)"),
+                         make_flonum(1.0))
+        self.assertRaises(Exception, self.eval, "(s64vector-ref v 3)")
+        self.assertIs(self.eval("(s64vector? v)"), SCMTrue)
+        self.assertIs(self.eval("(f64vector? v)"), SCMFalse)
+
+    def test_bulk(self):
+        "Bulk operations."
+        self.eval("(define a (s64vector 1 2 3))")
+        self.eval("(define b (s64vector 4 5 6))")
+        self.assertEqual(self.eval("(s64vector-add a b)"),
+                         self.eval("(s64vector 5 7 9)"))
+        self.assertEqual(self.eval("(s64vector-mul a b)"),
+                         self.eval("(s64vector 4 10 18)"))
+        self.assertEqual(self.eval("(s64vector-dot a b)"), make_fixnum(32))
+        self.assertEqual(self.eval("(s64vector-sum a)"), make_fixnum(6))
+        self.assertEqual(self.eval("(s64vector-min b)"), make_fixnum(4))
+        self.assertEqual(self.eval("(s64vector-max b)"), make_fixnum(6))
+        self.assertEqual(self.eval("(s64vector-scale a 3)"),
+                         self.eval("(s64vector 3 6 9)"))
+        self.assertEqual(self.eval("(s64vector-slice b 1 3)"),
+                         self.eval("(s64vector 5 6)"))
+        self.assertEqual(self.eval("(f64vector-scale (f64vector 1 2) 2)"),
+                         self.eval("(f64vector 2 4)"))
+        self.assertRaises(Exception, self.eval,
+                          "(s64vector-add a (s64vector 1))")
+
+
+class TestBytevector(EvalMixin, unittest.TestCase):
+    "Tests for bytevectors."
+
+    def test_read(self):
+        "Read bytevector literals."
+        bytevector = SCMRead(io.StringIO("#u8(1 2 255)"))
+        self.assertTrue(is_bytevector(bytevector))
+        self.assertEqual(bytevector.value, bytearray([1, 2, 255]))
+        self.assertRaises(Exception, SCMRead, io.StringIO("#u8(256)"))
+
+    def test_access(self):
+        "Byte access."
+        self.eval("(define b (make-bytevector 3 7))")
+        self.eval("(bytevector-u8-set! b 0 65)")
+        self.assertEqual(self.eval("(bytevector-u8-ref b 0)"), make_fixnum(65))
+        self.assertEqual(self.eval("(bytevector-length b)"), make_fixnum(3))
+        self.assertEqual(self.eval("b"), self.eval("(bytevector 65 7 7)"))
+        self.assertRaises(Exception, self.eval, "(bytevector-u8-ref b 3)")
+
+    def test_slice(self):
+        "Slices share bytes, copies do not."
+        self.eval("(define b (bytevector 1 2 3 4))")
+        self.eval("(define s (bytevector-slice b 1 3))")
+        self.eval("(define c (bytevector-copy b 1))")
+        self.eval("(bytevector-u8-set! s 0 20)")
+        self.assertEqual(self.eval("b"), self.eval("#u8(1 20 3 4)"))
+        self.assertEqual(self.eval("c"), self.eval("#u8(2 3 4)"))
+        self.assertEqual(self.eval("(bytevector-length s)"), make_fixnum(2))
+
+    def test_utf8(self):
+        "Strings and UTF-8."
+        self.assertEqual(self.eval("(string->utf8 \"\u03bb!\")"),
+                         self.eval("#u8(206 187 33)"))
+        self.assertEqual(self.eval("(utf8->string #u8(206 187 33) 0 2)"),
+                         make_string("\u03bb"))
+        self.assertRaisesRegex(Exception, "Invalid UTF-8 at byte 2",
+                               self.eval, "(utf8->string #u8(33 33 255) 1)")
+        self.assertRaisesRegex(Exception, "no UTF-8 encoding",
+                               string_to_utf8_proc,
+                               SCMCons(make_string("\ud800"), SCMTheEmptyList))
+
+
+class TestHashTable(EvalMixin, unittest.TestCase):
+    "Tests for hash tables."
+
+    def test_ref_set(self):
+        "Set, ref and delete."
+        self.eval("(define h (make-hash-table eq?))")
+        self.eval("(hash-table-set! h 'a 1)")
+        self.eval("(hash-table-set! h 'b 2)")
+        self.eval("(hash-table-set! h 'a 3)")
+        self.assertEqual(self.eval("(hash-table-ref h 'a)"), make_fixnum(3))
+        self.assertEqual(self.eval("(hash-table-count h)"), make_fixnum(2))
+        self.eval("(hash-table-delete! h 'a)")
+        self.assertIs(self.eval("(hash-table-contains? h 'a)"), SCMFalse)
+        self.assertRaises(Exception, self.eval, "(hash-table-ref h 'a)")
+        self.assertEqual(self.eval("(hash-table-ref h 'a (lambda () 0))"),
+                         make_fixnum(0))
+        self.assertEqual(self.eval("(hash-table-ref/default h 'b 0)"),
+                         make_fixnum(2))
+
+    def test_equivalence(self):
+        "Keys are compared by the equivalence of the table."
+        self.eval("(define e (make-equal-hash-table))")
+        self.eval("(define q (make-eq-hash-table))")
+        self.eval("(define s (make-string-hash-table))")
+        self.eval("(hash-table-set! e '(1 \"x\" #(2)) 'found)")
+        self.eval("(hash-table-set! q \"x\" 'found)")
+        self.eval("(hash-table-set! s \"x\" 'found)")
+        self.assertEqual(
+            self.eval("(hash-table-ref/default e '(1 \"x\" #(2)) #f)"),
+            make_symbol("found"))
+        self.assertIs(self.eval("(hash-table-ref/default q \"x\" #f)"),
+                      SCMFalse)
+        self.assertEqual(self.eval("(hash-table-ref/default s \"x\" #f)"),
+                         make_symbol("found"))
+        self.eval("(hash-table-set! q 100000 'n)")
+        self.assertEqual(self.eval("(hash-table-ref q 100000)"),
+                         make_symbol("n"))
+
+    def test_update_and_walk(self):
+        "Update and iteration."
+        self.eval("(define h (make-hash-table))")
+        self.eval("(hash-table-update! h 'n (lambda (x) (+ x 1)) (lambda () 0))")
+        self.eval("(hash-table-update! h 'n (lambda (x) (+ x 1)))")
+        self.assertEqual(self.write("(hash-table->alist h)"), "((n . 2))")
+        self.assertEqual(self.write("(hash-table-keys h)"), "(n)")
+        self.assertEqual(self.write("(hash-table-values h)"), "(2)")
+        self.eval("(define total 0)")
+        self.eval("(hash-table-walk h (lambda (k v) (set! total (+ total v))))")
+        self.assertEqual(self.eval("total"), make_fixnum(2))
+
+
+class TestStringProc(EvalMixin, unittest.TestCase):
+    "Tests for string operations, ropes and string builders."
+
+    def test_short(self):
+        "Short strings stay flat."
+        s = self.eval('(string-append "ab" "" "cd")')
+        self.assertIs(type(s), String)
+        self.assertEqual(s, make_string("abcd"))
+        self.assertEqual(self.eval('(substring "hello" 1 3)'),
+                         make_string("el"))
+        self.assertEqual(self.eval('(substring "hello" 2)'),
+                         make_string("llo"))
+        self.assertEqual(self.eval('(string-length "hello")'), make_fixnum(5))
+        self.assertEqual(self.eval('(string-ref "hello" 1)'),
+                         make_character("e"))
+        self.assertRaises(Exception, self.eval, '(string-ref "hello" 5)')
+        self.assertRaises(Exception, self.eval, '(substring "hello" 3 2)')
+
+    def test_rope(self):
+        "Long appends share their halves."
+        self.eval('(define chunk (make-string-builder))')
+        for _ in range(100):
+            self.eval('(string-builder-append! chunk "0123456789")')
+        self.eval('(define chunk (string-builder->string chunk))')
+        self.eval('(define (grow s n) (if (= n 0) s'
+                  ' (grow (string-append s chunk "!") (- n 1))))')
+        self.eval('(define s (grow "" 200))')
+        rope = self.eval('s')
+        expected = ("0123456789" * 100 + "!") * 200
+        self.assertIs(type(rope), Rope)
+        self.assertLessEqual(rope.depth, SCMRopeMaxDepth)
+        self.assertEqual(self.eval('(string-length s)'),
+                         make_fixnum(len(expected)))
+        self.assertEqual(self.eval('(string-ref s 1000)'),
+                         make_character("!"))
+        self.assertEqual(self.eval('(string-ref s 1012)'),
+                         make_character("1"))
+        self.assertEqual(self.eval('(substring s 995 1005)'),
+                         make_string(expected[995:1005]))
+        self.assertEqual(self.eval('(substring s 5 150000)').value,
+                         expected[5:150000])
+        self.assertEqual(rope.value, expected)
+        self.assertIs(self.eval('(string? s)'), SCMTrue)
+
+    def test_builder(self):
+        "Builders accumulate strings and characters."
+        self.eval('(define b (make-string-builder "a"))')
+        self.eval('(string-builder-append! b "bc" #\\d)')
+        self.assertEqual(self.eval('(string-builder-length b)'),
+                         make_fixnum(4))
+        self.assertEqual(self.eval('(string-builder->string b)'),
+                         make_string("abcd"))
+        self.eval('(string-builder-append! b "e")')
+        self.assertEqual(self.eval('(string-builder->string b)'),
+                         make_string("abcde"))
+        self.assertIs(self.eval('(string-builder? b)'), SCMTrue)
+        self.assertRaises(Exception, self.eval,
+                          '(string-builder-append! b 1)')
+
+
+class TestMap(EvalMixin, unittest.TestCase):
+    "Tests for persistent maps."
+
+    def test_persistent(self):
+        "Old versions are unchanged."
+        self.eval("(define m1 (map-assoc (make-map) 'a 1))")
+        self.eval("(define m2 (map-assoc m1 '(b) 2))")
+        self.eval("(define m3 (map-dissoc m2 'a))")
+        self.assertEqual(self.eval("(map-count m1)"), make_fixnum(1))
+        self.assertEqual(self.eval("(map-count m2)"), make_fixnum(2))
+        self.assertEqual(self.eval("(map-ref m2 '(b))"), make_fixnum(2))
+        self.assertIs(self.eval("(map-contains? m1 '(b))"), SCMFalse)
+        self.assertIs(self.eval("(map-contains? m3 'a)"), SCMFalse)
+        self.assertEqual(self.eval("(map-ref m3 'a 0)"), make_fixnum(0))
+        self.assertRaises(Exception, self.eval, "(map-ref m3 'a)")
+        self.assertEqual(self.write("(map->alist m3)"), "(((b) . 2))")
+
+    def test_bulk(self):
+        "Construction from an association list."
+        self.eval("(define m (alist->map '((a . 1) (b . 2) (a . 3))))")
+        self.assertEqual(self.eval("(map-count m)"), make_fixnum(2))
+        self.assertEqual(self.eval("(map-ref m 'a)"), make_fixnum(3))
+
+    def test_transient(self):
+        "Batch updates through a transient."
+        self.eval("(define m (alist->map '((a . 1))))")
+        self.eval("(define t (map-transient m))")
+        self.eval("(map-assoc! t 'b 2)")
+        self.eval("(map-dissoc! t 'a)")
+        self.eval("(define n (map-persistent! t))")
+        self.assertEqual(self.write("(map-keys n)"), "(b)")
+        self.assertEqual(self.write("(map-keys m)"), "(a)")
+        self.assertRaises(Exception, self.eval, "(map-assoc! t 'c 3)")
+
+    def test_hamt(self):
+        "Many keys, including colliding hashes."
+        items = [(i, i * i) for i in range(2000)] + [(-1, "a"), (-2, "b")]
+        persistent = hamt.from_items(items)
+        smaller = persistent.dissoc(5)
+        self.assertEqual(dict(persistent), dict(items))
+        self.assertEqual(len(smaller), len(items) - 1)
+        self.assertEqual(persistent.get(5), 25)
+        self.assertIsNone(smaller.get(5))
+
+
+class TestRecord(EvalMixin, unittest.TestCase):
+    "Tests for define-record-type."
+    def setUp(self):
+        super().setUp()
+        self.eval("(define-record-type point (make-point x y) point?"
+                  " (x point-x set-point-x!) (y point-y) (label point-label"
+                  " set-point-label!))")
+
+    def test_slots(self):
+        "Records are slotted objects."
+        p = self.eval("(make-point 1 2)")
+        self.assertIsInstance(p, Record)
+        self.assertFalse(hasattr(p, "__dict__"))
+        self.assertEqual(p.fields, ("x", "y", "label"))
+        self.assertIs(self.eval("point").value, type(p))
+
+    def test_procedures(self):
+        "Constructor, predicate, accessors and modifiers."
+        self.eval("(define p (make-point 1 2))")
+        self.assertIs(self.eval("(point? p)"), SCMTrue)
+        self.assertIs(self.eval("(point? 1)"), SCMFalse)
+        self.assertEqual(self.eval("(point-x p)"), make_fixnum(1))
+        self.assertEqual(self.eval("(point-y p)"), make_fixnum(2))
+        self.assertIs(self.eval("(point-label p)"), SCMFalse)
+        self.eval("(set-point-x! p 10)")
+        self.eval("(set-point-label! p 'origin)")
+        self.assertEqual(self.eval("(point-x p)"), make_fixnum(10))
+        self.assertEqual(self.eval("(point-label p)"), make_symbol("origin"))
+
+    def test_errors(self):
+        "Wrong arity and wrong record type."
+        self.eval("(define-record-type other (make-other a) other? (a other-a))")
+        self.assertRaises(Exception, self.eval, "(make-point 1)")
+        self.assertRaises(Exception, self.eval, "(make-point 1 2 3)")
+        self.assertRaises(Exception, self.eval, "(point-x (make-other 1))")
+        self.assertIs(self.eval("(point? (make-other 1))"), SCMFalse)
+        self.assertRaises(Exception, self.eval,
+                          "(define-record-type bad (make-bad z) bad? (a bad-a))")
+
+
+class TestFreeze(EvalMixin, unittest.TestCase):
+    "Tests for hash consing."
+
+    def test_shared(self):
+        "Equal subtrees are one object."
+        data = SCMReadFrozen(io.StringIO(
+            '(((port . 8080) "eu") ((port . 8080) "eu") (port . 8080))'))
+        first = SCMCar(data)
+        second = SCMCar(SCMCdr(data))
+        self.assertTrue(is_eq(first, second))
+        self.assertTrue(is_eq(SCMCar(first), SCMCar(SCMCdr(SCMCdr(data)))))
+        self.assertIs(SCMCar(SCMCdr(first)),
+                      freeze(SCMRead(io.StringIO('"eu"'))))
+        self.assertTrue(is_equal(data, SCMRead(io.StringIO(
+            '(((port . 8080) "eu") ((port . 8080) "eu") (port . 8080))'))))
+
+    def test_atoms(self):
+        "Distinct atoms are not merged."
+        data = SCMReadFrozen(io.StringIO("((1 . 0.0) (1 . -0.0))"))
+        self.assertIsNot(SCMCar(data), SCMCar(SCMCdr(data)))
+        data = SCMReadFrozen(io.StringIO("((#t) (1))"))
+        self.assertIsNot(SCMCar(data), SCMCar(SCMCdr(data)))
+
+    def test_immutable(self):
+        "Frozen pairs refuse set-car! and set-cdr!."
+        self.eval("(define l (freeze (list 1 2)))")
+        self.eval("(define m (list 1 2))")
+        self.assertIs(self.eval("(frozen? l)"), SCMTrue)
+        self.assertIs(self.eval("(frozen? m)"), SCMFalse)
+        self.assertRaises(Exception, self.eval, "(set-car! l 3)")
+        self.assertRaises(Exception, self.eval, "(set-cdr! l 3)")
+        self.eval("(set-car! m 3)")
+        self.assertEqual(self.write("m"), "(3 2)")
+
+    def test_circular(self):
+        "Circular data is refused."
+        self.eval("(define c (list 1 2))")
+        self.eval("(set-cdr! (cdr c) c)")
+        self.assertRaises(Exception, self.eval, "(freeze c)")
+        self.eval("(define d (list 1))")
+        self.eval("(set-car! d d)")
+        self.assertRaises(Exception, self.eval, "(freeze d)")
+        self.eval("(define s (list 1))")
+        self.assertIs(self.eval("(frozen? (freeze (list s s)))"), SCMTrue)
+
+    def test_weak(self):
+        "Frozen data nothing refers to is dropped from the tables."
+        if SCMHeapMode != "object":
+            self.skipTest("heap pairs are never freed")
+        data = SCMReadFrozen(io.StringIO('(weak-test "unique-string" 1.5)'))
+        pair = id(data)
+        self.assertTrue(is_frozen(data))
+        del data
+        gc.collect()
+        self.assertNotIn(pair, [id(obj) for obj in SCMHashConsTable.values()])
+        self.assertNotIn((String, "unique-string"), SCMHashConsTable)
+
+
+class TestSpecialForm(EvalMixin, unittest.TestCase):
+    "Tests for the special form table."
+
+    def test_define_special_form(self):
+        "New special forms plug into SCMEval."
+        def eval_when(exp, env):
+            if is_true(SCMEval(SCMCar(SCMCdr(exp)), env)):
+                return make_begin(SCMCdr(SCMCdr(exp))), env
+            return SCMFalse, None
+        define_special_form("test-when", eval_when, tail=True)
+        try:
+            self.assertEqual(self.eval("(test-when (< 1 2) 1 2)"),
+                             make_fixnum(2))
+            self.assertIs(self.eval("(test-when (< 2 1) undefined)"),
+                          SCMFalse)
+        finally:
+            del SCMSpecialForms[make_symbol("test-when")]
+
+    def test_values(self):
+        "Values of and and or are not evaluated again."
+        self.assertEqual(self.eval("(or #f 'a)"), make_symbol("a"))
+        self.assertIs(self.eval("(or (< 1 2) undefined)"), SCMTrue)
+        self.assertIs(self.eval("(and (< 2 1) undefined)"), SCMFalse)
+        self.assertIs(self.eval("(and)"), SCMTrue)
+        self.assertIs(self.eval("(or)"), SCMFalse)
+
+    def test_tail_call(self):
+        "Calls in tail position do not grow the python stack."
+        self.eval("(define (loop n) (if (= n 0) 'done (loop (- n 1))))")
+        self.assertEqual(self.eval("(loop 5000)"), make_symbol("done"))
+        self.eval("(define (count n) (cond ((= n 0) 'done)"
+                  " (else (let ((m (- n 1))) (begin (count m))))))")
+        self.assertEqual(self.eval("(count 5000)"), make_symbol("done"))
+
+
+class TestLexicalAddress(EvalMixin, unittest.TestCase):
+    "Tests for the lexical addressing pass."
+
+    def test_compile(self):
+        "Local references become slots, free ones global references."
+        lambda_ = compile_lambda(
+            SCMRead(io.StringIO("(x)")),
+            SCMRead(io.StringIO("((define y 1) (lambda (z) (+ x y z)))")),
+            ())
+        x, y, z = make_symbol("x"), make_symbol("y"), make_symbol("z")
+        self.assertEqual(lambda_.names, (x, y))
+        inner = SCMCar(SCMCdr(SCMCdr(lambda_.body)))
+        self.assertIs(type(inner), Lambda)
+        self.assertEqual(list_to_pylist(inner.body),
+                         [GlobalRef(make_symbol("+"), 2), LocalRef(x, 1, 0),
+                          LocalRef(y, 1, 1),
+                          LocalRef(z, 0, 0)])
+
+    def test_closures(self):
+        "Nested closures, let, set! and internal definitions."
+        self.eval("(define (make-counter start)"
+                  " (define count start)"
+                  " (lambda (step) (let ((old count))"
+                  " (set! count (+ count step)) old)))")
+        self.eval("(define c (make-counter 10))")
+        self.assertEqual(self.eval("(c 1)"), make_fixnum(10))
+        self.assertEqual(self.eval("(c 5)"), make_fixnum(11))
+        self.assertEqual(self.eval("(c 0)"), make_fixnum(16))
+        self.eval("(define (f x) (define (g) y) (define y (* x 2)) (g))")
+        self.assertEqual(self.eval("(f 4)"), make_fixnum(8))
+        self.eval("(define (h) (define z z) z)")
+        self.assertRaises(Exception, self.eval, "(h)")
+
+    def test_by_name(self):
+        "Code that was not compiled still finds locals by name."
+        def eval_unless(exp, env):
+            if is_true(SCMEval(SCMCar(SCMCdr(exp)), env)):
+                return SCMFalse, None
+            return make_begin(SCMCdr(SCMCdr(exp))), env
+        define_special_form("test-unless", eval_unless, tail=True)
+        try:
+            self.eval("(define (f x) (test-unless (< x 0) (define y x) y))")
+            self.assertEqual(self.eval("(f 1)"), make_fixnum(1))
+        finally:
+            del SCMSpecialForms[make_symbol("test-unless")]
+        self.eval("(define (g x) (define-record-type r (make-r a) r? (a r-a))"
+                  " (r-a (make-r x)))")
+        self.assertEqual(self.eval("(g 3)"), make_fixnum(3))
+
+
+class TestGlobalRef(EvalMixin, unittest.TestCase):
+    "Tests for cached references to global variables."
+
+    def test_cache(self):
+        "A reference keeps the cell it found."
+        self.eval("(define x 1)")
+        self.eval("(define (f) x)")
+        ref = self.eval("f").body
+        self.assertIs(type(ref), GlobalRef)
+        self.assertEqual(self.eval("(f)"), make_fixnum(1))
+        self.assertIs(ref.cell, SCMCar(self.env).value[make_symbol("x")])
+
+    def test_redefine(self):
+        "define and set! of a global are seen at once."
+        self.eval("(define (g) 1)")
+        self.eval("(define (f) (g))")
+        self.assertEqual(self.eval("(f)"), make_fixnum(1))
+        self.eval("(define (g) 2)")
+        self.assertEqual(self.eval("(f)"), make_fixnum(2))
+        self.eval("(define (h) (set! g 3))")
+        self.eval("(h)")
+        self.assertEqual(self.eval("g"), make_fixnum(3))
+        self.eval("(define (u) undefined)")
+        self.assertRaises(Exception, self.eval, "(u)")
+        self.eval("(define undefined 4)")
+        self.assertEqual(self.eval("(u)"), make_fixnum(4))
+
+    def test_shadow(self):
+        "A new binding in a nearer frame invalidates the cache."
+        inner = SCMCons(make_dict_frame({}), self.env)
+        self.eval("(define x 1)")
+        self.eval("(define (f) x)", inner)
+        self.assertEqual(self.eval("(f)", inner), make_fixnum(1))
+        self.eval("(define x 2)", inner)
+        self.assertEqual(self.eval("(f)", inner), make_fixnum(2))
+
+    def test_other_environment(self):
+        "The same code run from another environment looks up again."
+        other = make_environment()
+        self.eval("(define x 1)")
+        self.eval("(define x 2)", other)
+        lambda_ = compile_lambda(SCMTheEmptyList,
+                                 SCMRead(io.StringIO("(x)")), ())
+        for env in (self.env, other):
+            define_variable(make_symbol("f"), make_closure(lambda_, env), env)
+        self.assertEqual(self.eval("(f)"), make_fixnum(1))
+        self.assertEqual(self.eval("(f)", other), make_fixnum(2))
+        self.assertEqual(self.eval("(f)"), make_fixnum(1))
+
+
+class TestFlatClosure(EvalMixin, unittest.TestCase):
+    "Tests for closures that capture only their free variables."
+
+    def test_capture(self):
+        "A nested closure keeps the variables it uses, not the frame."
+        self.eval("(define (f a b c) (lambda () b))")
+        closure = self.eval("(f 1 2 3)")
+        self.assertIs(closure.env, self.env)
+        self.assertEqual(closure.free, (make_fixnum(2),))
+        self.assertEqual(closure.body, FreeRef(make_symbol("b"), 0, False))
+        self.assertEqual(self.eval("((f 1 2 3))"), make_fixnum(2))
+
+    def test_nested(self):
+        "Variables used further in are captured by every lambda between."
+        self.eval("(define (f x) (lambda (y) (lambda (z) (+ x y z))))")
+        self.assertEqual(self.eval("(((f 1) 2) 3)"), make_fixnum(6))
+        self.assertEqual(self.eval("(f 1)").free, (make_fixnum(1),))
+
+    def test_box(self):
+        "Assigned captured variables are shared, others are not boxed."
+        self.eval("(define (make-counter)"
+                  " (define n 0)"
+                  " (cons (lambda () (set! n (+ n 1)) n) (lambda () n)))")
+        self.eval("(define c (make-counter))")
+        self.eval("((car c))")
+        self.eval("((car c))")
+        self.assertEqual(self.eval("((cdr c))"), make_fixnum(2))
+        self.assertIs(type(self.eval("(cdr c)").free[0]), Cell)
+        self.eval("(define (f x) (set! x (+ x 1)) x)")
+        self.assertEqual(self.eval("f").boxes, ())
+        self.assertEqual(self.eval("(f 1)"), make_fixnum(2))
+
+    def test_recursion(self):
+        "Internal definitions see each other and themselves."
+        self.eval("(define (f n)"
+                  " (define (even? n) (if (= n 0) #t (odd? (- n 1))))"
+                  " (define (odd? n) (if (= n 0) #f (even? (- n 1))))"
+                  " (even? n))")
+        self.assertEqual(self.eval("(f 10)"), SCMTrue)
+        self.assertEqual(self.eval("(f 7)"), SCMFalse)
+        self.eval("(define (g) (define (h) y) (h) (define y 1) y)")
+        self.assertRaises(Exception, self.eval, "(g)")
+
+    def test_chained(self):
+        "A form without a compiler keeps the enclosing frames."
+        define_special_form("test-quote", lambda exp, env: SCMCar(SCMCdr(exp)))
+        try:
+            self.eval("(define (f x) (lambda () (test-quote 1) x))")
+            closure = self.eval("(f 1)")
+            self.assertIsNot(closure.env, self.env)
+            self.assertEqual(self.eval("((f 1))"), make_fixnum(1))
+        finally:
+            del SCMSpecialForms[make_symbol("test-quote")]
+
+
+class TestHeapMode(unittest.TestCase):
+    "Behaviour with SCHEME_HEAP=soa, run in a fresh interpreter."
+    def run_soa(self, code):
+        "Output of code run with schemev19 imported in soa heap mode."
+        return run_in_mode(code, SCHEME_HEAP="soa")
+
+    def test_write(self):
+        "Pairs print as lists, not as their handles."
+        out = self.run_soa(
+            "import io\n"
+            "env = make_environment()\n"
+            "for s in [\"'(1 (2 3) . 4)\", \"#(1 (2) #(3))\"]:\n"
+            "    SCMWrite(SCMEval(SCMRead(io.StringIO(s)), env))\n"
+            "    print()\n")
+        self.assertEqual(out, "(1 (2 3) . 4)\n#(1 (2) #(3))\n")
+
+    def test_lists(self):
+        "Lists made from argument lists are in the heap."
+        out = self.run_soa(
+            "import io\n"
+            "env = make_environment()\n"
+            "def run(s):\n"
+            "    return SCMEval(SCMRead(io.StringIO(s)), env)\n"
+            "run('(define (rest . xs) xs)')\n"
+            "for s in ['(list 1 2)', '(rest 1 2)', '(apply list 1 (list 2))',\n"
+            "          '(apply rest 1 2 (list 3))']:\n"
+            "    value = run(s)\n"
+            "    print(type(value) is int, type(SCMCdr(value)) is int, end=' ')\n"
+            "    SCMWrite(value)\n"
+            "    print()\n")
+        self.assertEqual(out, "True True (1 2)\nTrue True (1 2)\n"
+                              "True True (1 2)\nTrue True (1 2 3)\n")
+
+    def test_collect(self):
+        "Pairs the environment does not reach are freed and reused."
+        out = self.run_soa(
+            "import io\n"
+            "env = make_environment()\n"
+            "def run(s):\n"
+            "    return SCMEval(SCMRead(io.StringIO(s)), env)\n"
+            "run('(define kept (list 1 (vector (list 2)) (freeze (list 3))))')\n"
+            "run('(define (loop n) (if (= n 0) (freeze (list 4))"
+            " (begin (list n n) (loop (- n 1)))))')\n"
+            "run('(loop 1000)')\n"
+            "size = len(SCMHeap.cars)\n"
+            "tables = len(SCMFrozenPairs), len(SCMHashConsTable)\n"
+            "print(SCMCollect([env]) > 2000, len(SCMHeap.cars) < size)\n"
+            "print(len(SCMFrozenPairs) < tables[0],"
+            " len(SCMHashConsTable) < tables[1])\n"
+            "SCMWrite(run('kept'))\n"
+            "print('', run('(frozen? (car (cdr (cdr kept))))') is SCMTrue)\n"
+            "SCMCollect([env])\n"
+            "size = len(SCMHeap.cars)\n"
+            "run('(loop 10)')\n"
+            "print(size == len(SCMHeap.cars))\n")
+        self.assertEqual(out, "True True\nTrue True\n(1 #((2)) (3)) True\n"
+                              "True\n")
+
+    def test_pair_equal(self):
+        "Pair objects compare equal to handles of the same list."
+        out = self.run_soa(
+            "import io\n"
+            "data = SCMRead(io.StringIO('(1 (2) . 3)'))\n"
+            "pair = SCMConsObject(make_fixnum(1), SCMCdr(data))\n"
+            "other = SCMConsObject(make_fixnum(2), SCMCdr(data))\n"
+            "print(pair == data, data == pair, pair == other, pair == SCMTheEmptyList)\n")
+        self.assertEqual(out, "True True False False\n")
+
+    def test_calls(self):
+        "Procedure calls leave nothing behind in the heap."
+        out = self.run_soa(
+            "import io\n"
+            "env = make_environment()\n"
+            "def run(s):\n"
+            "    return SCMEval(SCMRead(io.StringIO(s)), env)\n"
+            "run('(define (loop n) (if (= n 0) (quote done) (loop (- n 1))))')\n"
+            "run('(loop 1)')\n"
+            "exp = SCMRead(io.StringIO('(loop 10000)'))\n"
+            "size = len(SCMHeap.cars), len(SCMHeap.objects)\n"
+            "SCMWrite(SCMEval(exp, env))\n"
+            "print('', size == (len(SCMHeap.cars), len(SCMHeap.objects)))\n")
+        self.assertEqual(out, "done True\n")
+
+
 class TestEqual(unittest.TestCase):
     def setUp(self):
         self.nums1 = SCMRead(io.StringIO("(1 1)"))
@@ -354,25 +1304,108 @@ class TestEqual(unittest.TestCase):
         self.assertIs(is_eq_proc(self.chars2), SCMFalse)
 
     def test_string_eq(self):
-        "Check `is_eq_proc` for strings."
-        self.assertIs(is_eq_proc(self.string1), SCMTrue)
+        "Check `is_eq_proc` for strings, which compares identity."
+        self.assertIs(is_eq_proc(self.string1), SCMFalse)
         self.assertIs(is_eq_proc(self.string2), SCMFalse)
+        string = SCMCar(self.string1)
+        self.assertIs(is_eq_proc(pylist_to_list([string, string])), SCMTrue)
+        self.assertIs(is_equal_proc(self.string1), SCMTrue)
+        self.assertIs(is_equal_proc(self.string2), SCMFalse)
 
     def test_not_eq(self):
         "Check type checking."
         self.assertIs(is_eq_proc(self.difftype), SCMFalse)
 
+    def test_eqv(self):
+        "Numbers by value and exactness."
+        env = make_environment()
+        eval_ = lambda s: SCMEval(SCMRead(io.StringIO(s)), env)
+        self.assertIs(eval_("(eqv? 100000000 100000000)"), SCMTrue)
+        self.assertIs(eval_("(eqv? 1/2 1/2)"), SCMTrue)
+        self.assertIs(eval_("(eqv? 1.5 1.5)"), SCMTrue)
+        self.assertIs(eval_("(eqv? 0.0 -0.0)"), SCMFalse)
+        self.assertIs(eval_("(eqv? 2 2.0)"), SCMFalse)
+        self.assertIs(eval_("(eqv? (list 1) (list 1))"), SCMFalse)
+        # SCHEME_QUOTE=frozen shares equal literals.
+        self.assertIs(eval_("(eqv? '(1) '(1))"),
+                      SCMTrue if SCMQuoteMode == "frozen" else SCMFalse)
+        self.assertIs(eval_("(eq? 'a 'a)"), SCMTrue)
+
+    def test_equal(self):
+        "Structural equality, deep and circular data."
+        env = make_environment()
+        eval_ = lambda s: SCMEval(SCMRead(io.StringIO(s)), env)
+        self.assertIs(eval_('(equal? \'(1 (2 #(3 "x")) . 4)'
+                            ' \'(1 (2 #(3 "x")) . 4))'), SCMTrue)
+        self.assertIs(eval_("(equal? '(1 (2 3)) '(1 (2 4)))"), SCMFalse)
+        self.assertIs(eval_("(equal? #(1 2) #(1 2 3))"), SCMFalse)
+        self.assertIs(eval_("(equal? 2 2.0)"), SCMFalse)
+        deep1, deep2 = SCMTheEmptyList, SCMTheEmptyList
+        for _ in range(100000):
+            deep1 = SCMCons(deep1, SCMTheEmptyList)
+            deep2 = SCMCons(deep2, SCMTheEmptyList)
+        self.assertTrue(is_equal(deep1, deep2))
+        self.assertFalse(is_eq(deep1, deep2))
+        eval_("(define c1 (list 1 2))")
+        eval_("(set-cdr! (cdr c1) c1)")
+        eval_("(define c2 (list 1 2 1 2))")
+        eval_("(set-cdr! (cdr (cdr (cdr c2))) c2)")
+        self.assertIs(eval_("(equal? c1 c2)"), SCMTrue)
+        eval_("(set-car! c2 3)")
+        self.assertIs(eval_("(equal? c1 c2)"), SCMFalse)
+        self.assertIs(eval_("(equal? (freeze '(1 2)) (freeze '(1 2)))"),
+                      SCMTrue)
+        self.assertIs(eval_("(equal? (freeze '(1 2)) (freeze '(1 3)))"),
+                      SCMFalse)
+        for item in ["(vector 1)", "(bytevector 1)", "(f64vector 1)",
+                     '(string-append "{}" "b")'.format("a" * 1024)]:
+            self.assertIs(eval_("(equal? (freeze (list {0}))"
+                                " (freeze (list {0})))".format(item)),
+                          SCMTrue)
+
 
 class TestCompoundProc(unittest.TestCase):
     "Tests for compound proc."
 
     def test_make_compound_proc(self):
         "Make a compound proc"
-        comproc = make_compound_proc("parameters", "body", "env")
+        comproc = make_compound_proc(SCMRead(io.StringIO("(a b . c)")),
+                                     SCMRead(io.StringIO("((+ a b))")),
+                                     "env")
         self.assertTrue(isinstance(comproc, SCMObject))
-        self.assertEqual(comproc.data.value["parameters"], "parameters")
-        self.assertEqual(comproc.data.value["body"], "body")
-        self.assertEqual(comproc.data.value["env"], "env")
+        self.assertTrue(is_equal(comproc.parameters,
+                                 SCMRead(io.StringIO("(a b c)"))))
+        a, b, c = make_symbol("a"), make_symbol("b"), make_symbol("c")
+        self.assertEqual(list_to_pylist(comproc.body),
+                         [GlobalRef(make_symbol("+"), 1), LocalRef(a, 0, 0),
+                          LocalRef(b, 0, 1)])
+        self.assertEqual(comproc.names, (a, b, c))
+        self.assertEqual(comproc.env, "env")
+        self.assertEqual(comproc.arity, 2)
+        self.assertTrue(comproc.rest)
+
+    def test_body(self):
+        "Bodies with several expressions are wrapped in a begin once."
+        comproc = make_compound_proc(SCMTheEmptyList,
+                                     SCMRead(io.StringIO("(1 2)")),
+                                     SCMTheGlobalEnvironment)
+        self.assertTrue(is_equal(comproc.body,
+                                 SCMRead(io.StringIO("(begin 1 2)"))))
+
+    def test_eval(self):
+        "Rest arguments, names and arity."
+        env = make_environment()
+        SCMEval(SCMRead(io.StringIO("(define (f a . b) b)")), env)
+        self.assertTrue(is_equal(
+            SCMEval(SCMRead(io.StringIO("(f 1 2 3)")), env),
+            SCMRead(io.StringIO("(2 3)"))))
+        self.assertIs(SCMEval(SCMRead(io.StringIO("(f 1)")), env),
+                      SCMTheEmptyList)
+        self.assertTrue(is_equal(SCMEval(SCMRead(io.StringIO(
+            "((lambda args args) 1 2)")), env), SCMRead(io.StringIO("(1 2)"))))
+        self.assertEqual(SCMEval(make_symbol("f"), env).name, "f")
+        self.assertRaises(Exception, SCMEval,
+                          SCMRead(io.StringIO("(f)")), env)
 
 
 class TestLambda(unittest.TestCase):
@@ -380,6 +1413,7 @@ class TestLambda(unittest.TestCase):
     def setUp(self):
         self.lambdaproc = make_lambda("parameters", "body")
 
+    @needs_pair_objects
     def test_lambda(self):
         "Test for lambda."
         lambda_ = make_lambda("parameters", "body")
@@ -404,6 +1438,7 @@ class TestDefinition(unittest.TestCase):
         self.assertEqual(definition_variable(self.define),
                          make_symbol("add1"))
 
+    @needs_pair_objects
     def test_def_val(self):
         "Test definition value"
         self.assertEqual(definition_value(self.define),
@@ -423,12 +1458,12 @@ class TestExp(unittest.TestCase):
     def test_first_exp(self):
         "Test first exp"
         self.assertEqual(first_exp(self.seq),
-                         SCMCons("qwer", "asdf"))
+                         SCMConsObject("qwer", "asdf"))
 
     def test_rest_exp(self):
         "Test rest exp"
         self.assertEqual(rest_exp(self.seq),
-                         SCMCons("asdf", SCMTheEmptyList))
+                         SCMConsObject("asdf", SCMTheEmptyList))
 
 
 class TestBegin(unittest.TestCase):
@@ -437,6 +1472,7 @@ class TestBegin(unittest.TestCase):
         self.beginexp = SCMRead(io.StringIO("(begin 1 2 3)"))
         self.beginactions = SCMRead(io.StringIO("(1 2 3)"))
 
+    @needs_pair_objects
     def test_begin(self):
         "Test for begin"
         self.assertEqual(self.beginexp, make_begin(self.beginactions))
@@ -446,6 +1482,7 @@ class TestBegin(unittest.TestCase):
         self.assertTrue(is_begin(self.beginexp))
         self.assertFalse(is_begin(self.beginactions))
 
+    @needs_pair_objects
     def test_begin_actions(self):
         "Test for `begin_actions`."
         self.assertEqual(begin_actions(self.beginexp),
@@ -470,6 +1507,7 @@ class TestCond(unittest.TestCase):
         self.clauses = cond_clauses(self.condexp)
         self.clauses_e = SCMRead(io.StringIO("(((< 1 2) #t) ((= 1 2) #f) (else \"else\"))"))
 
+    @needs_pair_objects
     def test_make_if(self):
         "Test for `make_if` which is used to convert a condition to if."
         self.assertEqual(make_if(self.pred1, self.conseq1, self.alt1),
@@ -480,15 +1518,18 @@ class TestCond(unittest.TestCase):
         self.assertTrue(is_cond(self.condexp))
         self.assertFalse(is_cond(self.ifexp))
 
+    @needs_pair_objects
     def test_cond_clauses(self):
         "Test for `cond_clauses`."
         self.assertEqual(self.clauses, self.clauses_e)
 
+    @needs_pair_objects
     def test_cond_predicate(self):
         "Test for `cond_predicate`."
         self.assertEqual(cond_predicate(SCMCar(self.clauses)),
                          self.pred1)
 
+    @needs_pair_objects
     def test_cond_actions(self):
         "Test for `cond_actions`."
         clause = SCMCar(self.clauses)
@@ -501,6 +1542,7 @@ class TestCond(unittest.TestCase):
         self.assertTrue(is_cond_else_clause(elseclause))
         self.assertFalse(is_cond_else_clause(SCMCar(self.clauses)))
 
+    @needs_pair_objects
     def test_sequence_to_exp(self):
         "Test for `sequence_to_exp`."
         lastseq = SCMRead(io.StringIO("((+ 1 1))"))
@@ -509,6 +1551,7 @@ class TestCond(unittest.TestCase):
         self.assertEqual(sequence_to_exp(lastseq), lastseq_1)
         self.assertTrue(is_begin(sequence_to_exp(self.clauses)))
 
+    @needs_pair_objects
     def test_expand_clauses(self):
         "Test for `expand_clauses`."
         nestedif = make_if(SCMRead(io.StringIO("(= 1 2)")),
@@ -533,6 +1576,7 @@ class TestLet(unittest.TestCase):
         self.binding = SCMRead(io.StringIO("(a 1)"))
         self.bindings = SCMRead(io.StringIO("((a 1) (b 2))"))
 
+    @needs_pair_objects
     def test_make_application(self):
         "Test for `make_application`."
         self.assertEqual(make_application(self.operater, self.operands),
@@ -543,10 +1587,12 @@ class TestLet(unittest.TestCase):
         self.assertTrue(is_let(self.letexp))
         self.assertFalse(is_let(self.app))
 
+    @needs_pair_objects
     def test_let_bindings(self):
         "Test for `let_bindings`."
         self.assertEqual(let_bindings(self.letexp), self.letbindings)
 
+    @needs_pair_objects
     def test_let_body(self):
         "Test for `let_body`."
         self.assertEqual(let_body(self.letexp), self.letbody)
@@ -559,26 +1605,31 @@ class TestLet(unittest.TestCase):
         "Test for `binding_argument`."
         self.assertEqual(binding_argument(self.binding), make_fixnum(1))
 
+    @needs_pair_objects
     def test_bindings_parameters(self):
         "Test for `bindings_parameters`."
         self.assertEqual(bindings_parameters(self.bindings),
                          SCMRead(io.StringIO("(a b)")))
 
+    @needs_pair_objects
     def test_bindings_arguments(self):
         "Test for `bindings_arguments`."
         self.assertEqual(bindings_arguments(self.bindings),
                          SCMRead(io.StringIO("(1 2)")))
 
+    @needs_pair_objects
     def test_let_parameters(self):
         "Test for `let_parameters`."
         self.assertEqual(let_parameters(self.letexp),
                          bindings_parameters(self.bindings))
 
+    @needs_pair_objects
     def test_let_arguments(self):
         "Test for `let_arguments`."
         self.assertEqual(let_arguments(self.letexp),
                          bindings_arguments(self.bindings))
 
+    @needs_pair_objects
     def test_let_to_application(self):
         "Test for `let_to_application`."
         lambdaexp = make_lambda(bindings_parameters(self.letbindings),
@@ -613,11 +1664,13 @@ class TestAndAndOr(unittest.TestCase):
         self.assertFalse(is_or(self.andexpt))
         self.assertFalse(is_or(self.andexpf))
 
+    @needs_pair_objects
     def test_and_tests(self):
         "Test for `and_tests`."
         self.assertEqual(and_tests(self.andexpt), self.andtestst)
         self.assertEqual(and_tests(self.andexpf), self.andtestsf)
 
+    @needs_pair_objects
     def test_or_tests(self):
         "Test for `or_tests`."
         self.assertEqual(or_tests(self.orexpt), self.ortestst)
@@ -644,6 +1697,7 @@ class TestApply(unittest.TestCase):
         "Test for `apply_operator`."
         self.assertEqual(apply_operator(self.arguments), self.applyop)
 
+    @needs_pair_objects
     def test_apply_operands(self):
         "Test for `apply_operands`."
         self.assertEqual(apply_operands(self.arguments), self.applyoprands)
@@ -669,15 +1723,36 @@ class TestEval(unittest.TestCase):
 
     def test_setup_environment(self):
         "Test for `setup_environment`."
-        self.assertEqual(SCMCar(setup_environment()), SCMCons(SCMTheEmptyList, SCMTheEmptyList))
+        self.assertEqual(SCMCar(setup_environment()), make_dict_frame({}))
         self.assertEqual(SCMCdr(setup_environment()),
                          SCMTheEmptyEnvironment)
 
+    def test_dict_frame(self):
+        "The global frame is a dict, local frames grow by name."
+        env = make_environment()
+        self.assertTrue(is_dict_frame(SCMCar(env)))
+        SCMEval(SCMRead(io.StringIO("(define x 1)")), env)
+        self.assertEqual(SCMCar(env).value[make_symbol("x")].value,
+                         make_fixnum(1))
+        SCMEval(SCMRead(io.StringIO("(set! x 2)")), env)
+        self.assertEqual(SCMEval(make_symbol("x"), env), make_fixnum(2))
+        local = extend_environment(SCMRead(io.StringIO("(a b)")),
+                                   SCMRead(io.StringIO("(1 2)")), env)
+        for i in range(10):
+            define_variable(make_symbol("v{}".format(i)), make_fixnum(i),
+                            local)
+        self.assertEqual(len(SCMCar(local).values), 12)
+        self.assertEqual(SCMEval(SCMRead(io.StringIO("(+ a b v3 x)")),
+                                 local), make_fixnum(8))
+        self.assertRaises(Exception, SCMEval,
+                          SCMRead(io.StringIO("v3")), env)
+
     def test_null_environment(self):
         "Test for `null_environment`."
         self.assertEqual(null_environment_proc(self.evalexp),
                          setup_environment())
 
+    @needs_pair_objects
     def test_eval_exp(self):
         "Test for `eval_expression`."
         self.assertEqual(eval_expression(self.arguments),